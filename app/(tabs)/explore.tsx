@@ -12,7 +12,7 @@ import {
   StyleSheet,
   View,
 } from "react-native";
-import MapView, { Marker, Polyline, Region } from "react-native-maps";
+import MapView, { Marker, Polyline, Region, UrlTile } from "react-native-maps";
 import { SafeAreaView, useSafeAreaInsets } from "react-native-safe-area-context";
 
 import {
@@ -31,7 +31,7 @@ import {
   type RoutePoint,
 } from "../../src/lib/location-task";
 
-import { createRoute, isAuthError } from "../../src/lib/api";
+import { createRoute, getHeatTiles, HeatTilesOut, isAuthError } from "../../src/lib/api";
 
 import { ThemedText } from "@/components/themed-text";
 import { ThemedView } from "@/components/themed-view";
@@ -204,6 +204,25 @@ export default function RecordScreen() {
     }, [])
   );
 
+  // mapa de calor de rutas públicas (la URL caduca: se pide al entrar)
+  const [heatTiles, setHeatTiles] = useState<HeatTilesOut | null>(null);
+
+  useFocusEffect(
+    React.useCallback(() => {
+      let active = true;
+
+      getHeatTiles()
+        .then((out) => {
+          if (active) setHeatTiles(out);
+        })
+        .catch(() => {});
+
+      return () => {
+        active = false;
+      };
+    }, [])
+  );
+
   // ✅ Sincroniza puntos del background y los mezcla con los de memoria (sin duplicados)
   async function syncFromBackground(): Promise<PuntoGPS[]> {
     try {
@@ -627,6 +646,17 @@ export default function RecordScreen() {
             if (grabando) setSiguiendo(false);
           }}
         >
+          {heatTiles && (
+            <UrlTile
+              urlTemplate={heatTiles.url_template}
+              minimumZ={heatTiles.min_zoom}
+              maximumNativeZ={heatTiles.max_zoom}
+              tileSize={256}
+              opacity={0.8}
+              zIndex={-1}
+            />
+          )}
+
           {coordenadas.length > 0 && (
             <Polyline coordinates={coordenadas} strokeWidth={5} />
           )}
@@ -8,7 +8,7 @@ import { ThemedText } from "@/components/themed-text";
 import { ThemedView } from "@/components/themed-view";
 import { useThemeColor } from "@/hooks/use-theme-color";
 
-import { getMyRoutes } from "@/src/lib/api";
+import { getMyStats } from "@/src/lib/api";
 
 /* ───────── helpers ───────── */
 
@@ -45,7 +45,8 @@ function isNotAuthenticatedError(e: unknown) {
 }
 
 export default function HomeScreen() {
-  const [rutas, setRutas] = useState<RouteListItem[]>([]);
+  const [total, setTotal] = useState(0);
+  const [ultima, setUltima] = useState<RouteListItem | null>(null);
   const [cargando, setCargando] = useState(true);
 
   // ✅ colores del tema (arregla modo claro sin tocar el oscuro)
@@ -59,18 +60,21 @@ export default function HomeScreen() {
     try {
       setCargando(true);
 
-      const data: any = await getMyRoutes();
-      const list: RouteListItem[] = Array.isArray(data) ? data : [];
-      setRutas(list);
+      // totales y última ruta ya calculados en el servidor
+      const stats = await getMyStats();
+      setTotal(stats?.route_count ?? 0);
+      setUltima(stats?.last_route ?? null);
     } catch (e) {
       // ✅ si no hay login, NO explotamos
       if (isNotAuthenticatedError(e)) {
-        setRutas([]);
+        setTotal(0);
+        setUltima(null);
         return;
       }
 
       // otros errores: dejamos vacío pero sin crashear
-      setRutas([]);
+      setTotal(0);
+      setUltima(null);
       // si quieres, aquí luego metemos un toast/alert con extractApiDetail()
     } finally {
       setCargando(false);
@@ -83,28 +87,16 @@ export default function HomeScreen() {
     }, [cargarRutas])
   );
 
-  const ultima = useMemo(() => {
-    if (!rutas || rutas.length === 0) return null;
-
-    const sorted = [...rutas].sort((a, b) => {
-      const ta = new Date(a.created_at ?? 0).getTime();
-      const tb = new Date(b.created_at ?? 0).getTime();
-      return tb - ta;
-    });
-
-    return sorted[0] ?? null;
-  }, [rutas]);
-
   const resumen = useMemo(() => {
     return {
-      total: rutas.length,
+      total,
       ultimaFecha: ultima?.created_at
         ? new Date(ultima.created_at).toLocaleString()
         : "—",
       ultimaDist: ultima ? formatoDistancia(ultima.distance_m ?? 0) : "—",
       ultimaDur: ultima ? formatoDuracion(ultima.duration_s ?? 0) : "—",
     };
-  }, [rutas, ultima]);
+  }, [total, ultima]);
 
   return (
     <ThemedView style={styles.screen}>
@@ -196,7 +196,9 @@ export default function FriendRequestsScreen() {
                   <View key={req.id} style={[styles.requestItem, { backgroundColor: subtleBg, borderColor: border }]}>
                     <View style={styles.requestInfo}>
                       <ThemedText style={styles.requestText}>
-                        {tab === "incoming" ? `De: Usuario ${req.from_user_id}` : `A: Usuario ${req.to_user_id}`}
+                        {tab === "incoming"
+                          ? `De: ${req.from_name ?? `Usuario ${req.from_user_id}`}`
+                          : `A: ${req.to_name ?? `Usuario ${req.to_user_id}`}`}
                       </ThemedText>
                       <ThemedText style={styles.requestDate}>
                         {new Date(req.created_at).toLocaleDateString()}
@@ -0,0 +1,59 @@
+"""
+Usuario autenticado ("principal") con caché por id.
+
+get_current_user se ejecuta en casi todas las peticiones; con la caché el
+camino normal es: verificar la firma del JWT y leer de memoria, sin ir a
+la BD ni ocupar una conexión del pool.
+"""
+import os
+from dataclasses import dataclass
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .cache import TTLCache
+
+AUTH_CACHE_TTL_S = float(os.getenv("AUTH_CACHE_TTL_S", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    Lo que los endpoints necesitan del usuario. No es un objeto ORM: se
+    puede compartir entre peticiones/sesiones sin problemas.
+    """
+    id: UUID
+    email: str
+    name: str
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(id=user.id, email=user.email, name=user.name)
+
+
+principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl_s=AUTH_CACHE_TTL_S)
+
+
+async def load_principal(db: AsyncSession, user_id: UUID) -> Principal | None:
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    user = await db.scalar(select(models.User).where(models.User.id == user_id))
+    if not user:
+        return None
+
+    principal = Principal.from_user(user)
+    principal_cache.set(user_id, principal)
+    return principal
+
+
+def invalidate(user_id: UUID) -> None:
+    """
+    Llamar siempre que cambien los datos del usuario (nombre, email) o se
+    borre, para que no se sirva la copia antigua hasta que caduque.
+    """
+    principal_cache.delete(user_id)
@@ -0,0 +1,125 @@
+"""
+Compresión de respuestas según Accept-Encoding: br > zstd > gzip.
+
+Se apoya en los responders de starlette (mismo manejo de streaming,
+umbral de tamaño y tipos excluidos que GZipMiddleware) y solo cambia el
+compresor. brotli y zstandard son opcionales: si no están instalados se
+anuncia solo lo que haya.
+
+Las respuestas que salen comprimidas llevan el ETag débil (W/"..."): los
+bytes ya no son los de la versión sin comprimir, y un ETag fuerte no
+puede ser el mismo para los dos. If-None-Match compara en débil
+(httpcache.matches), así que los 304 siguen funcionando.
+"""
+import abc
+import os
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# niveles rápidos: el coste de CPU importa más que el último 5% de tamaño
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+# trozos más grandes se comprimen en un hilo para no bloquear el loop
+THREAD_MIN_BYTES = 128 * 1024
+
+
+class _ThreadedResponder(IdentityResponder, abc.ABC):
+    @abc.abstractmethod
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        ...
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= THREAD_MIN_BYTES:
+            return await anyio.to_thread.run_sync(self._compress_body, body, more_body)
+        return self._compress_body(body, more_body)
+
+
+class BrotliResponder(_ThreadedResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int):
+        super().__init__(app, minimum_size)
+        self._compressor = None
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        out = self._compressor.process(body)
+        return out + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+class ZstdResponder(_ThreadedResponder):
+    content_encoding = "zstd"
+
+    def __init__(self, app, minimum_size: int):
+        super().__init__(app, minimum_size)
+        self._compressor = None
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK if more_body else zstandard.COMPRESSOBJ_FLUSH_FINISH
+        return self._compressor.compress(body) + self._compressor.flush(mode)
+
+
+def _accepted(header: str) -> set[str]:
+    out = set()
+    for part in header.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            out.add(name)
+    return out
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accepted = _accepted(Headers(scope=scope).get("accept-encoding", ""))
+        if brotli is not None and "br" in accepted:
+            responder = BrotliResponder(self.app, self.minimum_size)
+        elif zstandard is not None and "zstd" in accepted:
+            responder = ZstdResponder(self.app, self.minimum_size)
+        elif "gzip" in accepted:
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=GZIP_LEVEL)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+
+        async def send_weak_etag(message):
+            # Content-Encoding puesto por el responder (no por la app)
+            if message["type"] == "http.response.start" and not responder.content_encoding_set:
+                headers = MutableHeaders(raw=message["headers"])
+                etag = headers.get("etag")
+                if etag and "content-encoding" in headers and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+            await send(message)
+
+        await responder(scope, receive, send_weak_etag)
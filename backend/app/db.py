@@ -1,7 +1,14 @@
 import os
+
 from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+from . import poolstats
+
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
 
 if not DATABASE_URL:
@@ -13,13 +20,64 @@ if DATABASE_URL.startswith("postgresql://") and "sslmode=" not in DATABASE_URL:
     join_char = "&" if "?" in DATABASE_URL else "?"
     DATABASE_URL = f"{DATABASE_URL}{join_char}sslmode=require"
 
+# ------------------------
+# Pool (configurable por entorno)
+# ------------------------
+# DB_POOL_SIZE / DB_MAX_OVERFLOW son el presupuesto del proceso entero y
+# se reparten entre el engine sync y el async (DB_ASYNC_POOL_SHARE para el
+# async, el resto para el sync: endpoints sync y hilos de imports.py y
+# segments.py). Máximo de conexiones a Postgres:
+#   workers de uvicorn x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# y tiene que quedar por debajo de max_connections (o del límite del
+# pooler de Supabase) con margen para migraciones y scripts.
+# DB_POOL_FRESHNESS decide cómo evitamos conexiones muertas:
+#   pre_ping -> SELECT 1 en cada checkout (lo más seguro, un round-trip más)
+#   recycle  -> se cierran las conexiones con más de DB_POOL_RECYCLE_S segundos
+#   none     -> nada; solo la invalidación por error de SQLAlchemy (al
+#               detectar una desconexión se descarta el pool entero)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "6"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "4"))
+DB_ASYNC_POOL_SHARE = float(os.getenv("DB_ASYNC_POOL_SHARE", "0.5"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+DB_POOL_FRESHNESS = os.getenv("DB_POOL_FRESHNESS", "pre_ping").strip().lower()
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", "300"))
+
+if DB_POOL_FRESHNESS not in ("pre_ping", "recycle", "none"):
+    raise RuntimeError(f"DB_POOL_FRESHNESS no válido: {DB_POOL_FRESHNESS}")
+# pool_size=0 en QueuePool es "sin límite": cada engine necesita al menos 1
+if DB_POOL_SIZE < 2 or DB_MAX_OVERFLOW < 0 or not 0 < DB_ASYNC_POOL_SHARE < 1:
+    raise RuntimeError("DB_POOL_SIZE >= 2, DB_MAX_OVERFLOW >= 0 y 0 < DB_ASYNC_POOL_SHARE < 1")
+
+
+def _split(total: int, minimum: int) -> tuple[int, int]:
+    """
+    (sync, async) que suman `total`, cada uno con al menos `minimum`.
+    """
+    async_n = min(max(minimum, round(total * DB_ASYNC_POOL_SHARE)), total - minimum)
+    return total - async_n, async_n
+
+
+POOL_SIZES = dict(zip(("sync", "async"), zip(_split(DB_POOL_SIZE, 1), _split(DB_MAX_OVERFLOW, 0))))
+
+
+def pool_kwargs(kind: str) -> dict:
+    pool_size, max_overflow = POOL_SIZES[kind]
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT_S,
+        "pool_pre_ping": DB_POOL_FRESHNESS == "pre_ping",
+        "pool_recycle": DB_POOL_RECYCLE_S if DB_POOL_FRESHNESS == "recycle" else -1,
+    }
+
+
 engine = create_engine(
     DATABASE_URL,
-    pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=5,
+    poolclass=poolstats.InstrumentedQueuePool,
     future=True,
+    **pool_kwargs("sync"),
 )
+poolstats.instrument("sync", engine)
 
 SessionLocal = sessionmaker(
     autocommit=False,
@@ -29,9 +87,59 @@ SessionLocal = sessionmaker(
 
 Base = declarative_base()
 
+
+def dialect_insert(db):
+    """
+    insert() del dialecto de la sesión, para upserts (on_conflict_do_*):
+    Postgres en producción, SQLite en local/benchmark.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return pg_insert
+    return sqlite_insert
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+# ------------------------
+# Async (asyncpg / aiosqlite)
+# ------------------------
+def async_url(url: str) -> str:
+    """
+    Misma BD, driver async. asyncpg no entiende `sslmode`: lo pasamos a `ssl`.
+    """
+    u = make_url(url)
+
+    if u.get_backend_name() == "postgresql":
+        query = dict(u.query)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        u = u.set(drivername="postgresql+asyncpg", query=query)
+    elif u.get_backend_name() == "sqlite":
+        u = u.set(drivername="sqlite+aiosqlite")
+
+    return u.render_as_string(hide_password=False)
+
+
+async_engine = create_async_engine(
+    async_url(DATABASE_URL),
+    poolclass=poolstats.InstrumentedAsyncQueuePool,
+    **pool_kwargs("async"),
+)
+poolstats.instrument("async", async_engine.sync_engine)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+    class_=AsyncSession,
+)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
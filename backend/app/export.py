@@ -0,0 +1,201 @@
+"""
+Exportación de rutas a GPX, GeoJSON y CSV.
+
+Todo son generadores de bytes que escriben el path por tramos de
+CHUNK_POINTS puntos (formateados en bloque con numpy), pensados para
+StreamingResponse: nunca se monta el fichero entero ni la lista de dicts
+de puntos. El zip con todas las rutas de un usuario (`zip_stream`) lee
+las rutas de ZIP_FETCH en ZIP_FETCH y comprime mientras envía.
+"""
+import json
+import re
+import zipfile
+from typing import Iterable, Iterator
+from xml.sax.saxutils import escape
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session, undefer_group
+
+from . import models, pathcodec
+
+CHUNK_POINTS = 2000
+# rutas que se leen a la vez de la BD para el zip (con su path)
+ZIP_FETCH = 20
+
+FORMATS = ("gpx", "geojson", "csv")
+MEDIA_TYPES = {
+    "gpx": "application/gpx+xml",
+    "geojson": "application/geo+json",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _chunks(cols: dict[str, np.ndarray]) -> Iterator[dict[str, np.ndarray]]:
+    n = len(cols["lat"])
+    for start in range(0, n, CHUNK_POINTS):
+        yield {k: v[start:start + CHUNK_POINTS] for k, v in cols.items()}
+
+
+def _iso_times(t: np.ndarray) -> list[str | None]:
+    """
+    ms desde epoch -> "2024-05-01T10:00:00.000Z" (None si no hay tiempo).
+    """
+    ok = np.isfinite(t)
+    out: list[str | None] = [None] * len(t)
+    if ok.any():
+        stamps = np.datetime_as_string(t[ok].astype("datetime64[ms]"), unit="ms")
+        for i, s in zip(np.flatnonzero(ok).tolist(), stamps.tolist()):
+            out[i] = s + "Z"
+    return out
+
+
+def _fmt(values: np.ndarray, decimals: int) -> list[str]:
+    # NaN -> "" (CSV) ; el resto con precisión fija
+    return ["" if v != v else f"{v:.{decimals}f}" for v in values.tolist()]
+
+
+def filename(route, fmt: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", route.name or "").strip("-")[:60] or "ruta"
+    return f"{route.created_at:%Y-%m-%d}-{slug}-{str(route.id)[:8]}.{fmt}"
+
+
+# ------------------------
+# Escritores
+# ------------------------
+def gpx_chunks(route, cols: dict[str, np.ndarray]) -> Iterator[bytes]:
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx version="1.1" creator="rutas" xmlns="http://www.topografix.com/GPX/1/1">\n'
+        f"<trk><name>{escape(route.name or '')}</name><trkseg>\n"
+    ).encode()
+    for part in _chunks(cols):
+        lat, lon = _fmt(part["lat"], 7), _fmt(part["lon"], 7)
+        times = _iso_times(part["t"])
+        lines = [
+            f'<trkpt lat="{a}" lon="{o}"><time>{t}</time></trkpt>\n' if t else f'<trkpt lat="{a}" lon="{o}"/>\n'
+            for a, o, t in zip(lat, lon, times)
+        ]
+        yield "".join(lines).encode()
+    yield b"</trkseg></trk>\n</gpx>\n"
+
+
+def geojson_chunks(route, cols: dict[str, np.ndarray]) -> Iterator[bytes]:
+    """
+    Un Feature LineString; los tiempos van en properties.coordTimes (como
+    togeojson), escritos después de las coordenadas en una segunda pasada.
+    """
+    yield b'{"type":"Feature","geometry":{"type":"LineString","coordinates":['
+    first = True
+    for part in _chunks(cols):
+        coords = ",".join(f"[{o},{a}]" for a, o in zip(_fmt(part["lat"], 7), _fmt(part["lon"], 7)))
+        if coords:
+            yield (coords if first else "," + coords).encode()
+            first = False
+
+    props = json.dumps({"id": str(route.id), "name": route.name, "visibility": route.visibility})
+    yield f']}},"properties":{props[:-1]},"coordTimes":['.encode()
+    first = True
+    for part in _chunks(cols):
+        times = ",".join('"%s"' % t if t else "null" for t in _iso_times(part["t"]))
+        if times:
+            yield (times if first else "," + times).encode()
+            first = False
+    yield b"]}}\n"
+
+
+def csv_chunks(route, cols: dict[str, np.ndarray]) -> Iterator[bytes]:
+    yield b"lat,lon,time,accuracy_m,speed_ms\n"
+    for part in _chunks(cols):
+        rows = zip(
+            _fmt(part["lat"], 7),
+            _fmt(part["lon"], 7),
+            (t or "" for t in _iso_times(part["t"])),
+            _fmt(part["accuracy"], 1),
+            _fmt(part["speed"], 2),
+        )
+        yield "".join(",".join(row) + "\n" for row in rows).encode()
+
+
+WRITERS = {"gpx": gpx_chunks, "geojson": geojson_chunks, "csv": csv_chunks}
+
+
+def route_stream(route, fmt: str) -> Iterator[bytes]:
+    """
+    La ruta necesita path/path_blob cargados. Se decodifica aquí, dentro
+    del generador: StreamingResponse lo recorre en el threadpool.
+    """
+    yield from WRITERS[fmt](route, pathcodec.route_columns(route))
+
+
+# ------------------------
+# Zip de todas las rutas
+# ------------------------
+class _Sink:
+    """
+    Destino no seekable para ZipFile: acumula lo escrito hasta que el
+    generador lo recoge (zipfile usa entonces data descriptors).
+    """
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+def _owned_routes(db: Session, user_id) -> Iterable[models.Route]:
+    ids = db.scalars(
+        select(models.Route.id)
+        .where(models.Route.user_id == user_id)
+        .order_by(models.Route.created_at, models.Route.id)
+    ).all()
+    # de ZIP_FETCH en ZIP_FETCH: con path, pero sin tener miles en memoria
+    for start in range(0, len(ids), ZIP_FETCH):
+        batch = ids[start:start + ZIP_FETCH]
+        routes = db.scalars(
+            select(models.Route)
+            .options(undefer_group("path"))
+            .where(models.Route.id.in_(batch))
+            .order_by(models.Route.created_at, models.Route.id)
+        ).all()
+        yield from routes
+        db.expunge_all()
+
+
+def zip_stream(session_factory, user_id, fmt: str) -> Iterator[bytes]:
+    """
+    Abre su propia sesión: el generador sigue vivo después de que FastAPI
+    haya cerrado las dependencias de la petición.
+    """
+    sink = _Sink()
+    with session_factory() as db, zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        seen: set[str] = set()
+        for route in _owned_routes(db, user_id):
+            name = filename(route, fmt)
+            if name in seen:
+                name = f"{route.id}.{fmt}"
+            seen.add(name)
+            # zip no admite fechas anteriores a 1980
+            info = zipfile.ZipInfo(name, date_time=max(route.created_at.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with zf.open(info, "w", force_zip64=True) as entry:
+                for chunk in route_stream(route, fmt):
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # directorio central, al cerrar el ZipFile
+    yield sink.drain()
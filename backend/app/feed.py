@@ -0,0 +1,166 @@
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import and_, or_, select, delete
+from sqlalchemy.orm import Session, load_only
+
+from . import models
+
+FEED_MAX_LIMIT = 100
+
+
+# ------------------------
+# Cursor (keyset) "<created_at ISO>,<route uuid>"
+# ------------------------
+def encode_cursor(route: models.Route) -> str:
+    return f"{route.created_at.isoformat()},{route.id}"
+
+
+def decode_cursor(raw: str) -> tuple[datetime, UUID]:
+    """
+    Lanza ValueError si el cursor no tiene el formato esperado.
+    """
+    created_raw, _, id_raw = raw.strip().rpartition(",")
+    if not created_raw or not id_raw:
+        raise ValueError("Cursor inválido")
+    # "+" llega como espacio si el cliente no lo escapa en la query
+    return datetime.fromisoformat(created_raw.replace(" ", "+")), UUID(id_raw)
+
+
+def before_cursor(created_col, id_col, cursor: tuple[datetime, UUID] | None):
+    if cursor is None:
+        return None
+    created_at, route_id = cursor
+    return or_(
+        created_col < created_at,
+        and_(created_col == created_at, id_col < route_id),
+    )
+
+
+# ------------------------
+# Fan-out on write
+# ------------------------
+def _friend_ids(db: Session, user_id: UUID) -> list[UUID]:
+    return list(
+        db.scalars(select(models.Friend.friend_id).where(models.Friend.user_id == user_id))
+    )
+
+
+def fan_out_route(db: Session, route: models.Route) -> None:
+    """
+    (Re)calcula las entradas de timeline de una ruta. Idempotente: sirve
+    tanto al crear como cuando cambia la visibilidad. No hace commit.
+    """
+    db.execute(delete(models.FeedEntry).where(models.FeedEntry.route_id == route.id))
+
+    readers = [route.user_id]
+    if route.visibility in ("friends", "public"):
+        readers += _friend_ids(db, route.user_id)
+
+    db.add_all(
+        models.FeedEntry(
+            owner_id=reader_id,
+            route_id=route.id,
+            author_id=route.user_id,
+            created_at=route.created_at,
+        )
+        for reader_id in readers
+    )
+
+
+def backfill_friendship(db: Session, user_a: UUID, user_b: UUID) -> list[tuple[UUID, UUID]]:
+    """
+    Al aceptar una amistad, cada uno recibe en su timeline las rutas
+    no privadas del otro. Devuelve las entradas añadidas (lector, ruta).
+    No hace commit.
+    """
+    added = []
+    for reader_id, author_id in ((user_a, user_b), (user_b, user_a)):
+        already = select(models.FeedEntry.route_id).where(
+            models.FeedEntry.owner_id == reader_id,
+            models.FeedEntry.author_id == author_id,
+        )
+        rows = db.execute(
+            select(models.Route.id, models.Route.created_at).where(
+                models.Route.user_id == author_id,
+                models.Route.visibility.in_(("friends", "public")),
+                models.Route.id.not_in(already),
+            )
+        ).all()
+        db.add_all(
+            models.FeedEntry(
+                owner_id=reader_id,
+                route_id=route_id,
+                author_id=author_id,
+                created_at=created_at,
+            )
+            for route_id, created_at in rows
+        )
+        added += [(reader_id, route_id) for route_id, _ in rows]
+    return added
+
+
+def drop_route(db: Session, route_id: UUID) -> None:
+    """
+    Igual que el ON DELETE CASCADE, pero explícito (SQLite no aplica FKs
+    por defecto). No hace commit.
+    """
+    db.execute(delete(models.FeedEntry).where(models.FeedEntry.route_id == route_id))
+
+
+# ------------------------
+# Lectura
+# ------------------------
+def read_feed(
+    db: Session,
+    user_id: UUID,
+    limit: int,
+    cursor: tuple[datetime, UUID] | None = None,
+) -> list[models.Route]:
+    """
+    Mezcla dos lecturas acotadas por índice:
+      - timeline propio (feed_entries, owner_id + created_at)
+      - rutas públicas (routes, visibility + created_at)
+    y se queda con las `limit` más recientes.
+    """
+    timeline = (
+        select(models.Route)
+        .join(models.FeedEntry, models.FeedEntry.route_id == models.Route.id)
+        .where(models.FeedEntry.owner_id == user_id)
+        .order_by(models.FeedEntry.created_at.desc(), models.FeedEntry.route_id.desc())
+        .limit(limit)
+    )
+    cond = before_cursor(models.FeedEntry.created_at, models.FeedEntry.route_id, cursor)
+    if cond is not None:
+        timeline = timeline.where(cond)
+
+    public = (
+        select(models.Route)
+        .where(models.Route.visibility == "public")
+        .order_by(models.Route.created_at.desc(), models.Route.id.desc())
+        .limit(limit)
+    )
+    cond = before_cursor(models.Route.created_at, models.Route.id, cursor)
+    if cond is not None:
+        public = public.where(cond)
+
+    merged: dict[UUID, models.Route] = {}
+    for route in list(db.scalars(timeline)) + list(db.scalars(public)):
+        merged[route.id] = route
+
+    ordered = sorted(merged.values(), key=lambda r: (r.created_at, r.id), reverse=True)
+    return ordered[:limit]
+
+
+def rebuild_all(db: Session) -> None:
+    """
+    Rellena feed_entries a partir de routes + friends (primer despliegue).
+    """
+    routes = db.scalars(
+        select(models.Route).options(
+            load_only(models.Route.user_id, models.Route.visibility, models.Route.created_at)
+        )
+    ).all()
+    for route in routes:
+        fan_out_route(db, route)
+    db.commit()
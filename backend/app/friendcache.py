@@ -0,0 +1,125 @@
+"""
+Caché de adyacencia de amistades: user_id -> frozenset de ids de amigos.
+
+Cada usuario tiene un número de versión que se incrementa cuando cambian
+sus amistades (aceptar una solicitud). Las entradas de la caché llevan la
+versión con la que se leyeron; si no coincide con la actual, se releen de
+la BD. Así una lectura que compite con un accept nunca deja un conjunto
+viejo pegado: como mucho vale hasta la siguiente consulta.
+
+Las versiones viven en un backend:
+  - local (por defecto): un dict en el proceso. Con varios workers cada
+    uno invalida solo lo suyo, por eso también hay TTL.
+  - redis: si FRIEND_CACHE_REDIS_URL está definido (y el paquete redis
+    instalado). Vale cualquier servidor que hable el protocolo.
+Los conjuntos en sí siempre se guardan en memoria del proceso.
+"""
+import os
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .cache import TTLCache
+
+FRIEND_CACHE_TTL_S = float(os.getenv("FRIEND_CACHE_TTL_S", "300"))
+FRIEND_CACHE_SIZE = int(os.getenv("FRIEND_CACHE_SIZE", "50000"))
+FRIEND_CACHE_REDIS_URL = os.getenv("FRIEND_CACHE_REDIS_URL", "")
+
+
+class LocalVersions:
+    name = "local"
+
+    def __init__(self):
+        self._versions: dict[UUID, int] = {}
+
+    async def get(self, user_id: UUID) -> int:
+        return self._versions.get(user_id, 0)
+
+    async def bump(self, user_ids) -> None:
+        for uid in user_ids:
+            self._versions[uid] = self._versions.get(uid, 0) + 1
+
+
+class RedisVersions:
+    name = "redis"
+
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(url)
+
+    @staticmethod
+    def _key(user_id: UUID) -> str:
+        return f"friends:v:{user_id}"
+
+    async def get(self, user_id: UUID) -> int:
+        raw = await self._redis.get(self._key(user_id))
+        return int(raw) if raw is not None else 0
+
+    async def bump(self, user_ids) -> None:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for uid in user_ids:
+                pipe.incr(self._key(uid))
+            await pipe.execute()
+
+
+def make_backend():
+    if FRIEND_CACHE_REDIS_URL:
+        try:
+            return RedisVersions(FRIEND_CACHE_REDIS_URL)
+        except ImportError:
+            print("FRIEND_CACHE_REDIS_URL definido pero falta el paquete redis; caché local")
+    return LocalVersions()
+
+
+class FriendCache:
+    def __init__(self, backend, maxsize: int, ttl_s: float):
+        self.backend = backend
+        self._sets = TTLCache(maxsize=maxsize, ttl_s=ttl_s)
+        self.stale = 0
+
+    async def friends_of(self, db: AsyncSession, user_id: UUID) -> frozenset[UUID]:
+        version = await self.backend.get(user_id)
+        hit = self._sets.get(user_id)
+        if hit is not None:
+            if hit[0] == version:
+                return hit[1]
+            self.stale += 1
+
+        ids = frozenset(
+            (
+                await db.scalars(
+                    select(models.Friend.friend_id).where(models.Friend.user_id == user_id)
+                )
+            ).all()
+        )
+        self._sets.set(user_id, (version, ids))
+        return ids
+
+    async def are_friends(self, db: AsyncSession, user_id: UUID, other_id: UUID) -> bool:
+        return other_id in await self.friends_of(db, user_id)
+
+    async def invalidate(self, *user_ids: UUID) -> None:
+        """
+        Llamar después del commit que cambia las amistades.
+        """
+        await self.backend.bump(user_ids)
+        for uid in user_ids:
+            self._sets.delete(uid)
+
+    def stats(self) -> dict:
+        return {**self._sets.stats(), "stale": self.stale, "backend": self.backend.name}
+
+
+friend_cache = FriendCache(make_backend(), FRIEND_CACHE_SIZE, FRIEND_CACHE_TTL_S)
+
+
+def can_view(viewer_id: UUID, friend_ids: frozenset[UUID], route) -> bool:
+    """
+    Visibilidad de una ruta sabiendo ya los amigos del que mira (sin BD).
+    """
+    if route.user_id == viewer_id or route.visibility == "public":
+        return True
+    return route.visibility == "friends" and route.user_id in friend_ids
@@ -0,0 +1,267 @@
+"""
+Operaciones del grafo de amistad con las mínimas idas y vueltas a la BD:
+  - validar destinatarios de solicitudes (existe, ya amigos, pendiente en
+    un sentido u otro) en una sola consulta, para uno o varios nombres
+  - crear / aceptar / rechazar solicitudes en bloque
+  - listados con los nombres ya unidos
+Cada cambio deja su rastro para GET /sync (sync.py) en la misma
+transacción. Nada de aquí hace commit salvo `create_requests`.
+"""
+from dataclasses import dataclass
+from uuid import UUID
+
+from sqlalchemy import and_, delete, exists, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from . import feed, models, sync, usersearch
+
+MAX_BULK = 50
+# ids por petición en POST /routes/batch
+MAX_ROUTE_BATCH = 100
+
+Friend = models.Friend
+FriendRequest = models.FriendRequest
+User = models.User
+
+
+@dataclass
+class Target:
+    user_id: UUID
+    name: str
+    # None si se le puede enviar la solicitud; si no, el `detail` de la API
+    problem: str | None
+
+
+async def resolve_targets(db: AsyncSession, me: UUID, names: list[str]) -> dict[str, Target]:
+    """
+    Destinatarios por nombre normalizado, con su estado respecto a `me`.
+    Los nombres que no existen no aparecen en el resultado.
+    """
+    keys = sorted({usersearch.normalize(n) for n in names})
+    if not keys:
+        return {}
+
+    is_friend = exists().where(Friend.user_id == me, Friend.friend_id == User.id)
+    sent = exists().where(FriendRequest.from_user_id == me, FriendRequest.to_user_id == User.id)
+    received = exists().where(FriendRequest.from_user_id == User.id, FriendRequest.to_user_id == me)
+
+    rows = (
+        await db.execute(
+            select(
+                User.id,
+                User.name,
+                User.name_lower,
+                is_friend.label("is_friend"),
+                sent.label("sent"),
+                received.label("received"),
+            )
+            .where(User.name_lower.in_(keys))
+            # nombres repetidos: gana el usuario más antiguo
+            .order_by(User.created_at, User.id)
+        )
+    ).all()
+
+    out: dict[str, Target] = {}
+    for row in rows:
+        if row.name_lower in out:
+            continue
+        if row.id == me:
+            problem = "CANNOT_REQUEST_SELF"
+        elif row.is_friend:
+            problem = "ALREADY_FRIENDS"
+        elif row.sent:
+            problem = "REQUEST_ALREADY_SENT"
+        elif row.received:
+            problem = "REQUEST_ALREADY_RECEIVED"
+        else:
+            problem = None
+        out[row.name_lower] = Target(row.id, row.name, problem)
+    return out
+
+
+async def create_requests(db: AsyncSession, me: UUID, to_ids: list[UUID]) -> dict[UUID, models.FriendRequest]:
+    """
+    Inserta las solicitudes en un solo INSERT y hace commit. Si choca con
+    otra petición concurrente (uq_friend_request_pair) se reintenta de una
+    en una y las que chocan no aparecen en el resultado.
+    """
+    rows = [{"from_user_id": me, "to_user_id": to_id} for to_id in dict.fromkeys(to_ids)]
+    if not rows:
+        return {}
+
+    stmt = insert(FriendRequest).returning(FriendRequest)
+    try:
+        created = (await db.scalars(stmt, rows)).all()
+        await db.run_sync(sync.record, sync.request_changes((fr.id, fr.from_user_id, fr.to_user_id) for fr in created))
+        await db.commit()
+        return {fr.to_user_id: fr for fr in created}
+    except IntegrityError:
+        await db.rollback()
+
+    out = {}
+    for row in rows:
+        try:
+            fr = (await db.scalars(stmt, [row])).one()
+            await db.run_sync(sync.record, sync.request_changes([(fr.id, fr.from_user_id, fr.to_user_id)]))
+            await db.commit()
+            out[fr.to_user_id] = fr
+        except IntegrityError:
+            await db.rollback()
+    return out
+
+
+def _backfill(db: Session, pairs: list[tuple[UUID, UUID]]) -> None:
+    added = []
+    for a, b in pairs:
+        added += feed.backfill_friendship(db, a, b)
+    sync.record(db, sync.feed_changes(added))
+
+
+async def accept_pairs(db: AsyncSession, requests: list[tuple[UUID, UUID, UUID]]) -> None:
+    """
+    requests: (request_id, from_user_id, to_user_id). Crea las dos filas de
+    Friend de cada una en un solo INSERT, borra las solicitudes y rellena
+    los timelines. IntegrityError si alguna pareja ya era amiga.
+    """
+    if not requests:
+        return
+    pairs = [(a, b) for _, a, b in requests]
+    await db.execute(
+        insert(Friend),
+        [{"user_id": u, "friend_id": f} for a, b in pairs for u, f in ((a, b), (b, a))],
+    )
+    await db.execute(
+        delete(FriendRequest)
+        .where(FriendRequest.id.in_([rid for rid, _, _ in requests]))
+        .execution_options(synchronize_session=False)
+    )
+    await db.run_sync(sync.record, sync.friend_changes(pairs) + sync.request_changes(requests))
+    await db.run_sync(_backfill, pairs)
+
+
+async def accept_many(
+    db: AsyncSession, me: UUID, request_ids: list[UUID]
+) -> tuple[dict[UUID, str], list[UUID]]:
+    """
+    Acepta las solicitudes recibidas por `me`. Devuelve el estado de cada
+    id: "accepted", "ALREADY_FRIENDS" (la solicitud se borra igualmente) o
+    "REQUEST_NOT_FOUND" (no existe o no es para `me`), y los ids de los
+    nuevos amigos.
+    """
+    ids = list(dict.fromkeys(request_ids))
+    already = exists().where(
+        Friend.user_id == FriendRequest.from_user_id,
+        Friend.friend_id == FriendRequest.to_user_id,
+    )
+    rows = (
+        await db.execute(
+            select(FriendRequest.id, FriendRequest.from_user_id, FriendRequest.to_user_id, already.label("already"))
+            .where(FriendRequest.id.in_(ids), FriendRequest.to_user_id == me)
+        )
+    ).all()
+
+    result = {rid: "REQUEST_NOT_FOUND" for rid in ids}
+    stale = [r.id for r in rows if r.already]
+    fresh = [(r.id, r.from_user_id, r.to_user_id) for r in rows if not r.already]
+
+    if stale:
+        await db.execute(
+            delete(FriendRequest)
+            .where(FriendRequest.id.in_(stale))
+            .execution_options(synchronize_session=False)
+        )
+        await db.run_sync(
+            sync.record, sync.request_changes((r.id, r.from_user_id, r.to_user_id) for r in rows if r.already)
+        )
+    await accept_pairs(db, fresh)
+
+    result.update({rid: "ALREADY_FRIENDS" for rid in stale})
+    result.update({rid: "accepted" for rid, _, _ in fresh})
+    return result, [from_id for _, from_id, _ in fresh]
+
+
+async def reject_many(db: AsyncSession, me: UUID, request_ids: list[UUID]) -> set[UUID]:
+    """
+    Borra las solicitudes recibidas por `me` y devuelve los ids borrados.
+    """
+    deleted = (
+        await db.execute(
+            delete(FriendRequest)
+            .where(FriendRequest.id.in_(list(request_ids)), FriendRequest.to_user_id == me)
+            .returning(FriendRequest.id, FriendRequest.from_user_id, FriendRequest.to_user_id)
+            .execution_options(synchronize_session=False)
+        )
+    ).all()
+    await db.run_sync(sync.record, sync.request_changes(deleted))
+    return {row.id for row in deleted}
+
+
+def visible_routes_query(me: UUID):
+    """
+    Rutas que `me` puede ver, con las reglas de friendcache.can_view en
+    SQL: el LEFT JOIN con friends (clave primaria, como mucho una fila)
+    dice si el autor es amigo sin otra consulta.
+    """
+    Route = models.Route
+    return (
+        select(Route)
+        .outerjoin(Friend, and_(Friend.user_id == me, Friend.friend_id == Route.user_id))
+        .where(
+            or_(
+                Route.visibility == "public",
+                Route.user_id == me,
+                and_(Route.visibility == "friends", Friend.friend_id.is_not(None)),
+            )
+        )
+    )
+
+
+def requests_query(me: UUID, incoming: bool | None, ids: list[UUID] | None = None):
+    """
+    Solicitudes recibidas (incoming), enviadas (False) o ambas (None), con
+    from_name/to_name. `ids` las limita a esas (GET /sync).
+    """
+    sender, recipient = aliased(User), aliased(User)
+    if incoming is None:
+        mine = or_(FriendRequest.to_user_id == me, FriendRequest.from_user_id == me)
+    else:
+        mine = (FriendRequest.to_user_id if incoming else FriendRequest.from_user_id) == me
+    q = (
+        select(
+            FriendRequest.id,
+            FriendRequest.from_user_id,
+            FriendRequest.to_user_id,
+            FriendRequest.created_at,
+            sender.name.label("from_name"),
+            recipient.name.label("to_name"),
+        )
+        .join(sender, sender.id == FriendRequest.from_user_id)
+        .join(recipient, recipient.id == FriendRequest.to_user_id)
+        .where(mine)
+        .order_by(FriendRequest.created_at.desc())
+    )
+    if ids is not None:
+        q = q.where(FriendRequest.id.in_(ids))
+    return q
+
+
+def friends_query(me: UUID, ids: list[UUID] | None = None):
+    q = (
+        select(User.id, User.name)
+        .join(Friend, Friend.friend_id == User.id)
+        .where(Friend.user_id == me)
+        .order_by(User.name.asc())
+    )
+    if ids is not None:
+        q = q.where(User.id.in_(ids))
+    return q
+
+
+async def list_requests(db: AsyncSession, me: UUID, incoming: bool):
+    return (await db.execute(requests_query(me, incoming))).all()
+
+
+async def list_friends(db: AsyncSession, me: UUID):
+    return (await db.execute(friends_query(me))).all()
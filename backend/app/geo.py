@@ -0,0 +1,27 @@
+"""
+Utilidades geográficas vectorizadas (numpy).
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6_371_000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Distancia en metros entre pares de puntos (arrays o escalares, en grados).
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    h = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def segment_lengths_m(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Longitud de cada tramo consecutivo (len = n - 1).
+    """
+    if len(lat) < 2:
+        return np.zeros(0)
+    return haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
@@ -0,0 +1,118 @@
+"""
+Servicio de hashing de contraseñas fuera del threadpool de FastAPI.
+
+pbkdf2 es CPU puro: si se ejecuta en el threadpool de las peticiones, una
+ráfaga de logins lo ocupa entero y el resto de endpoints esperan. Aquí va
+a un executor propio y acotado:
+  - HASH_EXECUTOR = thread (por defecto; hashlib suelta el GIL) | process
+  - HASH_WORKERS  = hilos/procesos (por defecto nº de CPUs)
+  - HASH_MAX_PENDING = máximo de trabajos en curso + en cola; por encima
+    se rechaza con HashingBusy (la API responde 503) en vez de encolar sin fin
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import security
+
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "thread").strip().lower()
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(HASH_WORKERS * 8)))
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingService:
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_total_s = 0.0
+        self.queue_wait_max_s = 0.0
+        self.work_total_s = 0.0
+
+    def _get_executor(self) -> Executor:
+        # perezoso: no arrancamos procesos si nadie hace login
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="hashing"
+                    )
+            return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingBusy()
+            self.pending += 1
+
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        try:
+            started, result = await loop.run_in_executor(
+                self._get_executor(), _timed_call, fn, args
+            )
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+        finished = time.perf_counter()
+        # en modo process los relojes no son comparables: solo el total
+        wait = max(0.0, started - submitted) if self.kind == "thread" else 0.0
+        with self._lock:
+            self.completed += 1
+            self.queue_wait_total_s += wait
+            self.queue_wait_max_s = max(self.queue_wait_max_s, wait)
+            self.work_total_s += finished - submitted - wait
+        return result
+
+    async def hash_password(self, password: str) -> str:
+        return await self.run(security.hash_password, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> tuple[bool, str | None]:
+        return await self.run(security.verify_and_update, password, password_hash)
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "executor": self.kind,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "queue_wait_avg_ms": round(self.queue_wait_total_s * 1000 / done, 3),
+                "queue_wait_max_ms": round(self.queue_wait_max_s * 1000, 3),
+                "work_avg_ms": round(self.work_total_s * 1000 / done, 3),
+                "rounds": security.PBKDF2_ROUNDS,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def _timed_call(fn, args):
+    # se ejecuta en el worker: devolvemos cuándo empezó de verdad
+    started = time.perf_counter()
+    return started, fn(*args)
+
+
+hasher = HashingService(HASH_EXECUTOR, HASH_WORKERS, HASH_MAX_PENDING)
@@ -0,0 +1,269 @@
+"""
+Mapa de calor de las rutas públicas en tiles z/x/y (Web Mercator, como
+los tiles del mapa).
+
+  - Cada tile se divide en BINS x BINS celdas y cada celda cuenta cuántas
+    rutas públicas pasan por ella (una ruta cuenta una vez por celda).
+  - Se guarda para HEAT_MIN_ZOOM..HEAT_MAX_ZOOM; por encima, el cliente
+    reescala los tiles de HEAT_MAX_ZOOM (maxzoom de la fuente del mapa).
+  - Incremental: al crear una ruta pública, hacerla pública/privada o
+    borrarla se suman/restan sus celdas con upserts (`apply`), y sube la
+    versión de los tiles tocados. Servir un tile es leer como mucho
+    BINS * BINS filas, haya las rutas que haya.
+
+El cálculo de celdas (`route_bins`) es CPU puro y no toca la BD: en los
+endpoints async va al threadpool y `apply` se ejecuta con run_sync.
+
+Cada tile se sirve como JSON (celdas y cuentas, para quien quiera
+pintarlo) o como PNG de TILE_PX x TILE_PX (`render_png`), que es lo que
+entiende una capa de tiles del mapa (UrlTile). Los PNG no llevan
+Authorization (una capa de tiles no manda cabeceras): la URL lleva una
+clave firmada de security.create_tiles_key. Solo hay rutas públicas.
+"""
+import os
+import struct
+import zlib
+from collections import Counter
+
+import numpy as np
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.orm import Session, undefer_group
+
+from . import fastjson, models, pathcodec
+from .db import dialect_insert
+
+HEAT_MIN_ZOOM = int(os.getenv("HEAT_MIN_ZOOM", "2"))
+HEAT_MAX_ZOOM = int(os.getenv("HEAT_MAX_ZOOM", "14"))
+
+BIN_BITS = 6
+BINS = 1 << BIN_BITS  # 64 x 64 celdas por tile
+
+MAX_LAT = 85.05112878
+# tramos más largos (en celdas del zoom máximo) no se rellenan: son saltos
+# del GPS o huecos sin señal, no un camino recorrido
+MAX_FILL_STEPS = 64
+
+ZOOMS = range(HEAT_MIN_ZOOM, HEAT_MAX_ZOOM + 1)
+
+# un minuto sin revalidar: el mapa de calor puede ir un poco por detrás
+TILE_CACHE_CONTROL = "private, max-age=60"
+
+TILE_PX = 256
+# color de las celdas (naranja); la intensidad va en el alfa
+HEAT_RGB = (255, 80, 0)
+MIN_ALPHA, MAX_ALPHA = 70, 230
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return HEAT_MIN_ZOOM <= z <= HEAT_MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+# ------------------------
+# Ruta -> celdas
+# ------------------------
+def _global_bins(cols: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Coordenadas de celda globales en el zoom máximo, con los tramos entre
+    puntos rellenados para que una ruta con pocos puntos no deje huecos.
+    """
+    lat, lon = cols["lat"], cols["lon"]
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon = np.clip(lat[ok], -MAX_LAT, MAX_LAT), lon[ok]
+    if len(lat) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    scale = float(1 << (HEAT_MAX_ZOOM + BIN_BITS))
+    phi = np.radians(lat)
+    fx = (lon + 180.0) / 360.0 * scale
+    fy = (1.0 - np.log(np.tan(phi) + 1.0 / np.cos(phi)) / np.pi) / 2.0 * scale
+
+    if len(fx) > 1:
+        dx, dy = np.diff(fx), np.diff(fy)
+        steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64)
+        steps = np.where((steps < 1) | (steps > MAX_FILL_STEPS), 1, steps)
+        seg = np.repeat(np.arange(len(dx)), steps)
+        # posición dentro de cada tramo: 0, 1/n, ..., (n-1)/n
+        offsets = np.arange(len(seg)) - np.repeat(np.cumsum(steps) - steps, steps)
+        frac = offsets / steps[seg]
+        fx = np.append(fx[seg] + dx[seg] * frac, fx[-1])
+        fy = np.append(fy[seg] + dy[seg] * frac, fy[-1])
+
+    top = (1 << (HEAT_MAX_ZOOM + BIN_BITS)) - 1
+    gx = np.clip(np.floor(fx), 0, top).astype(np.int64)
+    gy = np.clip(np.floor(fy), 0, top).astype(np.int64)
+    return gx, gy
+
+
+def route_bins(cols: dict[str, np.ndarray]) -> list[tuple[int, int, int, int]]:
+    """
+    (z, x, y, bin) de cada celda por la que pasa la ruta, sin repetir,
+    ordenadas (mismo orden de bloqueo en todas las transacciones).
+    """
+    gx, gy = _global_bins(cols)
+    out = []
+    for z in ZOOMS:
+        shift = HEAT_MAX_ZOOM - z
+        keys = np.unique(((gx >> shift) << 32) | (gy >> shift))
+        cx, cy = keys >> 32, keys & 0xFFFFFFFF
+        tx, ty = cx >> BIN_BITS, cy >> BIN_BITS
+        b = (cy & (BINS - 1)) * BINS + (cx & (BINS - 1))
+        out += zip([z] * len(keys), tx.tolist(), ty.tolist(), b.tolist())
+    out.sort()
+    return out
+
+
+def route_bins_of(route) -> list[tuple[int, int, int, int]]:
+    """
+    Necesita path/path_blob cargados.
+    """
+    return route_bins(pathcodec.route_columns(route))
+
+
+# ------------------------
+# Escritura
+# ------------------------
+def apply(db: Session, bins: list[tuple[int, int, int, int]], delta: int) -> None:
+    """
+    Suma `delta` (+1 al publicar, -1 al retirar) a las celdas de una ruta
+    y sube la versión de sus tiles. No hace commit.
+    """
+    apply_counts(db, {b: delta for b in bins})
+
+
+def apply_counts(db: Session, deltas: dict[tuple[int, int, int, int], int]) -> None:
+    """
+    Igual que `apply` para varias rutas a la vez: celda -> cuánto sumar.
+    """
+    if not deltas:
+        return
+    insert = dialect_insert(db)
+
+    stmt = insert(models.HeatBin)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["z", "x", "y", "bin"],
+            set_={"count": models.HeatBin.count + stmt.excluded.count},
+        ),
+        [{"z": z, "x": x, "y": y, "bin": b, "count": deltas[z, x, y, b]} for z, x, y, b in sorted(deltas)],
+    )
+
+    tiles = sorted({(z, x, y) for z, x, y, _ in deltas})
+    if min(deltas.values()) < 0:
+        db.execute(
+            delete(models.HeatBin)
+            .where(tuple_(models.HeatBin.z, models.HeatBin.x, models.HeatBin.y).in_(tiles))
+            .where(models.HeatBin.count <= 0)
+            .execution_options(synchronize_session=False)
+        )
+
+    stmt = insert(models.HeatTile)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["z", "x", "y"],
+            set_={"version": models.HeatTile.version + 1},
+        ),
+        [{"z": z, "x": x, "y": y, "version": 1} for z, x, y in tiles],
+    )
+
+
+def rebuild(db: Session, batch_size: int = 200) -> int:
+    """
+    Recalcula todo desde las rutas públicas (primer despliegue, o si se
+    sospecha que los contadores se han desviado). Hace commit.
+    """
+    db.execute(delete(models.HeatBin))
+    # las versiones no se borran sino que suben todas: ningún ETag/caché
+    # anterior vuelve a casar, tampoco en tiles que se quedan vacíos
+    db.execute(update(models.HeatTile).values(version=models.HeatTile.version + 1))
+    last_id, done = None, 0
+    while True:
+        q = (
+            select(models.Route)
+            .options(undefer_group("path"))
+            .where(models.Route.visibility == "public")
+            .order_by(models.Route.id)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            q = q.where(models.Route.id > last_id)
+        routes = db.scalars(q).all()
+        if not routes:
+            break
+        deltas = Counter(b for route in routes for b in route_bins_of(route))
+        apply_counts(db, deltas)
+        done += len(routes)
+        last_id = routes[-1].id
+        db.commit()
+        db.expunge_all()
+    db.commit()
+    return done
+
+
+# ------------------------
+# Lectura
+# ------------------------
+def encode_tile(z: int, x: int, y: int, rows) -> bytes:
+    """
+    {"z", "x", "y", "size": BINS, "max", "cells": [fila*size+col...],
+    "counts": [...]} (solo celdas con rutas).
+    """
+    cells, counts = [], []
+    for b, count in rows:
+        cells.append(b)
+        counts.append(count)
+    return fastjson.dumps(
+        {"z": z, "x": x, "y": y, "size": BINS, "max": max(counts, default=0), "cells": cells, "counts": counts}
+    )
+
+
+def read_tile(db: Session, z: int, x: int, y: int) -> bytes:
+    rows = db.execute(
+        select(models.HeatBin.bin, models.HeatBin.count)
+        .where(models.HeatBin.z == z, models.HeatBin.x == x, models.HeatBin.y == y)
+        .order_by(models.HeatBin.bin)
+    ).all()
+    return encode_tile(z, x, y, rows)
+
+
+# ------------------------
+# PNG
+# ------------------------
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def render_png(rows) -> bytes:
+    """
+    (bin, count) -> PNG RGBA de TILE_PX x TILE_PX. Alfa según log(count)
+    relativo al máximo del tile; celdas vacías transparentes.
+    """
+    counts = np.zeros(BINS * BINS, dtype=np.float64)
+    for b, count in rows:
+        counts[b] = count
+    top = counts.max(initial=0)
+    img = np.zeros((BINS * BINS, 4), dtype=np.uint8)
+    if top > 0:
+        hot = counts > 0
+        level = np.log1p(counts[hot]) / np.log1p(top)
+        img[hot, :3] = HEAT_RGB
+        img[hot, 3] = np.rint(MIN_ALPHA + (MAX_ALPHA - MIN_ALPHA) * level).astype(np.uint8)
+
+    scale = TILE_PX // BINS
+    img = img.reshape(BINS, BINS, 4).repeat(scale, axis=0).repeat(scale, axis=1)
+    # cada fila empieza con el byte de filtro (0 = ninguno)
+    raw = np.concatenate([np.zeros((TILE_PX, 1), dtype=np.uint8), img.reshape(TILE_PX, -1)], axis=1)
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", TILE_PX, TILE_PX, 8, 6, 0, 0, 0)),
+        _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+def read_tile_png(db: Session, z: int, x: int, y: int) -> bytes:
+    rows = db.execute(
+        select(models.HeatBin.bin, models.HeatBin.count)
+        .where(models.HeatBin.z == z, models.HeatBin.x == x, models.HeatBin.y == y)
+    ).all()
+    return render_png(rows)
@@ -0,0 +1,101 @@
+"""
+Caché HTTP: ETag fuertes, If-None-Match -> 304 y Cache-Control.
+
+  - Detalle de ruta: el path no cambia nunca, así que el ETag sale de la
+    versión de la ruta (updated_at o created_at) y de los parámetros de
+    formato, sin leer ni decodificar el path.
+  - Listados: el ETag es un hash del JSON ya serializado.
+Todo lleva "private" (las respuestas dependen del usuario) y Vary:
+Authorization.
+"""
+import hashlib
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+# subir si cambia la forma de las respuestas para invalidar lo cacheado
+ETAG_FORMAT = "1"
+
+# el cliente guarda la respuesta pero revalida siempre (un 304 es barato)
+REVALIDATE = "private, no-cache"
+
+_adapters: dict[object, TypeAdapter] = {}
+
+
+def make_etag(*parts) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(ETAG_FORMAT.encode())
+    for part in parts:
+        h.update(b"\x1f")
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+    return f'"{h.hexdigest()}"'
+
+
+def route_etag(route, *variant) -> str:
+    version = route.updated_at or route.created_at
+    return make_etag(route.id, version.isoformat() if version else "", *variant)
+
+
+def matches(request: Request, etag: str) -> bool:
+    """
+    If-None-Match con comparación débil (RFC 9110: W/"x" casa con "x").
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return etag in tags
+
+
+def cache_headers(etag: str, cache_control: str = REVALIDATE) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": cache_control, "Vary": "Authorization"}
+
+
+def not_modified(etag: str, cache_control: str = REVALIDATE, headers: dict | None = None) -> Response:
+    return Response(status_code=304, headers={**cache_headers(etag, cache_control), **(headers or {})})
+
+
+def adapter(model) -> TypeAdapter:
+    if model not in _adapters:
+        _adapters[model] = TypeAdapter(model)
+    return _adapters[model]
+
+
+def serialize(model, data) -> bytes:
+    """
+    Valida `data` contra `model` (p. ej. list[schemas.RouteOut]) y lo
+    devuelve como JSON.
+    """
+    ta = adapter(model)
+    return ta.dump_json(ta.validate_python(data, from_attributes=True))
+
+
+def bytes_response(
+    request: Request,
+    body: bytes,
+    cache_control: str = REVALIDATE,
+    headers: dict | None = None,
+) -> Response:
+    """
+    JSON ya serializado -> 304 si el cliente ya tiene ese contenido.
+    """
+    etag = make_etag(body)
+    if matches(request, etag):
+        return not_modified(etag, cache_control, headers)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={**cache_headers(etag, cache_control), **(headers or {})},
+    )
+
+
+def json_response(
+    request: Request,
+    model,
+    data,
+    cache_control: str = REVALIDATE,
+    headers: dict | None = None,
+) -> Response:
+    return bytes_response(request, serialize(model, data), cache_control, headers)
@@ -0,0 +1,339 @@
+"""
+Importación en bloque de rutas de otras apps (GPX, GeoJSON, FIT; sueltos
+o en un zip).
+
+  - POST /imports guarda la subida en disco por trozos (nunca entera en
+    memoria), crea el ImportJob y responde 202 con su id.
+  - Un hilo del ImportService (IMPORT_JOBS trabajos a la vez) recorre los
+    ficheros y los manda al pool de procesos (IMPORT_WORKERS): parsear,
+    estadísticas, LODs y geohash son CPU puro. Como mucho hay
+    2 * IMPORT_WORKERS ficheros en vuelo.
+  - Las filas se insertan por lotes de IMPORT_BATCH: un INSERT de rutas y
+    otro de feed_entries (executemany) por lote, más los upserts de
+    estadísticas y mapa de calor, y se actualiza el progreso del trabajo
+    en el mismo commit.
+  - GET /imports/{id} lee el progreso de la BD, así que funciona con
+    varios workers de uvicorn.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import uuid
+import zipfile
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from uuid import UUID
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from . import heatmap, models, pathcodec, respcache, segments, sync, trackparse, userstats
+from .db import SessionLocal
+
+IMPORT_JOBS = int(os.getenv("IMPORT_JOBS", "2"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "100"))
+IMPORT_DIR = os.getenv("IMPORT_DIR", tempfile.gettempdir())
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(500 * 1024 * 1024)))
+IMPORT_MAX_FILES = int(os.getenv("IMPORT_MAX_FILES", "10000"))
+# tamaño descomprimido de cada fichero del zip
+IMPORT_MAX_FILE_BYTES = int(os.getenv("IMPORT_MAX_FILE_BYTES", str(100 * 1024 * 1024)))
+IMPORT_STALE_S = float(os.getenv("IMPORT_STALE_S", "600"))
+
+MAX_ERRORS = 100
+
+ZIP_TYPES = ("application/zip", "application/x-zip-compressed")
+CONTENT_TYPES = {
+    "application/gpx+xml": "gpx",
+    "application/xml": "gpx",
+    "text/xml": "gpx",
+    "application/geo+json": "geojson",
+    "application/json": "geojson",
+    "application/vnd.ant.fit": "fit",
+    "application/fit": "fit",
+}
+
+
+class UploadError(ValueError):
+    """
+    Subida rechazada; el mensaje es el `detail` que devuelve la API.
+    """
+
+
+def upload_format(content_type: str) -> str:
+    """
+    "zip" o el formato de un fichero suelto según el Content-Type.
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in ZIP_TYPES:
+        return "zip"
+    fmt = CONTENT_TYPES.get(media_type)
+    if fmt is None:
+        raise UploadError("UNSUPPORTED_CONTENT_TYPE")
+    return fmt
+
+
+async def save_upload(chunks) -> str:
+    """
+    Vuelca el cuerpo de la petición (async iterable de bytes) a un fichero
+    temporal y devuelve su ruta.
+    """
+    fd, path = tempfile.mkstemp(prefix="import-", dir=IMPORT_DIR)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > IMPORT_MAX_BYTES:
+                    raise UploadError("UPLOAD_TOO_LARGE")
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    if size == 0:
+        os.unlink(path)
+        raise UploadError("EMPTY_UPLOAD")
+    return path
+
+
+def list_items(path: str, fmt: str) -> tuple[list[tuple[str | None, str, str]], list[dict]]:
+    """
+    Ficheros a importar: (miembro del zip o None, formato, nombre para los
+    errores), y los que se descartan sin procesar.
+    """
+    if fmt != "zip":
+        return [(None, fmt, "upload")], []
+    try:
+        with zipfile.ZipFile(path) as zf:
+            infos = zf.infolist()
+    except zipfile.BadZipFile:
+        raise UploadError("BAD_ZIP")
+
+    items, skipped = [], []
+    for info in infos:
+        name = info.filename
+        if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+            continue
+        member_fmt = trackparse.format_for(name)
+        if member_fmt is None:
+            continue
+        if info.file_size > IMPORT_MAX_FILE_BYTES:
+            skipped.append({"file": name, "error": "FILE_TOO_LARGE"})
+            continue
+        items.append((name, member_fmt, name))
+    if len(items) > IMPORT_MAX_FILES:
+        raise UploadError("TOO_MANY_FILES")
+    return items, skipped
+
+
+def _parse(source: str, member: str | None, fmt: str) -> list[dict]:
+    return trackparse.parse_file(source, member, fmt)
+
+
+class _Batch:
+    """
+    Rutas parseadas pendientes de insertar y progreso aún sin guardar.
+    """
+
+    def __init__(self):
+        self.routes: list[dict] = []
+        self.processed = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+
+class ImportService:
+    def __init__(self, jobs: int, workers: int, batch_size: int):
+        self.jobs = jobs
+        self.workers = workers
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._runner: ThreadPoolExecutor | None = None
+        self._pool: ProcessPoolExecutor | None = None
+        self.started = 0
+        self.finished = 0
+        self.files = 0
+        self.routes = 0
+
+    def _executors(self) -> tuple[ThreadPoolExecutor, ProcessPoolExecutor]:
+        # perezoso, como hashing.py: sin procesos hasta la primera importación
+        with self._lock:
+            if self._runner is None:
+                self._runner = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="import")
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._runner, self._pool
+
+    def submit(self, job_id: UUID, user_id: UUID, path: str, fmt: str, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        `loop` es el del servidor: desde el hilo del trabajo se invalida ahí
+        la caché de /routes/public.
+        """
+        runner, _ = self._executors()
+        with self._lock:
+            self.started += 1
+        runner.submit(self._run, job_id, user_id, path, fmt, loop)
+
+    # ------------------------
+    # Trabajo (hilo del runner)
+    # ------------------------
+    def _run(self, job_id: UUID, user_id: UUID, path: str, fmt: str, loop) -> None:
+        with SessionLocal() as db:
+            job = db.get(models.ImportJob, job_id)
+            try:
+                self._process(db, job, user_id, path, fmt, loop)
+                job.status = "done"
+            except UploadError as e:
+                db.rollback()
+                job.status = "failed"
+                job.errors = [*job.errors, {"file": "upload", "error": str(e)}]
+            except Exception as e:
+                db.rollback()
+                job.status = "failed"
+                job.errors = [*job.errors, {"file": "upload", "error": "INTERNAL_ERROR"}]
+                print("import", job_id, "ERROR:", repr(e))
+            finally:
+                job.finished_at = datetime.now(timezone.utc)
+                db.commit()
+                with self._lock:
+                    self.finished += 1
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _process(self, db: Session, job: models.ImportJob, user_id: UUID, path: str, fmt: str, loop) -> None:
+        items, skipped = list_items(path, fmt)
+        job.status = "running"
+        job.total_files = len(items) + len(skipped)
+        job.processed_files = len(skipped)
+        job.failed_files = len(skipped)
+        job.errors = skipped[:MAX_ERRORS]
+        db.commit()
+
+        readers = [user_id]
+        if job.visibility in ("friends", "public"):
+            readers += list(db.scalars(select(models.Friend.friend_id).where(models.Friend.user_id == user_id)))
+
+        _, pool = self._executors()
+        pending: dict = {}
+        todo = iter(items)
+        batch = _Batch()
+
+        def fill() -> None:
+            while len(pending) < 2 * self.workers:
+                item = next(todo, None)
+                if item is None:
+                    return
+                member, item_fmt, label = item
+                pending[pool.submit(_parse, path, member, item_fmt)] = label
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                label = pending.pop(future)
+                batch.processed += 1
+                try:
+                    batch.routes += future.result()
+                except trackparse.TrackError as e:
+                    batch.failed += 1
+                    batch.errors.append({"file": label, "error": str(e)})
+                except Exception:
+                    batch.failed += 1
+                    batch.errors.append({"file": label, "error": "BAD_FILE"})
+            fill()
+            if len(batch.routes) >= self.batch_size or not pending:
+                if self._flush(db, job, user_id, readers, batch):
+                    respcache.response_cache.invalidate_from_thread(respcache.PUBLIC_ROUTES, loop)
+                batch = _Batch()
+
+    def _flush(self, db: Session, job: models.ImportJob, user_id: UUID, readers: list[UUID], batch: _Batch) -> bool:
+        """
+        Inserta el lote (rutas + timelines) y guarda el progreso en un
+        solo commit. Devuelve si se ha creado alguna ruta pública.
+        """
+        now = datetime.now(timezone.utc)
+        rows = [
+            {
+                "id": uuid.uuid4(),
+                "user_id": user_id,
+                "visibility": job.visibility,
+                "created_at": now,
+                **values,
+            }
+            for values in batch.routes
+        ]
+        if rows:
+            # mismas columnas en todas las filas: un solo executemany
+            columns = set().union(*rows)
+            db.execute(insert(models.Route), [{c: r.get(c) for c in columns} for r in rows])
+            userstats.add_routes(db, rows)
+            if job.visibility == "public":
+                heatmap.apply_counts(
+                    db,
+                    Counter(b for r in rows for b in heatmap.route_bins(pathcodec.decode_columns(r["path_blob"]))),
+                )
+            db.execute(
+                insert(models.FeedEntry),
+                [
+                    {"owner_id": reader, "route_id": r["id"], "author_id": user_id, "created_at": r["created_at"]}
+                    for r in rows
+                    for reader in readers
+                ],
+            )
+            sync.record(
+                db, sync.route_changes(user_id, [r["id"] for r in rows], readers, job.visibility == "public")
+            )
+
+        job.processed_files += batch.processed
+        job.failed_files += batch.failed
+        job.imported_routes += len(rows)
+        if batch.errors and len(job.errors) < MAX_ERRORS:
+            job.errors = [*job.errors, *batch.errors][:MAX_ERRORS]
+        db.commit()
+        segments.matcher.submit_routes([r["id"] for r in rows])
+
+        with self._lock:
+            self.files += batch.processed
+            self.routes += len(rows)
+        return bool(rows) and job.visibility == "public"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "jobs": self.jobs,
+                "workers": self.workers,
+                "started": self.started,
+                "finished": self.finished,
+                "running": self.started - self.finished,
+                "files": self.files,
+                "routes": self.routes,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            runner, pool = self._runner, self._pool
+            self._runner = self._pool = None
+        if runner is not None:
+            runner.shutdown(wait=False, cancel_futures=True)
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def is_stale(job: models.ImportJob) -> bool:
+    """
+    Trabajo sin terminar que no avanza desde hace IMPORT_STALE_S: murió con
+    el proceso que lo llevaba (reinicio, despliegue) y su fichero temporal
+    con él. No se puede marcar al arrancar: con varios workers, el que
+    arranca no sabe qué trabajos siguen vivos en los demás.
+    """
+    if job.status not in ("pending", "running"):
+        return False
+    last = job.updated_at or job.created_at
+    if last.tzinfo is None:
+        last = last.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - last).total_seconds() > IMPORT_STALE_S
+
+
+importer = ImportService(IMPORT_JOBS, IMPORT_WORKERS, IMPORT_BATCH)
@@ -0,0 +1,315 @@
+"""
+Instrumentación por petición: consultas SQL, tiempo en BD y tiempo total.
+
+  - Eventos de SQLAlchemy (engine sync y async) cuentan cada sentencia en
+    las estadísticas de la petición en curso (contextvar; los hilos del
+    threadpool heredan el contexto, así que los endpoints sync también
+    cuentan).
+  - El middleware acumula al terminar las métricas por ruta y, solo si la
+    petición trae `X-Debug-Token: <METRICS_TOKEN>`, añade Server-Timing
+    (db / app / total) a la respuesta (cuántas consultas y cuánto tardan
+    no es algo que deba ver cualquier cliente).
+  - N+1: si la misma sentencia se ejecuta N1_THRESHOLD veces o más en una
+    petición, se avisa en el log.
+  - Consultas lentas (> SLOW_QUERY_MS) al log sin los valores de los
+    parámetros.
+  - `render_prometheus()` saca todo en formato de texto de Prometheus
+    (GET /metrics).
+
+/metrics y /metrics/pool solo existen si hay METRICS_TOKEN y piden
+`Authorization: Bearer <METRICS_TOKEN>` (Prometheus: `authorization`
+en el scrape_config). Sin token no se montan.
+"""
+import contextvars
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import event
+from starlette.datastructures import Headers, MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N1_THRESHOLD = int(os.getenv("N1_THRESHOLD", "5"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
+
+# segundos
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time_s", "statements", "_lock")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time_s = 0.0
+        self.statements: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, elapsed_s: float) -> None:
+        with self._lock:
+            self.queries += 1
+            self.db_time_s += elapsed_s
+            self.statements[statement] += 1
+
+
+_current: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("request_stats", default=None)
+
+
+def current() -> RequestStats | None:
+    return _current.get()
+
+
+# ------------------------
+# SQLAlchemy
+# ------------------------
+def _redact(parameters) -> str:
+    """
+    Solo la forma de los parámetros (cuántos y de qué tipo), nunca valores.
+    """
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f"[{len(parameters)} filas]"
+        return "(" + ", ".join(type(v).__name__ for v in parameters) + ")"
+    return type(parameters).__name__
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    metrics.observe_query(elapsed, slow)
+    if slow:
+        logger.warning(
+            "consulta lenta %.1f ms: %s params=%s",
+            elapsed * 1000,
+            " ".join(statement.split()),
+            _redact(parameters),
+        )
+
+
+def install(*engines) -> None:
+    """
+    Engines sync (para el async: async_engine.sync_engine).
+    """
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_execute)
+        event.listen(engine, "after_cursor_execute", _after_execute)
+
+
+# ------------------------
+# Métricas
+# ------------------------
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Counter = Counter()  # (method, route, status)
+        self.durations: dict[tuple, _Histogram] = {}  # (method, route)
+        self.db_time: Counter = Counter()  # (method, route)
+        self.queries: dict[tuple, _Histogram] = {}  # (method, route)
+        self.n_plus_one: Counter = Counter()  # (method, route)
+        self.query_time = _Histogram(DURATION_BUCKETS)
+        self.slow_queries = 0
+
+    def observe_query(self, elapsed_s: float, slow: bool = False) -> None:
+        with self._lock:
+            self.query_time.observe(elapsed_s)
+            if slow:
+                self.slow_queries += 1
+
+    def observe_request(self, method: str, route: str, status: int, total_s: float, stats: RequestStats) -> None:
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            self.durations.setdefault(key, _Histogram(DURATION_BUCKETS)).observe(total_s)
+            self.queries.setdefault(key, _Histogram(QUERY_BUCKETS)).observe(stats.queries)
+            self.db_time[key] += stats.db_time_s
+
+        repeated = [(sql, n) for sql, n in stats.statements.items() if n >= N1_THRESHOLD]
+        if repeated:
+            with self._lock:
+                self.n_plus_one[key] += 1
+            sql, n = max(repeated, key=lambda pair: pair[1])
+            logger.warning("posible N+1 en %s %s: %d veces %s", method, route, n, " ".join(sql.split())[:300])
+
+
+metrics = Metrics()
+
+
+# ------------------------
+# Middleware
+# ------------------------
+class InstrumentationMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        timing = debug_authorized(Headers(scope=scope).get("x-debug-token"))
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timing:
+                    total_ms = (time.perf_counter() - start) * 1000
+                    db_ms = stats.db_time_s * 1000
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "Server-Timing",
+                        f'db;dur={db_ms:.1f};desc="{stats.queries} queries", '
+                        f"app;dur={max(0.0, total_ms - db_ms):.1f}, total;dur={total_ms:.1f}",
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            # plantilla de la ruta, no la URL: /routes/{route_id:uuid}
+            name = getattr(route, "path", None) or "unmatched"
+            metrics.observe_request(scope["method"], name, status, time.perf_counter() - start, stats)
+
+
+# ------------------------
+# Acceso
+# ------------------------
+def _token_matches(token: str) -> bool:
+    return bool(METRICS_TOKEN) and hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode())
+
+
+def metrics_authorized(authorization: str | None) -> bool:
+    if not authorization:
+        return False
+    scheme, _, token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and _token_matches(token)
+
+
+def debug_authorized(debug_token: str | None) -> bool:
+    """
+    Cabecera X-Debug-Token (Authorization ya lleva el JWT del usuario).
+    """
+    return bool(debug_token) and _token_matches(debug_token)
+
+
+# ------------------------
+# Prometheus
+# ------------------------
+
+
+_LABEL_ESCAPE = re.compile(r'(["\\\n])')
+
+
+def _labels(**labels) -> str:
+    parts = []
+    for k, v in labels.items():
+        value = _LABEL_ESCAPE.sub(lambda m: "\\n" if m.group(1) == "\n" else "\\" + m.group(1), str(v))
+        parts.append(f'{k}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _histogram_lines(name: str, hist: _Histogram, **labels) -> list[str]:
+    lines = []
+    for bound, count in zip(hist.buckets, hist.counts):
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {hist.total}')
+    lines.append(f"{name}_sum{_labels(**labels)} {hist.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {hist.total}")
+    return lines
+
+
+def render_prometheus(gauges: dict[str, list[tuple[dict, float]]] | None = None) -> str:
+    """
+    gauges: nombre -> [(labels, valor)] extra (pool, cachés...).
+    """
+    m = metrics
+    out = [
+        "# HELP http_requests_total Peticiones HTTP por ruta y estado.",
+        "# TYPE http_requests_total counter",
+    ]
+    with m._lock:
+        for (method, route, status), n in sorted(m.requests.items()):
+            out.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {n}")
+
+        out += [
+            "# HELP http_request_duration_seconds Tiempo total de la petición.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), hist in sorted(m.durations.items()):
+            out += _histogram_lines("http_request_duration_seconds", hist, method=method, route=route)
+
+        out += [
+            "# HELP http_request_db_queries Sentencias SQL por petición.",
+            "# TYPE http_request_db_queries histogram",
+        ]
+        for (method, route), hist in sorted(m.queries.items()):
+            out += _histogram_lines("http_request_db_queries", hist, method=method, route=route)
+
+        out += [
+            "# HELP http_request_db_seconds_total Tiempo en BD acumulado por ruta.",
+            "# TYPE http_request_db_seconds_total counter",
+        ]
+        for (method, route), secs in sorted(m.db_time.items()):
+            out.append(f"http_request_db_seconds_total{_labels(method=method, route=route)} {secs}")
+
+        out += [
+            "# HELP http_request_n_plus_one_total Peticiones con una sentencia repetida N1_THRESHOLD veces o más.",
+            "# TYPE http_request_n_plus_one_total counter",
+        ]
+        for (method, route), n in sorted(m.n_plus_one.items()):
+            out.append(f"http_request_n_plus_one_total{_labels(method=method, route=route)} {n}")
+
+        out += [
+            "# HELP db_query_duration_seconds Duración de cada sentencia SQL.",
+            "# TYPE db_query_duration_seconds histogram",
+        ]
+        out += _histogram_lines("db_query_duration_seconds", m.query_time)
+        out += [
+            "# HELP db_slow_queries_total Sentencias por encima de SLOW_QUERY_MS.",
+            "# TYPE db_slow_queries_total counter",
+            f"db_slow_queries_total {m.slow_queries}",
+        ]
+
+    for name, samples in (gauges or {}).items():
+        out.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            out.append(f"{name}{_labels(**labels) if labels else ''} {value}")
+
+    return "\n".join(out) + "\n"
@@ -1,16 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, undefer, undefer_group
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_, and_
 from uuid import UUID
+import asyncio
+import base64
+import binascii
+from typing import Literal
 
-from .db import Base, engine, get_db
-from . import models, schemas, security
+from .db import Base, engine, async_engine, SessionLocal, get_db, get_async_db
+from . import models, schemas, security, auth, feed, migrations, pathcodec, simplify, recordings, stats, spatial, poolstats, hashing, usersearch, friendgraph, friendcache, httpcache, compression, fastjson, respcache, instrumentation, imports, export, heatmap, segments, userstats, sync
 
 app = FastAPI()
 
+# gzip/brotli/zstd para respuestas de más de COMPRESS_MIN_BYTES
+app.add_middleware(compression.CompressionMiddleware)
+
 # Bearer token
 security_scheme = HTTPBearer()
 
@@ -21,48 +31,107 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
 
+# consultas / tiempo en BD por petición: Server-Timing (con X-Debug-Token),
+# log de consultas lentas y N+1, métricas en /metrics. La más externa: mide todo lo demás.
+instrumentation.install(engine, async_engine.sync_engine)
+app.add_middleware(instrumentation.InstrumentationMiddleware)
+
 @app.on_event("startup")
 def on_startup():
     try:
         Base.metadata.create_all(bind=engine)
+        migrations.run(engine)
         print("DB init OK")
     except Exception as e:
         print("DB init ERROR:", repr(e))
 
+@app.on_event("shutdown")
+def on_shutdown():
+    hashing.hasher.shutdown()
+    imports.importer.shutdown()
+    segments.matcher.shutdown()
+
 @app.get("/")
 def root():
     return {"status": "backend funcionando"}
 
+# ------------------------
+# Métricas (solo con METRICS_TOKEN, ver instrumentation.py)
+# ------------------------
+def require_metrics_token(request: Request):
+    # 404 y no 401: desde fuera no se ve que existan
+    if not instrumentation.metrics_authorized(request.headers.get("authorization")):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+def pool_metrics():
+    """
+    Estado y contadores de los pools sync/async (ver poolstats.py), más
+    las cachés (usuarios autenticados, amistades, respuestas) y el servicio
+    de hashing.
+    """
+    return {
+        **poolstats.snapshot(),
+        "auth_cache": auth.principal_cache.stats(),
+        "hashing": hashing.hasher.stats(),
+        "friend_cache": friendcache.friend_cache.stats(),
+        "response_cache": respcache.response_cache.stats(),
+        "imports": imports.importer.stats(),
+        "segments": segments.matcher.stats(),
+    }
+
+def prometheus_metrics():
+    """
+    Formato de texto de Prometheus: peticiones, latencia, consultas y
+    tiempo en BD por ruta (ver instrumentation.py) más el estado de los pools.
+    """
+    gauges: dict[str, list] = {}
+    for pool_name, data in poolstats.snapshot().items():
+        for key, value in data.items():
+            if isinstance(value, (int, float)):
+                gauges.setdefault(f"db_pool_{key}", []).append(({"pool": pool_name}, value))
+    return Response(
+        instrumentation.render_prometheus(gauges),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+if instrumentation.METRICS_TOKEN:
+    for path, endpoint in (("/metrics/pool", pool_metrics), ("/metrics", prometheus_metrics)):
+        app.add_api_route(path, endpoint, include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+
 # ------------------------
 # Auth
 # ------------------------
 @app.post("/auth/register", response_model=schemas.UserOut)
-def register(data: schemas.RegisterIn, db: Session = Depends(get_db)):
+async def register(data: schemas.RegisterIn, db: AsyncSession = Depends(get_async_db)):
     email = data.email.lower().strip()
     name = data.name.strip()
     password = data.password
 
-    existing = db.query(models.User).filter(models.User.email == email).first()
+    existing = await db.scalar(select(models.User.id).where(models.User.email == email))
     if existing:
         raise HTTPException(status_code=409, detail="EMAIL_EXISTS")
 
     user = models.User(
         email=email,
         name=name,
-        password_hash=security.hash_password(password),
+        name_lower=usersearch.normalize(name),
+        password_hash=await hash_or_503(hashing.hasher.hash_password(password)),
     )
 
     try:
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
 
-        pgcode = getattr(getattr(e, "orig", None), "pgcode", None)
-        msg = str(getattr(e, "orig", e))
+        orig = getattr(e, "orig", None)
+        # psycopg2 -> pgcode, asyncpg -> sqlstate
+        pgcode = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+        msg = str(orig or e)
         print("REGISTER IntegrityError pgcode=", pgcode, "msg=", msg)
 
         if pgcode == "23505" or "duplicate key" in msg.lower() or "unique" in msg.lower():
@@ -71,34 +140,51 @@ def register(data: schemas.RegisterIn, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=f"REGISTER_INTEGRITY_ERROR:{pgcode}")
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print("REGISTER ERROR:", repr(e))
         raise HTTPException(status_code=500, detail="REGISTER_FAILED")
 
+    usersearch.local_index.add(user.id, user.name)
     return schemas.UserOut(id=user.id, email=user.email, name=user.name)
 
 @app.post("/auth/login")
-def login(data: schemas.LoginIn, db: Session = Depends(get_db)):
+async def login(data: schemas.LoginIn, db: AsyncSession = Depends(get_async_db)):
     email = data.email.lower().strip()
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = await db.scalar(select(models.User).where(models.User.email == email))
     if not user:
         raise HTTPException(status_code=404, detail="NOT_FOUND")
 
-    try:
-        ok = security.verify_password(data.password, user.password_hash)
-    except Exception:
-        ok = False
-
+    ok, new_hash = await hash_or_503(
+        hashing.hasher.verify_and_update(data.password, user.password_hash)
+    )
     if not ok:
         raise HTTPException(status_code=401, detail="BAD_PASSWORD")
 
+    # hash con rondas antiguas: se guarda el nuevo aprovechando que tenemos la contraseña
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+
+    # la siguiente petición autenticada ya no necesita ir a la BD
+    auth.principal_cache.set(user.id, auth.Principal.from_user(user))
+
     access_token = security.create_access_token(user.id)
     return {"access_token": access_token, "token_type": "bearer"}
 
-def get_current_user(
+async def hash_or_503(job):
+    """
+    Espera un trabajo del servicio de hashing; si está saturado, 503 con
+    Retry-After en vez de dejar la petición encolada.
+    """
+    try:
+        return await job
+    except hashing.HashingBusy:
+        raise HTTPException(status_code=503, detail="AUTH_BUSY", headers={"Retry-After": "1"})
+
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security_scheme),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     token = credentials.credentials
     try:
@@ -106,16 +192,27 @@ def get_current_user(
     except Exception:
         raise HTTPException(status_code=401, detail="Token inválido")
 
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await auth.load_principal(db, user_id)
     if not user:
         raise HTTPException(status_code=401, detail="Usuario no existe")
 
     return user
 
 @app.get("/me", response_model=schemas.UserOut)
-def me(user: models.User = Depends(get_current_user)):
+def me(user: auth.Principal = Depends(get_current_user)):
     return schemas.UserOut(id=user.id, email=user.email, name=user.name)
 
+@app.get("/me/stats", response_model=schemas.UserStatsOut)
+async def my_stats(
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Totales, mejores marcas, últimas semanas/meses y última ruta, leídos
+    de user_stats (ver userstats.py): no depende de cuántas rutas haya.
+    """
+    return await db.run_sync(userstats.read, user.id)
+
 # ------------------------
 # Routes
 # ------------------------
@@ -123,304 +220,989 @@ def me(user: models.User = Depends(get_current_user)):
 def create_route(
     data: schemas.RouteCreate,
     db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    route = models.Route(
-        user_id=user.id,
+    if data.path_encoded is not None:
+        try:
+            path_blob = base64.b64decode(data.path_encoded, validate=True)
+            cols = pathcodec.decode_columns(path_blob, max_points=pathcodec.MAX_POINTS)
+            pathcodec.check_coords(cols["lat"], cols["lon"])
+        except pathcodec.PathTooLarge:
+            raise HTTPException(status_code=413, detail="PATH_TOO_LARGE")
+        except (binascii.Error, ValueError):
+            raise HTTPException(status_code=400, detail="BAD_PATH_ENCODED")
+    elif data.path is not None:
+        if len(data.path) > pathcodec.MAX_POINTS:
+            raise HTTPException(status_code=413, detail="PATH_TOO_LARGE")
+        cols = pathcodec.points_to_columns(data.path)
+        try:
+            path_blob = pathcodec.encode_columns(cols)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="BAD_PATH")
+    else:
+        raise HTTPException(status_code=400, detail="PATH_REQUIRED")
+
+    return insert_route(
+        db,
+        user,
         name=data.name.strip(),
+        visibility=data.visibility,
         distance_m=data.distance_m,
         duration_s=data.duration_s,
-        path=data.path,
-        visibility=data.visibility,
+        cols=cols,
+        path_blob=path_blob,
     )
 
+def insert_route(
+    db: Session,
+    user: auth.Principal,
+    *,
+    name: str,
+    visibility: str,
+    distance_m: int,
+    duration_s: int,
+    cols: dict,
+    path_blob: bytes,
+) -> models.Route:
+    """
+    Inserta la ruta con sus LODs y la reparte a los timelines. Hace commit.
+    distance_m/duration_s son los del cliente: se sustituyen por los
+    calculados en el servidor cuando el path lo permite.
+    """
+    lods = simplify.encode_lods(cols)
+
+    route = models.Route(
+        user_id=user.id,
+        name=name,
+        distance_m=distance_m,
+        duration_s=duration_s,
+        path_blob=path_blob,
+        path_lod_low=lods["low"],
+        path_lod_medium=lods["medium"],
+        visibility=visibility,
+    )
+    stats.apply(route, stats.compute(cols))
+    geo = spatial.route_geo(cols)
+    if geo:
+        spatial.apply(route, geo)
+
     db.add(route)
+    db.flush()
+    feed.fan_out_route(db, route)
+    userstats.add_routes(db, [userstats.route_values(route)])
+    sync.route_changed(db, route, broadcast=route.visibility == "public")
+    if route.visibility == "public":
+        heatmap.apply(db, heatmap.route_bins(cols), +1)
     db.commit()
     db.refresh(route)
+
+    if route.visibility == "public":
+        respcache.response_cache.invalidate_from_thread(respcache.PUBLIC_ROUTES)
+    segments.matcher.submit_routes([route.id])
     return route
 
 @app.get("/routes/mine", response_model=list[schemas.RouteOut])
-def list_my_routes(
+async def list_my_routes(
+    request: Request,
+    before: str | None = None,
+    limit: int | None = Query(None, ge=1, le=feed.FEED_MAX_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Paginación por cursor como /feed: `limit` y `before` = cabecera
+    X-Next-Cursor de la página anterior. Sin `limit` devuelve todas (las
+    versiones de la app que no paginan); para totales está /me/stats.
+    """
+    q = (
+        select(models.Route)
+        .where(models.Route.user_id == user.id)
+        .order_by(models.Route.created_at.desc(), models.Route.id.desc())
+    )
+    if before:
+        try:
+            q = q.where(feed.before_cursor(models.Route.created_at, models.Route.id, feed.decode_cursor(before)))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="BAD_CURSOR")
+    if limit is not None:
+        q = q.limit(limit)
+    rutas = (await db.scalars(q)).all()
+
+    headers = {}
+    if limit is not None and len(rutas) == limit:
+        headers["X-Next-Cursor"] = feed.encode_cursor(rutas[-1])
+    return httpcache.json_response(request, list[schemas.RouteOut], rutas, headers=headers)
+
+@app.get("/routes/mine/export")
+def export_my_routes(
+    format: Literal["gpx", "geojson", "csv"] = "gpx",
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Zip con todas mis rutas, generado y comprimido mientras se envía.
+    """
+    return StreamingResponse(
+        export.zip_stream(SessionLocal, user.id, format),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="rutas-{format}.zip"'},
+    )
+
+# ------------------------
+# Recordings (subida por trozos mientras se graba)
+# ------------------------
+async def raw_body(request: Request) -> bytes:
+    return await request.body()
+
+def get_own_recording(db: Session, recording_id: UUID, user: auth.Principal) -> models.RecordingSession:
+    rec = db.query(models.RecordingSession).filter(models.RecordingSession.id == recording_id).first()
+    if not rec:
+        raise HTTPException(status_code=404, detail="RECORDING_NOT_FOUND")
+    if rec.user_id != user.id:
+        raise HTTPException(status_code=403, detail="NOT_OWNER")
+    return rec
+
+def recording_out(rec: models.RecordingSession) -> schemas.RecordingOut:
+    return schemas.RecordingOut(
+        id=rec.id,
+        point_count=rec.point_count,
+        chunk_count=rec.chunk_count,
+        distance_m=int(round(rec.distance_m)),
+        duration_s=recordings.duration_s(rec),
+        created_at=rec.created_at,
+    )
+
+@app.post("/recordings", response_model=schemas.RecordingOut)
+def open_recording(
+    db: Session = Depends(get_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    rec = models.RecordingSession(user_id=user.id, point_count=0, chunk_count=0, distance_m=0.0)
+    db.add(rec)
+    db.commit()
+    db.refresh(rec)
+    return recording_out(rec)
+
+@app.get("/recordings/{recording_id:uuid}", response_model=schemas.RecordingOut)
+def get_recording(
+    recording_id: UUID,
     db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    rutas = (
-        db.query(models.Route)
-        .filter(models.Route.user_id == user.id)
-        .order_by(models.Route.created_at.desc())
-        .all()
+    return recording_out(get_own_recording(db, recording_id, user))
+
+@app.post("/recordings/{recording_id:uuid}/points", response_model=schemas.RecordingOut)
+def append_recording_points(
+    recording_id: UUID,
+    request: Request,
+    seq: int = Query(..., ge=0),
+    body: bytes = Depends(raw_body),
+    db: Session = Depends(get_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Body: NDJSON (un RoutePoint por línea) o binario de pathcodec
+    (application/octet-stream). `seq` empieza en 0; reenviar un trozo ya
+    recibido no lo duplica.
+    """
+    rec = get_own_recording(db, recording_id, user)
+
+    try:
+        cols = recordings.parse_chunk(body, request.headers.get("content-type", ""))
+        recordings.append_chunk(db, rec, seq, cols)
+        db.commit()
+    except recordings.ChunkError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except recordings.ChunkOutOfOrder:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"EXPECTED_SEQ:{rec.chunk_count}")
+    except IntegrityError:
+        # otro reintento del mismo trozo llegó a la vez
+        db.rollback()
+
+    db.refresh(rec)
+    return recording_out(rec)
+
+@app.post("/recordings/{recording_id:uuid}/finalize", response_model=schemas.RouteOut)
+def finalize_recording(
+    recording_id: UUID,
+    data: schemas.RecordingFinalizeIn,
+    db: Session = Depends(get_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    rec = get_own_recording(db, recording_id, user)
+
+    name = data.name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="BAD_NAME")
+    if rec.point_count == 0:
+        raise HTTPException(status_code=400, detail="PATH_REQUIRED")
+
+    cols = recordings.session_columns(db, rec)
+    try:
+        # entre trozos puede haber saltos que no caben en el formato
+        path_blob = pathcodec.encode_columns(cols)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="BAD_PATH")
+    distance_m = int(round(rec.distance_m))
+    duration_s = recordings.duration_s(rec)
+    recordings.discard(db, rec)
+
+    return insert_route(
+        db,
+        user,
+        name=name,
+        visibility=data.visibility,
+        distance_m=distance_m,
+        duration_s=duration_s,
+        cols=cols,
+        path_blob=path_blob,
     )
-    return rutas
+
+@app.delete("/recordings/{recording_id:uuid}")
+def discard_recording(
+    recording_id: UUID,
+    db: Session = Depends(get_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    rec = get_own_recording(db, recording_id, user)
+    recordings.discard(db, rec)
+    db.commit()
+    return {"status": "deleted"}
+
+# ------------------------
+# Imports (GPX / GeoJSON / FIT en bloque, en segundo plano)
+# ------------------------
+@app.post("/imports", response_model=schemas.ImportJobOut, status_code=202)
+async def create_import(
+    request: Request,
+    visibility: Literal["private", "friends", "public"] = Query("private"),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Body: un zip con .gpx/.geojson/.fit (application/zip) o un fichero
+    suelto con su Content-Type. Responde enseguida con el trabajo; el
+    progreso se consulta en GET /imports/{id}.
+    """
+    try:
+        fmt = imports.upload_format(request.headers.get("content-type", ""))
+        path = await imports.save_upload(request.stream())
+    except imports.UploadError as e:
+        status = 413 if str(e) == "UPLOAD_TOO_LARGE" else 400
+        raise HTTPException(status_code=status, detail=str(e))
+
+    job = models.ImportJob(user_id=user.id, visibility=visibility, status="pending", errors=[])
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    imports.importer.submit(job.id, user.id, path, fmt, asyncio.get_running_loop())
+    return job
+
+@app.get("/imports/{job_id:uuid}", response_model=schemas.ImportJobOut)
+async def get_import(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    job = await db.get(models.ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="IMPORT_NOT_FOUND")
+    if job.user_id != user.id:
+        raise HTTPException(status_code=403, detail="NOT_OWNER")
+
+    if imports.is_stale(job):
+        job.status = "failed"
+        job.errors = [*job.errors, {"file": "upload", "error": "INTERRUPTED"}]
+        # última vez que avanzó
+        job.finished_at = job.updated_at
+        await db.commit()
+        await db.refresh(job)
+    return job
 
 # ------------------------
 # Users search
 # ------------------------
 @app.get("/users/search", response_model=list[schemas.UserSearchOut])
-def search_users(
+async def search_users(
     q: str,
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
     query = q.strip().lower()
     if len(query) < 2:
         return []
 
-    users = (
-        db.query(models.User)
-        .filter(models.User.name.ilike(f"%{query}%"))
-        .order_by(models.User.name.asc())
-        .limit(20)
-        .all()
-    )
-    return users
+    found = await usersearch.search(db, query)
+    return [schemas.UserSearchOut(id=user_id, name=name) for user_id, name in found]
 
 # ------------------------
 # Friend Requests
 # ------------------------
 @app.post("/friend-requests", response_model=schemas.FriendRequestOut)
-def send_friend_request(
+async def send_friend_request(
     data: schemas.FriendRequestCreate,
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    to_name = data.to_name.strip().lower()
+    to_name = usersearch.normalize(data.to_name)
     if len(to_name) < 2:
         raise HTTPException(status_code=400, detail="BAD_TO_NAME")
 
-    if to_name == user.name.strip().lower():
+    if to_name == usersearch.normalize(user.name):
         raise HTTPException(status_code=400, detail="CANNOT_REQUEST_SELF")
 
-    to_user = db.query(models.User).filter(models.User.name == to_name).first()
-    if not to_user:
+    target = (await friendgraph.resolve_targets(db, user.id, [to_name])).get(to_name)
+    if not target:
         raise HTTPException(status_code=404, detail="USER_NOT_FOUND")
+    if target.problem == "CANNOT_REQUEST_SELF":
+        raise HTTPException(status_code=400, detail=target.problem)
+    if target.problem:
+        raise HTTPException(status_code=409, detail=target.problem)
 
-    existing_friend = (
-        db.query(models.Friend)
-        .filter(models.Friend.user_id == user.id, models.Friend.friend_id == to_user.id)
-        .first()
-    )
-    if existing_friend:
-        raise HTTPException(status_code=409, detail="ALREADY_FRIENDS")
-
-    pending_same = (
-        db.query(models.FriendRequest)
-        .filter(
-            models.FriendRequest.from_user_id == user.id,
-            models.FriendRequest.to_user_id == to_user.id,
-        )
-        .first()
-    )
-    if pending_same:
-        raise HTTPException(status_code=409, detail="REQUEST_ALREADY_SENT")
-
-    pending_reverse = (
-        db.query(models.FriendRequest)
-        .filter(
-            models.FriendRequest.from_user_id == to_user.id,
-            models.FriendRequest.to_user_id == user.id,
-        )
-        .first()
-    )
-    if pending_reverse:
-        raise HTTPException(status_code=409, detail="REQUEST_ALREADY_RECEIVED")
-
-    fr = models.FriendRequest(from_user_id=user.id, to_user_id=to_user.id)
-    try:
-        db.add(fr)
-        db.commit()
-        db.refresh(fr)
-    except IntegrityError:
-        db.rollback()
+    created = await friendgraph.create_requests(db, user.id, [target.user_id])
+    if target.user_id not in created:
         raise HTTPException(status_code=409, detail="REQUEST_ALREADY_EXISTS")
 
-    return fr
+    return created[target.user_id]
+
+@app.post("/friend-requests/bulk", response_model=list[schemas.FriendRequestSendResult])
+async def send_friend_requests_bulk(
+    data: schemas.FriendRequestBulkCreate,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Varias solicitudes de una vez: una consulta para validar todos los
+    nombres y un INSERT para crearlas. Un resultado por nombre, en orden.
+    """
+    if len(data.to_names) > friendgraph.MAX_BULK:
+        raise HTTPException(status_code=400, detail="TOO_MANY_NAMES")
+
+    names = [usersearch.normalize(n) for n in data.to_names]
+    targets = await friendgraph.resolve_targets(db, user.id, [n for n in names if len(n) >= 2])
+    sendable = [t.user_id for t in targets.values() if not t.problem]
+    created = await friendgraph.create_requests(db, user.id, sendable)
+
+    results = []
+    for raw, name in zip(data.to_names, names):
+        target = targets.get(name)
+        if len(name) < 2:
+            status, fr = "BAD_TO_NAME", None
+        elif not target:
+            status, fr = "USER_NOT_FOUND", None
+        elif target.problem:
+            status, fr = target.problem, None
+        elif target.user_id in created:
+            status, fr = "sent", created[target.user_id]
+        else:
+            status, fr = "REQUEST_ALREADY_EXISTS", None
+        results.append(schemas.FriendRequestSendResult(to_name=raw, status=status, request=fr))
+    return results
 
 @app.get("/friend-requests/incoming", response_model=list[schemas.FriendRequestOut])
-def list_incoming_requests(
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+async def list_incoming_requests(
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    reqs = (
-        db.query(models.FriendRequest)
-        .filter(models.FriendRequest.to_user_id == user.id)
-        .order_by(models.FriendRequest.created_at.desc())
-        .all()
-    )
-    return reqs
+    return await friendgraph.list_requests(db, user.id, incoming=True)
 
 @app.get("/friend-requests/outgoing", response_model=list[schemas.FriendRequestOut])
-def list_outgoing_requests(
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+async def list_outgoing_requests(
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    reqs = (
-        db.query(models.FriendRequest)
-        .filter(models.FriendRequest.from_user_id == user.id)
-        .order_by(models.FriendRequest.created_at.desc())
-        .all()
-    )
-    return reqs
+    return await friendgraph.list_requests(db, user.id, incoming=False)
+
+@app.post("/friend-requests/accept", response_model=list[schemas.FriendRequestActionResult])
+async def accept_friend_requests_bulk(
+    data: schemas.FriendRequestIdsIn,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    if len(data.ids) > friendgraph.MAX_BULK:
+        raise HTTPException(status_code=400, detail="TOO_MANY_IDS")
+
+    try:
+        result, new_friends = await friendgraph.accept_many(db, user.id, data.ids)
+        await db.commit()
+    except IntegrityError:
+        # otra petición aceptó la misma amistad a la vez
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="ALREADY_FRIENDS")
+
+    if new_friends:
+        await friendcache.friend_cache.invalidate(user.id, *new_friends)
+
+    return [schemas.FriendRequestActionResult(id=rid, status=status) for rid, status in result.items()]
+
+@app.post("/friend-requests/reject", response_model=list[schemas.FriendRequestActionResult])
+async def reject_friend_requests_bulk(
+    data: schemas.FriendRequestIdsIn,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    if len(data.ids) > friendgraph.MAX_BULK:
+        raise HTTPException(status_code=400, detail="TOO_MANY_IDS")
+
+    deleted = await friendgraph.reject_many(db, user.id, data.ids)
+    await db.commit()
+    return [
+        schemas.FriendRequestActionResult(id=rid, status="rejected" if rid in deleted else "REQUEST_NOT_FOUND")
+        for rid in dict.fromkeys(data.ids)
+    ]
 
 @app.post("/friend-requests/{request_id}/accept")
-def accept_friend_request(
-    request_id: str,
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+async def accept_friend_request(
+    request_id: UUID,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    fr = db.query(models.FriendRequest).filter(models.FriendRequest.id == request_id).first()
+    fr = await db.get(models.FriendRequest, request_id)
     if not fr:
         raise HTTPException(status_code=404, detail="REQUEST_NOT_FOUND")
 
     if fr.to_user_id != user.id:
         raise HTTPException(status_code=403, detail="NOT_YOUR_REQUEST")
 
-    a_to_b = models.Friend(user_id=fr.from_user_id, friend_id=fr.to_user_id)
-    b_to_a = models.Friend(user_id=fr.to_user_id, friend_id=fr.from_user_id)
-
     try:
-        db.add(a_to_b)
-        db.add(b_to_a)
-        db.delete(fr)
-        db.commit()
+        await friendgraph.accept_pairs(db, [(fr.id, fr.from_user_id, fr.to_user_id)])
+        await db.commit()
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=409, detail="ALREADY_FRIENDS")
 
+    await friendcache.friend_cache.invalidate(fr.from_user_id, fr.to_user_id)
+
     return {"status": "accepted"}
 
 @app.post("/friend-requests/{request_id}/reject")
-def reject_friend_request(
-    request_id: str,
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+async def reject_friend_request(
+    request_id: UUID,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    fr = db.query(models.FriendRequest).filter(models.FriendRequest.id == request_id).first()
+    fr = await db.get(models.FriendRequest, request_id)
     if not fr:
         raise HTTPException(status_code=404, detail="REQUEST_NOT_FOUND")
 
     if fr.to_user_id != user.id:
         raise HTTPException(status_code=403, detail="NOT_YOUR_REQUEST")
 
-    db.delete(fr)
-    db.commit()
+    await db.delete(fr)
+    await db.run_sync(sync.record, sync.request_changes([(fr.id, fr.from_user_id, fr.to_user_id)]))
+    await db.commit()
     return {"status": "rejected"}
 
 @app.get("/friends", response_model=list[schemas.FriendOut])
-def list_friends(
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+async def list_friends(
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    friend_rows = (
-        db.query(models.Friend)
-        .filter(models.Friend.user_id == user.id)
-        .all()
-    )
-
-    friend_ids = [row.friend_id for row in friend_rows]
-    if not friend_ids:
-        return []
-
-    friends = (
-        db.query(models.User)
-        .filter(models.User.id.in_(friend_ids))
-        .order_by(models.User.name.asc())
-        .all()
-    )
+    return await friendgraph.list_friends(db, user.id)
 
-    return [schemas.FriendOut(id=f.id, name=f.name) for f in friends]
+# ------------------------
+# Sincronización incremental (ver sync.py)
+# ------------------------
+@app.get("/sync", response_model=schemas.SyncOut)
+async def sync_changes(
+    since: str | None = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Sin `since`: instantánea de mis rutas, el feed (primera página), amigos
+    y solicitudes, con `reset` = true. Con `since` = `token` de la
+    respuesta anterior: solo lo que ha cambiado, y los ids borrados o que
+    ya no veo en deleted_*. Si `has_more`, volver a llamar enseguida con
+    el nuevo token.
+    """
+    if since is None:
+        return await db.run_sync(sync.snapshot, user.id)
+    try:
+        seq = sync.parse_token(since)
+    except sync.SyncTokenError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await db.run_sync(sync.changes_since, user.id, seq)
 
 # ------------------------
 # Feed
 # ------------------------
 @app.get("/feed", response_model=list[schemas.FeedRouteOut])
-def get_feed(
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+async def get_feed(
+    request: Request,
+    before: str | None = None,
+    limit: int = Query(50, ge=1, le=feed.FEED_MAX_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    friend_ids = [
-        row.friend_id
-        for row in db.query(models.Friend).filter(models.Friend.user_id == user.id).all()
-    ]
+    """
+    Paginación por cursor: pasa `before` = cabecera X-Next-Cursor de la
+    página anterior (o "<created_at>,<id>" del último elemento).
+    """
+    cursor = None
+    if before:
+        try:
+            cursor = feed.decode_cursor(before)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="BAD_CURSOR")
+
+    routes = await db.run_sync(feed.read_feed, user.id, limit, cursor)
 
-    cond_mine = (models.Route.user_id == user.id)
-    cond_public = (models.Route.visibility == "public")
+    headers = {}
+    if len(routes) == limit:
+        headers["X-Next-Cursor"] = feed.encode_cursor(routes[-1])
 
-    if friend_ids:
-        cond_friends = and_(
-            models.Route.visibility == "friends",
-            models.Route.user_id.in_(friend_ids),
+    return httpcache.json_response(request, list[schemas.FeedRouteOut], routes, headers=headers)
+
+# ------------------------
+# Public routes (IMPORTANTE: antes que /routes/{route_id})
+# ------------------------
+@app.get("/routes/public", response_model=list[schemas.RouteOut])
+async def list_public_routes(
+    request: Request,
+    bbox: str | None = None,
+    near: str | None = None,
+    radius: float = Query(5000, gt=0, le=200_000),
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Sin filtros: las más recientes.
+    bbox="min_lon,min_lat,max_lon,max_lat": rutas que pasan por el viewport.
+    near="lat,lon" (+ radius en metros): rutas cercanas, de más a menos cerca.
+    """
+    if bbox and near:
+        raise HTTPException(status_code=400, detail="BBOX_OR_NEAR")
+
+    box = None
+    if bbox:
+        try:
+            box = spatial.BBox.parse(bbox)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="BAD_BBOX")
+
+    point = None
+    if near:
+        try:
+            lat, lon = (float(x) for x in near.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="BAD_NEAR")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise HTTPException(status_code=400, detail="BAD_NEAR")
+        point = (lat, lon)
+
+    async def query() -> bytes:
+        q = select(models.Route).where(models.Route.visibility == "public")
+
+        if box:
+            q = q.where(spatial.candidates_filter(models.Route, box))
+
+        if point:
+            lat, lon = point
+            around = spatial.BBox.around(lat, lon, radius)
+            candidates = await db.scalars(
+                q.where(spatial.candidates_filter(models.Route, around))
+                .order_by(spatial.distance_order(models.Route, lat, lon), models.Route.id)
+                .limit(limit * spatial.NEAR_CANDIDATES_PER_RESULT)
+            )
+            by_distance = []
+            for route in candidates:
+                d = spatial.distance_to_bbox_m(lat, lon, spatial.route_bbox(route))
+                if d <= radius:
+                    by_distance.append((d, route))
+            by_distance.sort(key=lambda pair: pair[0])
+            routes = [route for _, route in by_distance[:limit]]
+        else:
+            routes = (
+                await db.scalars(
+                    q.order_by(models.Route.created_at.desc(), models.Route.id.desc()).limit(limit)
+                )
+            ).all()
+
+        return httpcache.serialize(list[schemas.RouteOut], routes)
+
+    # la respuesta es la misma para todos: caché compartida + single-flight
+    key = f"{box}|{point}|{radius if point else ''}|{limit}"
+    body = await respcache.response_cache.get_or_compute(respcache.PUBLIC_ROUTES, key, query)
+    return httpcache.bytes_response(request, body)
+
+# ------------------------
+# Mapa de calor de rutas públicas (ver heatmap.py)
+# ------------------------
+async def heat_tile_response(request: Request, db: AsyncSession, z: int, x: int, y: int, fmt: str) -> Response:
+    if not heatmap.valid_tile(z, x, y):
+        raise HTTPException(status_code=400, detail="BAD_TILE")
+
+    version = await db.scalar(
+        select(models.HeatTile.version).where(
+            models.HeatTile.z == z, models.HeatTile.x == x, models.HeatTile.y == y
+        )
+    ) or 0
+    etag = httpcache.make_etag("heat", fmt, z, x, y, version)
+    if httpcache.matches(request, etag):
+        return httpcache.not_modified(etag, heatmap.TILE_CACHE_CONTROL)
+
+    read, encode = {
+        "json": (heatmap.read_tile, heatmap.encode_tile),
+        "png": (heatmap.read_tile_png, lambda z, x, y, rows: heatmap.render_png(rows)),
+    }[fmt]
+
+    async def query() -> bytes:
+        return await db.run_sync(read, z, x, y)
+
+    if version:
+        body = await respcache.response_cache.get_or_compute(
+            respcache.HEAT_TILES, f"{fmt}/{z}/{x}/{y}/{version}", query
         )
-        cond = or_(cond_mine, cond_public, cond_friends)
     else:
-        cond = or_(cond_mine, cond_public)
-
-    routes = (
-        db.query(models.Route)
-        .filter(cond)
-        .order_by(models.Route.created_at.desc())
-        .limit(50)
-        .all()
+        body = encode(z, x, y, [])
+    return Response(
+        body,
+        media_type="image/png" if fmt == "png" else "application/json",
+        headers=httpcache.cache_headers(etag, heatmap.TILE_CACHE_CONTROL),
+    )
+
+@app.get("/tiles/url", response_model=schemas.HeatTilesOut)
+def heat_tiles_url(user: auth.Principal = Depends(get_current_user)):
+    """
+    Plantilla de URL de los PNG para una capa de tiles del mapa, con la
+    clave firmada (caduca: pedirla otra vez al abrir el mapa).
+    """
+    key, expires_at = security.create_tiles_key()
+    return schemas.HeatTilesOut(
+        url_template=f"/tiles/{{z}}/{{x}}/{{y}}.png?key={key}",
+        expires_at=expires_at,
+        min_zoom=heatmap.HEAT_MIN_ZOOM,
+        max_zoom=heatmap.HEAT_MAX_ZOOM,
     )
 
-    return routes
+@app.get("/tiles/{z:int}/{x:int}/{y:int}.png")
+async def heat_tile_png(
+    request: Request,
+    z: int,
+    x: int,
+    y: int,
+    key: str = Query(...),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Sin Authorization: la `key` de GET /tiles/url.
+    """
+    if not security.check_tiles_key(key):
+        raise HTTPException(status_code=401, detail="BAD_TILES_KEY")
+    return await heat_tile_response(request, db, z, x, y, "png")
+
+@app.get("/tiles/{z:int}/{x:int}/{y:int}")
+async def heat_tile(
+    request: Request,
+    z: int,
+    x: int,
+    y: int,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    return await heat_tile_response(request, db, z, x, y, "json")
 
 # ------------------------
-# Public routes (IMPORTANTE: antes que /routes/{route_id})
+# Segmentos y leaderboards (ver segments.py)
 # ------------------------
-@app.get("/routes/public", response_model=list[schemas.RouteOut])
-def list_public_routes(
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
-):
-    routes = (
-        db.query(models.Route)
-        .filter(models.Route.visibility == "public")
-        .order_by(models.Route.created_at.desc())
-        .limit(50)
-        .all()
+def segment_out(segment: models.Segment) -> schemas.SegmentOut:
+    """
+    Necesita path_blob cargado.
+    """
+    cols = pathcodec.decode_columns(segment.path_blob)
+    return schemas.SegmentOut(
+        id=segment.id,
+        user_id=segment.user_id,
+        source_route_id=segment.source_route_id,
+        name=segment.name,
+        distance_m=segment.distance_m,
+        path_polyline=pathcodec.encode_polyline(cols["lat"], cols["lon"]),
+        created_at=segment.created_at,
     )
-    return routes
+
+@app.post("/segments", response_model=schemas.SegmentOut, status_code=201)
+async def create_segment(
+    data: schemas.SegmentCreate,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Segmento a partir del tramo [start_index, end_index] de una ruta. Los
+    tiempos de las rutas que ya lo recorrían se calculan en segundo plano.
+    """
+    name = data.name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="BAD_NAME")
+
+    route = await db.scalar(
+        select(models.Route).options(undefer_group("path")).where(models.Route.id == data.route_id)
+    )
+    if not route:
+        raise HTTPException(status_code=404, detail="ROUTE_NOT_FOUND")
+    if not await can_view_route(db, user, route):
+        raise HTTPException(status_code=403, detail="FORBIDDEN")
+    # el segmento enseña el trazado a quien pueda verlo: de rutas ajenas,
+    # solo si son públicas
+    if route.user_id != user.id and route.visibility != "public":
+        raise HTTPException(status_code=403, detail="ROUTE_NOT_PUBLIC")
+
+    cols = await run_in_threadpool(pathcodec.route_columns, route)
+    try:
+        values = await run_in_threadpool(segments.build, cols, data.start_index, data.end_index)
+    except segments.SegmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    segment = models.Segment(
+        user_id=user.id,
+        source_route_id=route.id,
+        name=name,
+        visibility=segments.visibility_for(route, user.id),
+        **values,
+    )
+    db.add(segment)
+    await db.commit()
+
+    segments.matcher.submit_segment(segment.id)
+    return segment_out(segment)
+
+@app.get("/segments/{segment_id:uuid}", response_model=schemas.SegmentOut)
+async def get_segment(
+    segment_id: UUID,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    segment = await db.scalar(
+        select(models.Segment).options(undefer(models.Segment.path_blob)).where(models.Segment.id == segment_id)
+    )
+    # 404 también si no lo puedo ver: no se dice que existe
+    if not segment or not await can_view_route(db, user, segment):
+        raise HTTPException(status_code=404, detail="SEGMENT_NOT_FOUND")
+    return segment_out(segment)
+
+@app.get("/segments/{segment_id:uuid}/leaderboard", response_model=list[schemas.LeaderboardEntryOut])
+async def segment_leaderboard(
+    segment_id: UUID,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Mejor tiempo de cada usuario, solo con las rutas que puedo ver.
+    """
+    segment = await db.get(models.Segment, segment_id)
+    if not segment or not await can_view_route(db, user, segment):
+        raise HTTPException(status_code=404, detail="SEGMENT_NOT_FOUND")
+
+    friend_ids = await friendcache.friend_cache.friends_of(db, user.id)
+    rows = await db.execute(segments.leaderboard_query(segment_id, user.id, friend_ids, limit))
+    return [
+        schemas.LeaderboardEntryOut(
+            rank=i,
+            user_id=row.user_id,
+            user_name=row.name,
+            route_id=row.route_id,
+            elapsed_s=row.elapsed_s,
+            started_at=row.started_at,
+        )
+        for i, row in enumerate(rows, start=1)
+    ]
 
 # ------------------------
 # Route detail + update + delete
 # ------------------------
-def can_view_route(db: Session, viewer: models.User, route: models.Route) -> bool:
-    if route.user_id == viewer.id:
-        return True
-    if route.visibility == "public":
-        return True
-    if route.visibility == "friends":
-        is_friend = (
-            db.query(models.Friend)
-            .filter(models.Friend.user_id == viewer.id, models.Friend.friend_id == route.user_id)
-            .first()
-        )
-        return is_friend is not None
-    return False
+async def can_view_route(db: AsyncSession, viewer: auth.Principal, route: models.Route | models.Segment) -> bool:
+    # vale para cualquier fila con user_id + visibility (también segmentos)
+    # solo las rutas "friends" de otros necesitan saber los amigos
+    friend_ids = frozenset()
+    if route.visibility == "friends" and route.user_id != viewer.id:
+        friend_ids = await friendcache.friend_cache.friends_of(db, viewer.id)
+    return friendcache.can_view(viewer.id, friend_ids, route)
+
+def route_detail(
+    route: models.Route,
+    path_format: schemas.PathFormat,
+    lod: schemas.PathLod | None = "full",
+) -> dict:
+    """
+    Necesita cargadas la columna del LOD pedido (o path/path_blob si es
+    "full" o la ruta es antigua): no hace consultas. Con lod=None no se
+    incluye el path.
+
+    Devuelve el dict listo para FastJSONResponse: los campos pasan por
+    RouteDetailOut, pero el path (miles de puntos) se añade después para
+    no validarlo punto a punto.
+    """
+    out = schemas.RouteDetailOut(
+        id=route.id,
+        user_id=route.user_id,
+        name=route.name,
+        distance_m=route.distance_m,
+        duration_s=route.duration_s,
+        moving_time_s=route.moving_time_s,
+        max_speed_ms=route.max_speed_ms,
+        avg_moving_speed_ms=route.avg_moving_speed_ms,
+        splits_s=route.splits_s,
+        visibility=route.visibility,
+        created_at=route.created_at,
+    )
+    if lod is None:
+        return out.model_dump(mode="json")
+
+    if lod == "full":
+        blob = route.path_blob
+    else:
+        blob = getattr(route, f"path_lod_{lod}")
+        if blob is None:
+            # ruta antigua sin LODs precalculados
+            blob = simplify.encode_lods(pathcodec.route_columns(route))[lod]
+
+    if path_format == "compact":
+        blob = blob or pathcodec.encode_path(route.path or [])
+        out.path_encoded = base64.b64encode(blob).decode("ascii")
+    elif path_format == "polyline":
+        cols = pathcodec.decode_columns(blob) if blob else pathcodec.route_columns(route)
+        out.path_polyline = pathcodec.encode_polyline(cols["lat"], cols["lon"])
+
+    body = out.model_dump(mode="json")
+    if path_format == "list":
+        body["path"] = pathcodec.decode_path(blob) if blob else pathcodec.route_points(route)
+    return body
+
+@app.post("/routes/batch", response_model=schemas.RouteBatchOut)
+async def get_routes_batch(
+    data: schemas.RouteBatchIn,
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    """
+    Varias rutas en una sola consulta, con la visibilidad resuelta en SQL
+    (ver friendgraph.visible_routes_query). Solo se lee la columna del LOD
+    pedido; las rutas antiguas sin LODs cuestan una consulta más entre
+    todas.
+    """
+    if len(data.ids) > friendgraph.MAX_ROUTE_BATCH:
+        raise HTTPException(status_code=400, detail="TOO_MANY_IDS")
+    ids = list(dict.fromkeys(data.ids))
+    if not ids:
+        return {"routes": [], "missing": []}
+
+    q = friendgraph.visible_routes_query(user.id).where(models.Route.id.in_(ids))
+    if data.lod == "full":
+        q = q.options(undefer_group("path"))
+    elif data.lod is not None:
+        q = q.options(undefer(getattr(models.Route, f"path_lod_{data.lod}")))
+    routes = {r.id: r for r in (await db.scalars(q)).all()}
+
+    if data.lod not in (None, "full"):
+        legacy = [rid for rid, r in routes.items() if getattr(r, f"path_lod_{data.lod}") is None]
+        if legacy:
+            await db.scalars(
+                select(models.Route)
+                .options(undefer_group("path"))
+                .where(models.Route.id.in_(legacy))
+            )
+
+    found = [routes[rid] for rid in ids if rid in routes]
+    # decodificar/serializar los paths es CPU: fuera del event loop
+    body = await run_in_threadpool(
+        lambda: [route_detail(route, data.path_format, data.lod) for route in found]
+    )
+    return fastjson.FastJSONResponse({"routes": body, "missing": [str(rid) for rid in ids if rid not in routes]})
 
 @app.get("/routes/{route_id:uuid}", response_model=schemas.RouteDetailOut)
-def get_route_by_id(
+async def get_route_by_id(
+    request: Request,
     route_id: UUID,
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+    path_format: schemas.PathFormat = "list",
+    lod: schemas.PathLod = "full",
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    route = db.query(models.Route).filter(models.Route.id == route_id).first()
+    # solo cargamos la columna del nivel de detalle pedido
+    path_attrs = ["path", "path_blob"] if lod == "full" else [f"path_lod_{lod}"]
+    load_path = (
+        undefer_group("path")
+        if lod == "full"
+        else undefer(getattr(models.Route, f"path_lod_{lod}"))
+    )
+    # petición condicional: primero solo la fila; si el ETag casa el path
+    # ni se lee
+    conditional = "if-none-match" in request.headers
+    q = select(models.Route).where(models.Route.id == route_id)
+    route = await db.scalar(q if conditional else q.options(load_path))
     if not route:
         raise HTTPException(status_code=404, detail="ROUTE_NOT_FOUND")
 
-    if not can_view_route(db, user, route):
+    if not await can_view_route(db, user, route):
         raise HTTPException(status_code=403, detail="FORBIDDEN")
 
-    return route
+    etag = httpcache.route_etag(route, path_format, lod)
+    if httpcache.matches(request, etag):
+        return httpcache.not_modified(etag)
+
+    if conditional:
+        await db.refresh(route, path_attrs)
+
+    if lod != "full" and getattr(route, f"path_lod_{lod}") is None:
+        await db.refresh(route, ["path", "path_blob"])
+
+    # decodificar/simplificar/serializar es CPU: fuera del event loop
+    body = await run_in_threadpool(route_detail, route, path_format, lod)
+    return fastjson.FastJSONResponse(body, headers=httpcache.cache_headers(etag))
+
+@app.get("/routes/{route_id:uuid}/export")
+async def export_route(
+    request: Request,
+    route_id: UUID,
+    format: Literal["gpx", "geojson", "csv"] = "gpx",
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
+):
+    conditional = "if-none-match" in request.headers
+    q = select(models.Route).where(models.Route.id == route_id)
+    route = await db.scalar(q if conditional else q.options(undefer_group("path")))
+    if not route:
+        raise HTTPException(status_code=404, detail="ROUTE_NOT_FOUND")
+
+    if not await can_view_route(db, user, route):
+        raise HTTPException(status_code=403, detail="FORBIDDEN")
+
+    etag = httpcache.route_etag(route, "export", format)
+    if httpcache.matches(request, etag):
+        return httpcache.not_modified(etag)
+    if conditional:
+        await db.refresh(route, ["path", "path_blob"])
+
+    return StreamingResponse(
+        export.route_stream(route, format),
+        media_type=export.MEDIA_TYPES[format],
+        headers={
+            **httpcache.cache_headers(etag),
+            "Content-Disposition": f'attachment; filename="{export.filename(route, format)}"',
+        },
+    )
+
+async def update_heatmap(db: AsyncSession, route: models.Route, delta: int) -> None:
+    """
+    Suma o resta la ruta del mapa de calor (dentro de la transacción de
+    la petición). Las celdas se calculan fuera del event loop.
+    """
+    await db.refresh(route, ["path", "path_blob"])
+    bins = await run_in_threadpool(heatmap.route_bins_of, route)
+    await db.run_sync(heatmap.apply, bins, delta)
 
 @app.patch("/routes/{route_id:uuid}", response_model=schemas.RouteOut)
-def update_route(
+async def update_route(
     route_id: UUID,
     data: schemas.RouteUpdateIn,
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    route = db.query(models.Route).filter(models.Route.id == route_id).first()
+    route = await db.get(models.Route, route_id)
     if not route:
         raise HTTPException(status_code=404, detail="ROUTE_NOT_FOUND")
 
@@ -433,26 +1215,45 @@ def update_route(
             raise HTTPException(status_code=400, detail="BAD_NAME")
         route.name = new_name
 
-    if data.visibility is not None:
+    was_public = route.visibility == "public"
+    if data.visibility is not None and data.visibility != route.visibility:
         route.visibility = data.visibility
+        await db.run_sync(lambda s: feed.fan_out_route(s, route))
+        await db.run_sync(segments.route_visibility_changed, route)
+        if was_public or route.visibility == "public":
+            await update_heatmap(db, route, +1 if route.visibility == "public" else -1)
 
-    db.commit()
-    db.refresh(route)
+    await db.run_sync(sync.route_changed, route, was_public or route.visibility == "public")
+    await db.commit()
+    await db.refresh(route)
+
+    if was_public or route.visibility == "public":
+        await respcache.response_cache.invalidate(respcache.PUBLIC_ROUTES)
     return route
 
 @app.delete("/routes/{route_id:uuid}", response_model=schemas.RouteDeleteOut)
-def delete_route(
+async def delete_route(
     route_id: UUID,
-    db: Session = Depends(get_db),
-    user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: auth.Principal = Depends(get_current_user),
 ):
-    route = db.query(models.Route).filter(models.Route.id == route_id).first()
+    route = await db.get(models.Route, route_id)
     if not route:
         raise HTTPException(status_code=404, detail="ROUTE_NOT_FOUND")
 
     if route.user_id != user.id:
         raise HTTPException(status_code=403, detail="NOT_OWNER")
 
-    db.delete(route)
-    db.commit()
+    was_public = route.visibility == "public"
+    await db.run_sync(feed.drop_route, route.id)
+    await db.run_sync(segments.drop_route, route.id)
+    await db.run_sync(userstats.remove_route, route)
+    await db.run_sync(sync.route_changed, route, was_public)
+    if was_public:
+        await update_heatmap(db, route, -1)
+    await db.delete(route)
+    await db.commit()
+
+    if was_public:
+        await respcache.response_cache.invalidate(respcache.PUBLIC_ROUTES)
     return {"status": "deleted"}
@@ -0,0 +1,263 @@
+"""
+Migraciones "ligeras" que se ejecutan en el startup.
+
+`Base.metadata.create_all` solo crea tablas que no existen: no añade
+índices ni columnas nuevas a tablas ya creadas. Aquí van esos pasos,
+siempre idempotentes para poder correr en cada arranque.
+"""
+from sqlalchemy import func, inspect, null, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, undefer_group
+
+from . import models, feed, heatmap, pathcodec, stats, spatial, usersearch, userstats, sync
+
+# (tabla, columna) añadidas después de que la tabla existiera en producción
+ADDED_COLUMNS = [
+    (models.User.__table__, "name_lower"),
+    (models.Route.__table__, "path_blob"),
+    (models.Route.__table__, "path_lod_low"),
+    (models.Route.__table__, "path_lod_medium"),
+    (models.Route.__table__, "moving_time_s"),
+    (models.Route.__table__, "max_speed_ms"),
+    (models.Route.__table__, "avg_moving_speed_ms"),
+    (models.Route.__table__, "splits_s"),
+    (models.Route.__table__, "min_lat"),
+    (models.Route.__table__, "min_lon"),
+    (models.Route.__table__, "max_lat"),
+    (models.Route.__table__, "max_lon"),
+    (models.Route.__table__, "start_lat"),
+    (models.Route.__table__, "start_lon"),
+    (models.Route.__table__, "geohash"),
+    (models.Route.__table__, "updated_at"),
+]
+
+
+def _add_missing_columns(engine: Engine) -> None:
+    insp = inspect(engine)
+    for table, column_name in ADDED_COLUMNS:
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        if column_name in existing:
+            continue
+        column = table.c[column_name]
+        col_type = column.type.compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_name} {col_type}"))
+
+
+def _relax_legacy_path(engine: Engine) -> None:
+    # routes.path era NOT NULL; las rutas nuevas solo rellenan path_blob.
+    # (SQLite no tiene ALTER COLUMN; las BDs locales se crean ya sin NOT NULL)
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE routes ALTER COLUMN path DROP NOT NULL"))
+
+
+def encode_legacy_paths(engine: Engine, batch_size: int = 200) -> int:
+    """
+    Pasa las rutas antiguas de path (JSONB) a path_blob, por lotes.
+    No hace falta para que la API funcione (las lecturas caen al JSONB si
+    no hay blob), pero libera el espacio. Devuelve cuántas rutas migró.
+    """
+    done = 0
+    with Session(engine) as db:
+        while True:
+            routes = (
+                db.query(models.Route)
+                .filter(models.Route.path_blob.is_(None), models.Route.path.is_not(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not routes:
+                return done
+            for route in routes:
+                route.path_blob = pathcodec.encode_path(route.path)
+                route.path = null()  # NULL de SQL, no JSON 'null'
+            db.commit()
+            done += len(routes)
+
+
+def compute_missing_stats(engine: Engine, batch_size: int = 200) -> int:
+    """
+    Calcula las estadísticas de servidor de rutas antiguas, por lotes.
+    Devuelve cuántas rutas actualizó.
+
+    Cambia distance_m / duration_s / moving_time_s de esas rutas, así que
+    si tocó alguna rehace user_stats (totales, marcas y buckets).
+    """
+    done = 0
+    with Session(engine) as db:
+        while True:
+            routes = (
+                db.query(models.Route)
+                .options(undefer_group("path"))
+                .filter(models.Route.moving_time_s.is_(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not routes:
+                break
+            for route in routes:
+                stats.apply(route, stats.compute(pathcodec.route_columns(route)))
+            db.commit()
+            done += len(routes)
+        if done:
+            userstats.rebuild(db)
+    return done
+
+
+def compute_missing_geo(engine: Engine, batch_size: int = 200) -> int:
+    """
+    Rellena bbox/inicio/geohash de rutas antiguas, por lotes (keyset por
+    id: las rutas sin puntos se quedan a NULL y no se vuelven a leer).
+    """
+    done = 0
+    last_id = None
+    with Session(engine) as db:
+        while True:
+            q = (
+                db.query(models.Route)
+                .options(undefer_group("path"))
+                .filter(models.Route.geohash.is_(None))
+                .order_by(models.Route.id)
+            )
+            if last_id is not None:
+                q = q.filter(models.Route.id > last_id)
+            routes = q.limit(batch_size).all()
+            if not routes:
+                return done
+            for route in routes:
+                geo = spatial.route_geo(pathcodec.route_columns(route))
+                if geo:
+                    spatial.apply(route, geo)
+                    done += 1
+            last_id = routes[-1].id
+            db.commit()
+
+
+def reindex_geohash(engine: Engine, batch_size: int = 1000) -> int:
+    """
+    Recalcula el geohash de rutas y segmentos con celda vacía o de un
+    carácter (los que cruzan bordes de celda grandes) con
+    spatial.route_cell. Solo lee el bbox. Devuelve cuántos cambió.
+    """
+    done = 0
+    with Session(engine) as db:
+        for model in (models.Route, models.Segment):
+            last_id = None
+            while True:
+                q = (
+                    select(model.id, model.min_lat, model.min_lon, model.max_lat, model.max_lon, model.geohash)
+                    .where(func.length(model.geohash) <= 1)
+                    .order_by(model.id)
+                    .limit(batch_size)
+                )
+                if last_id is not None:
+                    q = q.where(model.id > last_id)
+                rows = db.execute(q).all()
+                if not rows:
+                    break
+                for row in rows:
+                    cell = spatial.route_cell(spatial.BBox(row.min_lat, row.min_lon, row.max_lat, row.max_lon))
+                    if cell != row.geohash:
+                        db.execute(update(model).where(model.id == row.id).values(geohash=cell))
+                        done += 1
+                last_id = rows[-1].id
+                db.commit()
+    return done
+
+
+def fill_name_lower(engine: Engine, batch_size: int = 1000) -> int:
+    """
+    Rellena users.name_lower de usuarios antiguos (en Python y no con
+    lower() de SQL: el de SQLite solo entiende ASCII).
+    """
+    done = 0
+    with Session(engine) as db:
+        while True:
+            users = (
+                db.query(models.User)
+                .filter(models.User.name_lower.is_(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not users:
+                return done
+            for user in users:
+                user.name_lower = usersearch.normalize(user.name)
+            db.commit()
+            done += len(users)
+
+
+def _ensure_indexes(engine: Engine) -> None:
+    for table in (models.User.__table__, models.Route.__table__, models.FeedEntry.__table__):
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def _ensure_trigram_index(engine: Engine) -> None:
+    # GIN con pg_trgm para LIKE '%q%' sobre name_lower. CREATE EXTENSION
+    # necesita permisos: si falla, la búsqueda sigue funcionando (más lenta).
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_users_name_lower_trgm "
+                "ON users USING gin (name_lower gin_trgm_ops)"
+            ))
+    except Exception as e:
+        print("pg_trgm no disponible:", repr(e))
+
+
+def _backfill_feed(engine: Engine) -> None:
+    with Session(engine) as db:
+        has_entries = db.scalar(select(models.FeedEntry.route_id).limit(1))
+        has_routes = db.scalar(select(models.Route.id).limit(1))
+        if has_routes and not has_entries:
+            feed.rebuild_all(db)
+
+
+def _backfill_user_stats(engine: Engine) -> None:
+    with Session(engine) as db:
+        has_stats = db.scalar(select(models.UserStats.user_id).limit(1))
+        has_routes = db.scalar(select(models.Route.id).limit(1))
+        if has_routes and not has_stats:
+            userstats.rebuild(db)
+
+
+def run(engine: Engine) -> None:
+    _add_missing_columns(engine)
+    _relax_legacy_path(engine)
+    _ensure_indexes(engine)
+    _ensure_trigram_index(engine)
+    fill_name_lower(engine)
+    _backfill_feed(engine)
+    _backfill_user_stats(engine)
+
+
+if __name__ == "__main__":
+    # python -m app.migrations [encode-paths] [compute-stats] [compute-geo] [reindex-geohash] [build-heatmap] [build-user-stats] [prune-sync]
+    import sys
+
+    from .db import engine
+
+    run(engine)
+    if "encode-paths" in sys.argv[1:]:
+        print("Rutas migradas a path_blob:", encode_legacy_paths(engine))
+    if "compute-stats" in sys.argv[1:]:
+        print("Rutas con estadísticas calculadas:", compute_missing_stats(engine))
+    if "compute-geo" in sys.argv[1:]:
+        print("Rutas con bbox/geohash:", compute_missing_geo(engine))
+    if "reindex-geohash" in sys.argv[1:]:
+        print("Rutas/segmentos con geohash recalculado:", reindex_geohash(engine))
+    if "build-heatmap" in sys.argv[1:]:
+        with Session(engine) as db:
+            print("Rutas públicas en el mapa de calor:", heatmap.rebuild(db))
+    if "build-user-stats" in sys.argv[1:]:
+        with Session(engine) as db:
+            print("Rutas en las estadísticas de usuario:", userstats.rebuild(db))
+    if "prune-sync" in sys.argv[1:]:
+        with Session(engine) as db:
+            print("Cambios de /sync borrados:", sync.prune(db))
@@ -1,10 +1,16 @@
 import uuid
-from sqlalchemy import Column, String, DateTime, func, Integer, Enum, ForeignKey, UniqueConstraint
+from datetime import datetime, timezone
+from sqlalchemy import Column, String, Date, DateTime, func, Integer, SmallInteger, BigInteger, Float, Enum, ForeignKey, UniqueConstraint, Index, LargeBinary, JSON
 from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import deferred
 
 from .db import Base
 
 
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -16,6 +22,13 @@ class User(Base):
     )
     email = Column(String, unique=True, index=True, nullable=False)
     name = Column(String, nullable=False)
+    # lower(name) para búsquedas (usersearch.py). Collation "C" en Postgres
+    # para que el LIKE 'q%' use el B-tree; el substring va por el índice
+    # trigram que crea migrations.py.
+    name_lower = Column(
+        String().with_variant(String(collation="C"), "postgresql"),
+        nullable=True,
+    )
     password_hash = Column(String, nullable=False)
     created_at = Column(
         DateTime(timezone=True),
@@ -23,6 +36,10 @@ class User(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        Index("ix_users_name_lower", "name_lower"),
+    )
+
 
 class Route(Base):
     __tablename__ = "routes"
@@ -45,7 +62,38 @@ class Route(Base):
     distance_m = Column(Integer, nullable=False)
     duration_s = Column(Integer, nullable=False)
 
-    path = Column(JSONB, nullable=False)
+    # Calculado en el servidor a partir del path (stats.py).
+    # NULL en rutas antiguas hasta pasar `python -m app.migrations compute-stats`.
+    moving_time_s = Column(Integer, nullable=True)
+    max_speed_ms = Column(Float, nullable=True)
+    avg_moving_speed_ms = Column(Float, nullable=True)
+    splits_s = Column(JSON, nullable=True)
+
+    # bbox, punto de inicio y celda geohash que contiene el bbox (spatial.py).
+    # Collation "C" en Postgres para que las búsquedas por rango de prefijo
+    # usen el índice.
+    min_lat = Column(Float, nullable=True)
+    min_lon = Column(Float, nullable=True)
+    max_lat = Column(Float, nullable=True)
+    max_lon = Column(Float, nullable=True)
+    start_lat = Column(Float, nullable=True)
+    start_lon = Column(Float, nullable=True)
+    geohash = Column(
+        String(12).with_variant(String(12, collation="C"), "postgresql"),
+        nullable=True,
+    )
+
+    # Formato antiguo (lista de RoutePoint en JSONB). Las rutas nuevas lo
+    # dejan a NULL y guardan path_blob (ver pathcodec.py).
+    # Ambas son deferred: los listados no deben cargar el path.
+    # (JSON genérico fuera de Postgres: la BD local/benchmark es SQLite)
+    path = deferred(Column(JSON().with_variant(JSONB, "postgresql"), nullable=True), group="path")
+    path_blob = deferred(Column(LargeBinary, nullable=True), group="path")
+
+    # Versiones simplificadas (simplify.py), mismo formato que path_blob.
+    # NULL en rutas antiguas: se calculan al vuelo.
+    path_lod_low = deferred(Column(LargeBinary, nullable=True))
+    path_lod_medium = deferred(Column(LargeBinary, nullable=True))
 
     visibility = Column(
         Enum("private", "friends", "public", name="route_visibility"),
@@ -53,11 +101,125 @@ class Route(Base):
         server_default="private",
     )
 
+    # default en Python además del server_default: el cursor del feed
+    # compara created_at con precisión de microsegundos (también en SQLite)
     created_at = Column(
         DateTime(timezone=True),
+        default=_utcnow,
         server_default=func.now(),
         nullable=False,
     )
+    # Se mueve con cualquier UPDATE por el ORM (nombre, visibilidad, stats
+    # recalculadas): es la versión de la ruta para los ETag. NULL hasta el
+    # primer cambio.
+    updated_at = Column(DateTime(timezone=True), nullable=True, onupdate=_utcnow)
+
+    __table_args__ = (
+        # "mis rutas" y la parte propia del feed
+        Index("ix_routes_user_created", "user_id", created_at.desc(), id.desc()),
+        # rutas públicas más recientes (feed + /routes/public)
+        Index("ix_routes_visibility_created", "visibility", created_at.desc(), id.desc()),
+        # consultas por viewport / cercanía
+        Index("ix_routes_visibility_geohash", "visibility", "geohash"),
+    )
+
+
+class FeedEntry(Base):
+    """
+    Timeline precalculado (fan-out on write): una fila por (lector, ruta).
+    Se rellena al crear/editar rutas y al aceptar amistades. Las rutas
+    públicas de desconocidos NO se copian aquí: se mezclan al leer desde
+    el índice (visibility, created_at).
+    """
+    __tablename__ = "feed_entries"
+
+    owner_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    route_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("routes.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+
+    author_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+
+    # copia de Route.created_at para paginar sin join
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_feed_entries_owner_created", "owner_id", created_at.desc(), route_id.desc()),
+    )
+
+
+class RecordingSession(Base):
+    """
+    Ruta que se está subiendo por trozos mientras se graba
+    (POST /recordings -> .../points -> .../finalize).
+    Distancia y duración se van acumulando con cada trozo.
+    """
+    __tablename__ = "recording_sessions"
+
+    id = Column(
+        UUID(as_uuid=True),
+        primary_key=True,
+        default=uuid.uuid4,
+    )
+
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+
+    point_count = Column(Integer, nullable=False, default=0)
+    chunk_count = Column(Integer, nullable=False, default=0)
+    distance_m = Column(Float, nullable=False, default=0.0)
+
+    # primer t y último punto, para seguir acumulando sin releer trozos
+    first_t = Column(BigInteger, nullable=True)
+    last_t = Column(BigInteger, nullable=True)
+    last_lat = Column(Float, nullable=True)
+    last_lon = Column(Float, nullable=True)
+
+    created_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+
+    updated_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
+
+
+class RecordingChunk(Base):
+    __tablename__ = "recording_chunks"
+
+    session_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("recording_sessions.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    # número de trozo que manda el cliente (0, 1, 2...): reintentos idempotentes
+    seq = Column(Integer, primary_key=True)
+
+    # formato pathcodec
+    points = Column(LargeBinary, nullable=False)
 
 
 class FriendRequest(Base):
@@ -122,3 +284,266 @@ class Friend(Base):
         server_default=func.now(),
         nullable=False,
     )
+
+
+class ImportJob(Base):
+    """
+    Importación en bloque de rutas (POST /imports, ver imports.py). El
+    cliente consulta el progreso con GET /imports/{id}.
+    """
+    __tablename__ = "import_jobs"
+
+    id = Column(
+        UUID(as_uuid=True),
+        primary_key=True,
+        default=uuid.uuid4,
+    )
+
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+
+    status = Column(
+        Enum("pending", "running", "done", "failed", name="import_job_status"),
+        nullable=False,
+        default="pending",
+    )
+    # visibilidad de las rutas importadas
+    visibility = Column(
+        Enum("private", "friends", "public", name="route_visibility"),
+        nullable=False,
+        default="private",
+    )
+
+    # ficheros encontrados / procesados / con error; rutas creadas
+    total_files = Column(Integer, nullable=False, default=0)
+    processed_files = Column(Integer, nullable=False, default=0)
+    failed_files = Column(Integer, nullable=False, default=0)
+    imported_routes = Column(Integer, nullable=False, default=0)
+    # [{"file": ..., "error": CODIGO}], como mucho imports.MAX_ERRORS
+    errors = Column(JSON, nullable=False, default=list)
+
+    created_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+    # se mueve con cada lote: un trabajo sin terminar que deja de moverse
+    # murió con su proceso (imports.is_stale)
+    updated_at = Column(DateTime(timezone=True), nullable=True, default=_utcnow, onupdate=_utcnow)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class HeatBin(Base):
+    """
+    Mapa de calor de las rutas públicas (heatmap.py): cada tile z/x/y se
+    divide en heatmap.BINS x heatmap.BINS celdas y `count` es cuántas
+    rutas pasan por la celda. Solo se guardan las celdas con rutas.
+    """
+    __tablename__ = "heat_bins"
+
+    z = Column(SmallInteger, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    # fila * BINS + columna dentro del tile
+    bin = Column(SmallInteger, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+
+class HeatTile(Base):
+    """
+    Versión de cada tile con datos: sube con cada cambio de sus celdas y
+    es la clave de la caché y del ETag de GET /tiles/{z}/{x}/{y}.
+    """
+    __tablename__ = "heat_tiles"
+
+    z = Column(SmallInteger, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+
+class Segment(Base):
+    """
+    Tramo definido por un usuario a partir de una ruta (segments.py). Las
+    rutas que lo recorren guardan su tiempo en SegmentEffort.
+    """
+    __tablename__ = "segments"
+
+    id = Column(
+        UUID(as_uuid=True),
+        primary_key=True,
+        default=uuid.uuid4,
+    )
+
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    source_route_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("routes.id", ondelete="SET NULL"),
+        nullable=True,
+    )
+
+    name = Column(String, nullable=False)
+    distance_m = Column(Integer, nullable=False)
+
+    # polilínea simplificada, formato pathcodec
+    path_blob = deferred(Column(LargeBinary, nullable=False))
+
+    # la de la ruta de origen (el segmento enseña su trazado): ver
+    # segments.visibility_for
+    visibility = Column(
+        Enum("private", "friends", "public", name="route_visibility"),
+        nullable=False,
+        server_default="private",
+    )
+
+    # mismo esquema que Route para el filtro espacial (spatial.py)
+    min_lat = Column(Float, nullable=False)
+    min_lon = Column(Float, nullable=False)
+    max_lat = Column(Float, nullable=False)
+    max_lon = Column(Float, nullable=False)
+    start_lat = Column(Float, nullable=False)
+    start_lon = Column(Float, nullable=False)
+    end_lat = Column(Float, nullable=False)
+    end_lon = Column(Float, nullable=False)
+    geohash = Column(
+        String(12).with_variant(String(12, collation="C"), "postgresql"),
+        nullable=False,
+        index=True,
+    )
+
+    created_at = Column(
+        DateTime(timezone=True),
+        default=_utcnow,
+        server_default=func.now(),
+        nullable=False,
+    )
+
+
+class SegmentEffort(Base):
+    """
+    Una pasada de una ruta por un segmento (la mejor, si lo recorre varias
+    veces). El leaderboard se lee de aquí filtrando por la visibilidad
+    actual de la ruta.
+    """
+    __tablename__ = "segment_efforts"
+
+    segment_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("segments.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    route_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("routes.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    elapsed_s = Column(Integer, nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # leaderboard: los más rápidos de un segmento
+        Index("ix_segment_efforts_segment_elapsed", "segment_id", "elapsed_s"),
+    )
+
+
+class UserStats(Base):
+    """
+    Totales y mejores marcas de cada usuario (userstats.py), mantenidos en
+    la misma transacción que crea o borra la ruta. Una fila por usuario
+    con al menos una ruta.
+    """
+    __tablename__ = "user_stats"
+
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+    route_count = Column(Integer, nullable=False, default=0)
+    total_distance_m = Column(BigInteger, nullable=False, default=0)
+    total_duration_s = Column(BigInteger, nullable=False, default=0)
+    total_moving_time_s = Column(BigInteger, nullable=False, default=0)
+
+    # mejores marcas: valor + ruta (NULL si no hay ninguna)
+    best_distance_m = Column(Integer, nullable=True)
+    best_distance_route_id = Column(UUID(as_uuid=True), nullable=True)
+    best_duration_s = Column(Integer, nullable=True)
+    best_duration_route_id = Column(UUID(as_uuid=True), nullable=True)
+    best_avg_speed_ms = Column(Float, nullable=True)
+    best_avg_speed_route_id = Column(UUID(as_uuid=True), nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=_utcnow, onupdate=_utcnow)
+
+
+class UserStatBucket(Base):
+    """
+    Totales por semana (lunes, UTC) y por mes de cada usuario, según el
+    created_at de la ruta. Se borran al quedarse a cero.
+    """
+    __tablename__ = "user_stat_buckets"
+
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    period = Column(
+        Enum("week", "month", name="stat_period"),
+        primary_key=True,
+    )
+    start = Column(Date, primary_key=True)
+
+    route_count = Column(Integer, nullable=False, default=0)
+    distance_m = Column(BigInteger, nullable=False, default=0)
+    duration_s = Column(BigInteger, nullable=False, default=0)
+
+
+class SyncChange(Base):
+    """
+    Registro de cambios para GET /sync (sync.py): "la entidad `entity_id`
+    de tipo `kind` ha cambiado para `user_id`" (NULL = para todos). `seq`
+    es el cursor de los clientes.
+    """
+    __tablename__ = "sync_changes"
+
+    # BIGSERIAL en Postgres; en SQLite solo INTEGER PRIMARY KEY es autoincremental
+    seq = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=True,
+    )
+    kind = Column(
+        Enum("route", "feed", "friend", "friend_request", name="sync_kind"),
+        nullable=False,
+    )
+    entity_id = Column(UUID(as_uuid=True), nullable=False)
+
+    created_at = Column(
+        DateTime(timezone=True),
+        default=_utcnow,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        # cambios de un usuario (o de todos, user_id IS NULL) desde un seq
+        Index("ix_sync_changes_user_seq", "user_id", "seq"),
+    )
@@ -0,0 +1,250 @@
+"""
+Codificación compacta de Route.path.
+
+Formato binario "RP1" (columnar):
+  cabecera  b"RP1" + versión (1 byte) + n puntos (uint32) + bases lat/lon/t (3 x int64)
+  cuerpo    5 columnas int32 little-endian, comprimidas con zlib:
+              lat, lon  -> delta de micro-grados (1e-6 ≈ 0.1 m)
+              t         -> delta de milisegundos desde el último t
+                           no nulo (base = el primero no nulo)
+              accuracy  -> décimas de metro, sin delta
+              speed     -> centésimas de m/s, sin delta
+            Los nulos de t/accuracy/speed se guardan como NULL_INT (que
+            nunca es una delta válida: su valor absoluto no cabe en int32).
+
+lat/lon tienen que ser finitos y estar en rango: si no, ValueError (la
+API lo devuelve como BAD_PATH). accuracy/speed no finitos son nulos.
+
+Con las deltas casi todo son bytes a cero, así que zlib deja un punto en
+pocos bytes frente a ~90 del objeto JSON.
+
+Los blobs que manda el cliente se decodifican con `max_points`: la
+cabecera se comprueba antes de descomprimir y zlib nunca saca más de los
+POINT_SIZE * n bytes que anuncia (un blob de pocos KB podría expandirse a
+gigas).
+"""
+import struct
+import zlib
+from typing import Any, Iterable
+
+import numpy as np
+
+MAGIC = b"RP1"
+VERSION = 1
+
+COORD_SCALE = 1_000_000
+ACCURACY_SCALE = 10
+SPEED_SCALE = 100
+NULL_INT = np.iinfo(np.int32).min
+INT32_MAX = np.iinfo(np.int32).max
+# t en ms: de sobra para cualquier fecha, y exacto en float64
+MAX_ABS_T = 2 ** 52
+
+_HEADER = struct.Struct("<3sBIqqq")
+# bytes por punto en el cuerpo descomprimido (5 x int32)
+POINT_SIZE = 20
+# máximo de puntos de una ruta subida por la API (JSON o binario)
+MAX_POINTS = 50_000
+
+# Columnas de RoutePoint (src/lib/location-task.ts)
+FIELDS = ("lat", "lon", "t", "accuracy", "speed")
+
+
+class PathDecodeError(ValueError):
+    pass
+
+
+class PathTooLarge(PathDecodeError):
+    pass
+
+
+def points_to_columns(points: Iterable[Any]) -> dict[str, np.ndarray]:
+    """
+    Lista de dicts -> columnas float64 (NaN = null). Los puntos sin lat/lon
+    válidos se descartan.
+    """
+    rows = []
+    for p in points:
+        if not isinstance(p, dict):
+            continue
+        try:
+            lat = float(p["lat"])
+            lon = float(p["lon"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        row = [lat, lon]
+        for key in ("t", "accuracy", "speed"):
+            v = p.get(key)
+            try:
+                row.append(float(v) if v is not None else np.nan)
+            except (TypeError, ValueError):
+                row.append(np.nan)
+        rows.append(row)
+
+    arr = np.asarray(rows, dtype=np.float64).reshape(-1, len(FIELDS))
+    return {name: arr[:, i] for i, name in enumerate(FIELDS)}
+
+
+def columns_to_points(cols: dict[str, np.ndarray]) -> list[dict]:
+    def as_list(col: np.ndarray, cast) -> list:
+        # NaN != NaN: así detectamos los nulos ya sobre la lista de Python
+        return [None if v != v else cast(v) for v in col.tolist()]
+
+    return [
+        {"lat": lat, "lon": lon, "t": t, "accuracy": acc, "speed": spd}
+        for lat, lon, t, acc, spd in zip(
+            cols["lat"].tolist(),
+            cols["lon"].tolist(),
+            as_list(cols["t"], int),
+            as_list(cols["accuracy"], float),
+            as_list(cols["speed"], float),
+        )
+    ]
+
+
+def _fixed(values: np.ndarray, scale: int) -> np.ndarray:
+    out = np.full(values.shape, NULL_INT, dtype=np.int64)
+    ok = np.isfinite(values)
+    # recorte antes de pasar a entero: 1e300 no puede dar la vuelta
+    out[ok] = np.clip(np.rint(values[ok] * scale), NULL_INT + 1, INT32_MAX)
+    return out
+
+
+def _delta(values: np.ndarray) -> tuple[int, np.ndarray]:
+    if len(values) == 0:
+        return 0, values.astype(np.int32)
+    d = np.diff(values, prepend=values[0])
+    if np.abs(d).max(initial=0) > INT32_MAX:
+        raise ValueError("Salto demasiado grande entre puntos")
+    return int(values[0]), d.astype(np.int32)
+
+
+def _delta_nullable(values: np.ndarray) -> tuple[int, np.ndarray]:
+    """
+    Como _delta, pero los no finitos van como NULL_INT y la delta de cada
+    valor es respecto al anterior no nulo.
+    """
+    ok = np.isfinite(values)
+    out = np.full(values.shape, NULL_INT, dtype=np.int32)
+    if not ok.any():
+        return 0, out
+    if np.abs(values[ok]).max() > MAX_ABS_T:
+        raise ValueError("Tiempo fuera de rango")
+    base, out[ok] = _delta(np.rint(values[ok]).astype(np.int64))
+    return base, out
+
+
+def check_coords(lat: np.ndarray, lon: np.ndarray) -> None:
+    """
+    ValueError si alguna lat/lon no es finita o está fuera de rango.
+    """
+    with np.errstate(invalid="ignore"):
+        ok = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    if not ok.all():
+        raise ValueError("Coordenadas fuera de rango")
+
+
+def encode_columns(cols: dict[str, np.ndarray]) -> bytes:
+    n = len(cols["lat"])
+    check_coords(cols["lat"], cols["lon"])
+
+    lat_base, lat_d = _delta(_fixed(cols["lat"], COORD_SCALE))
+    lon_base, lon_d = _delta(_fixed(cols["lon"], COORD_SCALE))
+    t_base, t_d = _delta_nullable(cols["t"])
+
+    acc = _fixed(cols["accuracy"], ACCURACY_SCALE)
+    spd = _fixed(cols["speed"], SPEED_SCALE)
+
+    body = b"".join(
+        c.astype("<i4").tobytes()
+        for c in (lat_d, lon_d, t_d, acc.astype(np.int32), spd.astype(np.int32))
+    )
+    header = _HEADER.pack(MAGIC, VERSION, n, lat_base, lon_base, t_base)
+    return header + zlib.compress(body, 6)
+
+
+def decode_columns(blob: bytes, max_points: int | None = None) -> dict[str, np.ndarray]:
+    try:
+        magic, version, n, lat_base, lon_base, t_base = _HEADER.unpack_from(blob)
+        if magic != MAGIC or version != VERSION:
+            raise PathDecodeError("Formato de path desconocido")
+        if max_points is not None and n > max_points:
+            raise PathTooLarge("Demasiados puntos")
+        size = POINT_SIZE * n
+        inflater = zlib.decompressobj()
+        # max_length=0 es "sin límite": un path vacío se pide de 1 byte
+        body = inflater.decompress(blob[_HEADER.size:], max(size, 1))
+    except (struct.error, zlib.error) as e:
+        raise PathDecodeError(str(e))
+
+    if len(body) != size or inflater.unconsumed_tail:
+        raise PathDecodeError("Tamaño de path incorrecto")
+    ints = np.frombuffer(body, dtype="<i4")
+    lat_d, lon_d, t_d, acc, spd = ints.reshape(5, n).astype(np.int64)
+
+    def nullable(col: np.ndarray, scale: int) -> np.ndarray:
+        out = col.astype(np.float64) / scale
+        out[col == NULL_INT] = np.nan
+        return out
+
+    t_null = t_d == NULL_INT
+    if n and t_base == 0 and not t_d.any():
+        # blobs de antes del centinela: sin tiempo se guardaba t=0
+        t_null[:] = True
+    t = (t_base + np.cumsum(np.where(t_null, 0, t_d))).astype(np.float64)
+    t[t_null] = np.nan
+
+    return {
+        "lat": (lat_base + np.cumsum(lat_d)) / COORD_SCALE,
+        "lon": (lon_base + np.cumsum(lon_d)) / COORD_SCALE,
+        "t": t,
+        "accuracy": nullable(acc, ACCURACY_SCALE),
+        "speed": nullable(spd, SPEED_SCALE),
+    }
+
+
+def encode_path(points: Iterable[Any]) -> bytes:
+    return encode_columns(points_to_columns(points))
+
+
+def decode_path(blob: bytes) -> list[dict]:
+    return columns_to_points(decode_columns(blob))
+
+
+# ------------------------
+# Google encoded polyline (solo lat/lon, precisión 1e-5)
+# ------------------------
+def encode_polyline(lat: np.ndarray, lon: np.ndarray, precision: int = 5) -> str:
+    factor = 10 ** precision
+    coords = np.rint(np.column_stack([lat, lon]) * factor).astype(np.int64)
+    if len(coords) == 0:
+        return ""
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+
+    chunks = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else (value << 1)
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+# ------------------------
+# Acceso desde el modelo
+# ------------------------
+def route_columns(route) -> dict[str, np.ndarray]:
+    """
+    Columnas del path de una ruta, venga de path_blob (nuevo) o del JSONB
+    antiguo (filas aún sin migrar).
+    """
+    if route.path_blob is not None:
+        return decode_columns(route.path_blob)
+    return points_to_columns(route.path or [])
+
+
+def route_points(route) -> list[dict]:
+    if route.path_blob is None:
+        return list(route.path or [])
+    return decode_path(route.path_blob)
@@ -0,0 +1,165 @@
+"""
+Métricas del pool de conexiones (sync y async).
+
+Se registran con `instrument(nombre, engine)` desde db.py y se leen con
+`snapshot()` (GET /metrics/pool):
+  - esperas al hacer checkout (total, máxima, timeouts)
+  - conexiones en uso / en overflow y cuántos checkouts tiraron de overflow
+  - coste del pre-ping y fallos
+  - conexiones nuevas e invalidaciones (p. ej. por desconexión)
+"""
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total_s = 0.0
+        self.checkout_wait_max_s = 0.0
+        self.checkout_timeouts = 0
+        self.overflow_checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.disconnect_errors = 0
+        self.pings = 0
+        self.ping_total_s = 0.0
+        self.ping_failures = 0
+
+    def record_wait(self, wait_s: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+                return
+            self.checkouts += 1
+            self.checkout_wait_total_s += wait_s
+            self.checkout_wait_max_s = max(self.checkout_wait_max_s, wait_s)
+
+    def record_ping(self, elapsed_s: float, ok: bool) -> None:
+        with self._lock:
+            self.pings += 1
+            self.ping_total_s += elapsed_s
+            if not ok:
+                self.ping_failures += 1
+
+    def incr(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_wait_total_ms": round(self.checkout_wait_total_s * 1000, 3),
+                "checkout_wait_avg_ms": round(self.checkout_wait_total_s * 1000 / self.checkouts, 3)
+                if self.checkouts else 0.0,
+                "checkout_wait_max_ms": round(self.checkout_wait_max_s * 1000, 3),
+                "checkout_timeouts": self.checkout_timeouts,
+                "overflow_checkouts": self.overflow_checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "disconnect_errors": self.disconnect_errors,
+                "pings": self.pings,
+                "ping_total_ms": round(self.ping_total_s * 1000, 3),
+                "ping_avg_ms": round(self.ping_total_s * 1000 / self.pings, 3) if self.pings else 0.0,
+                "ping_failures": self.ping_failures,
+            }
+
+
+class _TimedGetMixin:
+    """
+    Mide cuánto se espera en _do_get (la espera por una conexión libre).
+    """
+    _stats: PoolStats | None = None
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            if self._stats:
+                self._stats.record_wait(time.perf_counter() - t0, timed_out=True)
+            raise
+        if self._stats:
+            self._stats.record_wait(time.perf_counter() - t0)
+            if self.overflow() > 0:
+                self._stats.incr("overflow_checkouts")
+        return conn
+
+    def recreate(self):
+        new = super().recreate()
+        new._stats = self._stats
+        return new
+
+
+class InstrumentedQueuePool(_TimedGetMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedGetMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+_registry: dict[str, tuple[object, PoolStats]] = {}
+
+
+def instrument(name: str, engine) -> PoolStats:
+    """
+    `engine` es el Engine sync (para el async: async_engine.sync_engine).
+    """
+    stats = PoolStats()
+    pool = engine.pool
+    if isinstance(pool, _TimedGetMixin):
+        pool._stats = stats
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        stats.incr("connects")
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_conn, record, exc):
+        stats.incr("invalidations")
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context):
+        if context.is_disconnect:
+            stats.incr("disconnect_errors")
+
+    dialect = engine.dialect
+    do_ping = dialect.do_ping
+
+    def timed_ping(dbapi_conn):
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            ok = do_ping(dbapi_conn)
+            return ok
+        finally:
+            stats.record_ping(time.perf_counter() - t0, ok)
+
+    dialect.do_ping = timed_ping
+
+    _registry[name] = (engine, stats)
+    return stats
+
+
+def snapshot() -> dict:
+    out = {}
+    for name, (engine, stats) in _registry.items():
+        pool = engine.pool
+        data = {"pool": pool.status()}
+        if isinstance(pool, QueuePool):
+            data.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=max(0, pool.overflow()),
+            )
+        data.update(stats.as_dict())
+        out[name] = data
+    return out
@@ -0,0 +1,138 @@
+"""
+Subida de rutas por trozos mientras se graba.
+
+El cliente abre una sesión, manda lotes de puntos (NDJSON: un RoutePoint
+por línea, o el binario de pathcodec) numerados desde 0 y al final la
+cierra. Cada lote se guarda ya codificado y la distancia/duración se
+acumulan al vuelo, así que ninguna petición tiene que cargar la ruta
+entera.
+"""
+import json
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from . import models, pathcodec
+from .geo import haversine_m, segment_lengths_m
+
+MAX_CHUNK_BYTES = 1_000_000
+MAX_CHUNK_POINTS = 5_000
+MAX_SESSION_POINTS = 50_000
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+BINARY_TYPES = ("application/octet-stream",)
+
+
+class ChunkError(ValueError):
+    """
+    Trozo mal formado; el mensaje es el `detail` que devuelve la API.
+    """
+
+
+class ChunkOutOfOrder(Exception):
+    pass
+
+
+def parse_chunk(body: bytes, content_type: str) -> dict:
+    if len(body) > MAX_CHUNK_BYTES:
+        raise ChunkError("CHUNK_TOO_LARGE")
+
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in BINARY_TYPES:
+        try:
+            cols = pathcodec.decode_columns(body, max_points=MAX_CHUNK_POINTS)
+        except pathcodec.PathTooLarge:
+            raise ChunkError("CHUNK_TOO_LARGE")
+        except pathcodec.PathDecodeError:
+            raise ChunkError("BAD_CHUNK")
+    elif media_type in NDJSON_TYPES:
+        try:
+            points = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except ValueError:
+            raise ChunkError("BAD_CHUNK")
+        cols = pathcodec.points_to_columns(points)
+    else:
+        raise ChunkError("UNSUPPORTED_CONTENT_TYPE")
+
+    if len(cols["lat"]) > MAX_CHUNK_POINTS:
+        raise ChunkError("CHUNK_TOO_LARGE")
+    # un NaN o lat=500 estropearía distance_m y el path de la sesión
+    try:
+        pathcodec.check_coords(cols["lat"], cols["lon"])
+    except ValueError:
+        raise ChunkError("BAD_CHUNK")
+    return cols
+
+
+def append_chunk(db: Session, rec: models.RecordingSession, seq: int, cols: dict) -> bool:
+    """
+    Guarda el trozo `seq` y actualiza los acumulados. Devuelve False si ese
+    trozo ya estaba (reintento del cliente). No hace commit.
+    """
+    if seq < rec.chunk_count:
+        return False
+    if seq > rec.chunk_count:
+        raise ChunkOutOfOrder()
+
+    n = len(cols["lat"])
+    if rec.point_count + n > MAX_SESSION_POINTS:
+        raise ChunkError("SESSION_TOO_LARGE")
+    try:
+        blob = pathcodec.encode_columns(cols)
+    except ValueError:
+        raise ChunkError("BAD_CHUNK")
+
+    if n:
+        lat, lon, t = cols["lat"], cols["lon"], cols["t"]
+        dist = float(segment_lengths_m(lat, lon).sum())
+        if rec.last_lat is not None:
+            dist += float(haversine_m(rec.last_lat, rec.last_lon, lat[0], lon[0]))
+
+        valid_t = t[~np.isnan(t)]
+        # el salto desde el trozo anterior tiene que caber en el path final
+        if len(valid_t) and rec.last_t is not None and abs(valid_t[0] - rec.last_t) > pathcodec.INT32_MAX:
+            raise ChunkError("BAD_CHUNK")
+        if len(valid_t):
+            if rec.first_t is None:
+                rec.first_t = int(valid_t[0])
+            rec.last_t = int(valid_t[-1])
+
+        rec.distance_m = rec.distance_m + dist
+        rec.last_lat = float(lat[-1])
+        rec.last_lon = float(lon[-1])
+        rec.point_count = rec.point_count + n
+
+    db.add(models.RecordingChunk(session_id=rec.id, seq=seq, points=blob))
+    rec.chunk_count = rec.chunk_count + 1
+    return True
+
+
+def duration_s(rec: models.RecordingSession) -> int:
+    if rec.first_t is None or rec.last_t is None:
+        return 0
+    return max(0, int((rec.last_t - rec.first_t) / 1000))
+
+
+def session_columns(db: Session, rec: models.RecordingSession) -> dict:
+    """
+    Une todos los trozos de la sesión (en orden) en unas columnas.
+    """
+    blobs = db.scalars(
+        select(models.RecordingChunk.points)
+        .where(models.RecordingChunk.session_id == rec.id)
+        .order_by(models.RecordingChunk.seq)
+    ).all()
+    # cada trozo se guardó ya validado, pero no se descomprime sin cota
+    parts = [pathcodec.decode_columns(b, max_points=MAX_CHUNK_POINTS) for b in blobs]
+    if not parts:
+        return pathcodec.points_to_columns([])
+    return {name: np.concatenate([p[name] for p in parts]) for name in pathcodec.FIELDS}
+
+
+def discard(db: Session, rec: models.RecordingSession) -> None:
+    """
+    Borra la sesión y sus trozos (explícito por SQLite). No hace commit.
+    """
+    db.execute(delete(models.RecordingChunk).where(models.RecordingChunk.session_id == rec.id))
+    db.delete(rec)
@@ -0,0 +1,165 @@
+"""
+Caché de respuestas compartidas (iguales para todos los usuarios), p. ej.
+/routes/public. Se guarda el JSON ya serializado.
+
+  - Invalidación por generación: cada espacio de nombres ("public_routes")
+    tiene un contador que forma parte de la clave; invalidar es subirlo y
+    las entradas viejas simplemente dejan de leerse hasta que caducan.
+  - Single-flight: si llegan N peticiones con la misma clave y no está en
+    caché, solo la primera va a la BD; el resto espera su resultado.
+  - Backend en memoria (LRU + TTL) por defecto o redis si
+    RESPONSE_CACHE_REDIS_URL está definido (compartido entre workers).
+"""
+import asyncio
+import os
+
+import anyio.from_thread
+
+from .cache import TTLCache
+
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "30"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "")
+
+PUBLIC_ROUTES = "public_routes"
+# tiles del mapa de calor; la clave lleva la versión del tile, no hace
+# falta invalidar
+HEAT_TILES = "heat_tiles"
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, maxsize: int):
+        self._data = TTLCache(maxsize=maxsize)
+        self._generations: dict[str, int] = {}
+
+    async def generation(self, namespace: str) -> int:
+        return self._generations.get(namespace, 0)
+
+    async def bump(self, namespace: str) -> None:
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    async def get(self, key: str) -> bytes | None:
+        return self._data.get(key)
+
+    async def set(self, key: str, value: bytes, ttl_s: float) -> None:
+        self._data.set(key, value, ttl_s=ttl_s)
+
+    def stats(self) -> dict:
+        return self._data.stats()
+
+
+class RedisBackend:
+    name = "redis"
+
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(url)
+
+    async def generation(self, namespace: str) -> int:
+        raw = await self._redis.get(f"respcache:gen:{namespace}")
+        return int(raw) if raw is not None else 0
+
+    async def bump(self, namespace: str) -> None:
+        await self._redis.incr(f"respcache:gen:{namespace}")
+
+    async def get(self, key: str) -> bytes | None:
+        return await self._redis.get(f"respcache:{key}")
+
+    async def set(self, key: str, value: bytes, ttl_s: float) -> None:
+        await self._redis.set(f"respcache:{key}", value, px=int(ttl_s * 1000))
+
+    def stats(self) -> dict:
+        return {}
+
+
+def make_backend():
+    if RESPONSE_CACHE_REDIS_URL:
+        try:
+            return RedisBackend(RESPONSE_CACHE_REDIS_URL)
+        except ImportError:
+            print("RESPONSE_CACHE_REDIS_URL definido pero falta el paquete redis; caché en memoria")
+    return MemoryBackend(RESPONSE_CACHE_SIZE)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl_s: float):
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_compute(self, namespace: str, key: str, compute) -> bytes:
+        """
+        `compute` es una corrutina sin argumentos que devuelve los bytes.
+
+        Si el que calculaba se cancela (su cliente se ha ido), los que
+        esperaban su resultado no fallan con él: vuelven a empezar y uno
+        de ellos calcula con su propio `compute` (el del líder puede usar
+        una sesión de BD que ya se ha cerrado).
+        """
+        while True:
+            full_key = f"{namespace}:{await self.backend.generation(namespace)}:{key}"
+
+            cached = await self.backend.get(full_key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+            pending = self._inflight.get(full_key)
+            if pending is not None:
+                self.coalesced += 1
+                try:
+                    return await asyncio.shield(pending)
+                except asyncio.CancelledError:
+                    if pending.cancelled() and not asyncio.current_task().cancelling():
+                        continue
+                    raise
+
+            self.misses += 1
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[full_key] = future
+            try:
+                value = await compute()
+                await self.backend.set(full_key, value, self.ttl_s)
+                future.set_result(value)
+                return value
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()  # marcada como leída aunque nadie esperase
+                raise
+            finally:
+                del self._inflight[full_key]
+
+    async def invalidate(self, namespace: str) -> None:
+        await self.backend.bump(namespace)
+
+    def invalidate_from_thread(self, namespace: str, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        """
+        Para endpoints sync (corren en el threadpool de anyio). Desde hilos
+        propios (trabajos de imports.py) hay que pasar el loop del servidor.
+        """
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.invalidate(namespace), loop).result()
+        else:
+            anyio.from_thread.run(self.invalidate, namespace)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "store": self.backend.stats(),
+        }
+
+
+response_cache = ResponseCache(make_backend(), RESPONSE_CACHE_TTL_S)
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, EmailStr
 from uuid import UUID
 from typing import List, Literal, Any
-from datetime import datetime
+from datetime import date, datetime
 
 
 # ------------------------
@@ -34,9 +34,12 @@ class UserOut(BaseModel):
 
 class RouteCreate(BaseModel):
     name: str
-    distance_m: int
-    duration_s: int
-    path: List[Any]
+    # solo se usan si el path no da para calcularlos en el servidor
+    distance_m: int = 0
+    duration_s: int = 0
+    # uno de los dos: lista de RoutePoint o el binario de pathcodec en base64
+    path: List[Any] | None = None
+    path_encoded: str | None = None
     visibility: Literal["private", "friends", "public"] = "private"
 
 
@@ -45,6 +48,9 @@ class RouteOut(BaseModel):
     name: str
     distance_m: int
     duration_s: int
+    moving_time_s: int | None = None
+    max_speed_ms: float | None = None
+    avg_moving_speed_ms: float | None = None
     visibility: str
     created_at: datetime
 
@@ -73,16 +79,38 @@ class FriendRequestCreate(BaseModel):
     to_name: str
 
 
+class FriendRequestBulkCreate(BaseModel):
+    to_names: List[str]
+
+
+class FriendRequestIdsIn(BaseModel):
+    ids: List[UUID]
+
+
 class FriendRequestOut(BaseModel):
     id: UUID
     from_user_id: UUID
     to_user_id: UUID
     created_at: datetime
+    # solo en los listados
+    from_name: str | None = None
+    to_name: str | None = None
 
     class Config:
         from_attributes = True
 
-        from_attributes = True
+
+class FriendRequestSendResult(BaseModel):
+    to_name: str
+    # "sent" o el mismo detail que daría POST /friend-requests
+    status: str
+    request: FriendRequestOut | None = None
+
+
+class FriendRequestActionResult(BaseModel):
+    id: UUID
+    status: str
+
 
 class FriendOut(BaseModel):
     id: UUID
@@ -97,6 +125,9 @@ class FeedRouteOut(BaseModel):
     name: str
     distance_m: int
     duration_s: int
+    moving_time_s: int | None = None
+    max_speed_ms: float | None = None
+    avg_moving_speed_ms: float | None = None
     visibility: str
     created_at: datetime
 
@@ -104,13 +135,25 @@ class FeedRouteOut(BaseModel):
         from_attributes = True
 
 
+PathFormat = Literal["list", "polyline", "compact"]
+PathLod = Literal["low", "medium", "full"]
+
+
 class RouteDetailOut(BaseModel):
     id: UUID
     user_id: UUID
     name: str
     distance_m: int
     duration_s: int
-    path: List[Any]
+    moving_time_s: int | None = None
+    max_speed_ms: float | None = None
+    avg_moving_speed_ms: float | None = None
+    splits_s: List[int] | None = None
+    # según ?path_format=: list -> path, polyline -> path_polyline,
+    # compact -> path_encoded (binario de pathcodec en base64)
+    path: List[Any] | None = None
+    path_polyline: str | None = None
+    path_encoded: str | None = None
     visibility: str
     created_at: datetime
 
@@ -123,6 +166,164 @@ class RouteUpdateIn(BaseModel):
     visibility: Literal["private", "friends", "public"] | None = None
 
 
+class RouteBatchIn(BaseModel):
+    ids: List[UUID]
+    # lod=None: solo los datos de la ruta, sin path (ni se lee de la BD)
+    lod: PathLod | None = "full"
+    path_format: PathFormat = "list"
+
+
+class RouteBatchOut(BaseModel):
+    # en el orden pedido, sin repetidos
+    routes: list[RouteDetailOut]
+    # no existen o no las puedo ver
+    missing: list[UUID]
+
+
 class RouteDeleteOut(BaseModel):
     status: str
 
+
+# ------------------------
+# Recordings (subida por trozos)
+# ------------------------
+
+class RecordingOut(BaseModel):
+    id: UUID
+    point_count: int
+    chunk_count: int
+    distance_m: int
+    duration_s: int
+    created_at: datetime
+
+
+class RecordingFinalizeIn(BaseModel):
+    name: str
+    visibility: Literal["private", "friends", "public"] = "private"
+
+
+
+# ------------------------
+# Imports (GPX / GeoJSON / FIT en bloque)
+# ------------------------
+
+class ImportErrorOut(BaseModel):
+    file: str
+    error: str
+
+
+class ImportJobOut(BaseModel):
+    id: UUID
+    status: Literal["pending", "running", "done", "failed"]
+    visibility: Literal["private", "friends", "public"]
+    total_files: int
+    processed_files: int
+    failed_files: int
+    imported_routes: int
+    errors: list[ImportErrorOut]
+    created_at: datetime
+    finished_at: datetime | None = None
+
+    class Config:
+        from_attributes = True
+
+
+# ------------------------
+# Mapa de calor
+# ------------------------
+
+class HeatTilesOut(BaseModel):
+    # relativa a la API; {z}/{x}/{y} los rellena la capa de tiles
+    url_template: str
+    expires_at: datetime
+    min_zoom: int
+    max_zoom: int
+
+
+# ------------------------
+# Segmentos y leaderboards
+# ------------------------
+
+class SegmentCreate(BaseModel):
+    # tramo [start_index, end_index] de los puntos de una ruta que puedo ver
+    route_id: UUID
+    start_index: int
+    end_index: int
+    name: str
+
+
+class SegmentOut(BaseModel):
+    id: UUID
+    user_id: UUID
+    source_route_id: UUID | None = None
+    name: str
+    distance_m: int
+    # polilínea de Google (precisión 5)
+    path_polyline: str
+    created_at: datetime
+
+
+class LeaderboardEntryOut(BaseModel):
+    rank: int
+    user_id: UUID
+    user_name: str
+    route_id: UUID
+    elapsed_s: int
+    started_at: datetime
+
+
+# ------------------------
+# Estadísticas del usuario (GET /me/stats)
+# ------------------------
+
+class StatBucketOut(BaseModel):
+    # lunes de la semana o día 1 del mes (UTC)
+    start: date
+    route_count: int
+    distance_m: int
+    duration_s: int
+
+
+class PersonalBestOut(BaseModel):
+    value: float
+    route_id: UUID
+
+
+class PersonalBestsOut(BaseModel):
+    distance_m: PersonalBestOut | None = None
+    duration_s: PersonalBestOut | None = None
+    avg_moving_speed_ms: PersonalBestOut | None = None
+
+
+class UserStatsOut(BaseModel):
+    route_count: int
+    total_distance_m: int
+    total_duration_s: int
+    total_moving_time_s: int
+    bests: PersonalBestsOut
+    # de la más reciente a la más antigua, con ceros en las vacías
+    weeks: list[StatBucketOut]
+    months: list[StatBucketOut]
+    last_route: RouteOut | None = None
+
+
+# ------------------------
+# Sincronización incremental (GET /sync)
+# ------------------------
+
+class SyncOut(BaseModel):
+    # pasar como ?since= en la siguiente llamada
+    token: str
+    # true: la respuesta es el estado completo, reemplaza lo local
+    reset: bool
+    # quedan más cambios: volver a llamar con el nuevo token
+    has_more: bool
+    routes: list[RouteOut] = []
+    deleted_routes: list[UUID] = []
+    feed: list[FeedRouteOut] = []
+    deleted_feed: list[UUID] = []
+    friends: list[FriendOut] = []
+    deleted_friends: list[UUID] = []
+    # recibidas y enviadas (from_user_id / to_user_id dicen cuál)
+    friend_requests: list[FriendRequestOut] = []
+    deleted_friend_requests: list[UUID] = []
@@ -7,7 +7,15 @@ from uuid import UUID
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Rondas ajustables por entorno: los hashes con otras rondas se rehacen
+# solos en el siguiente login (needs_update / verify_and_update).
+PBKDF2_ROUNDS = int(os.getenv("PBKDF2_ROUNDS", "29000"))
+
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__rounds=PBKDF2_ROUNDS,
+)
 
 SECRET_KEY = os.getenv("SECRET_KEY", "DEV_SECRET_CHANGE_ME")
 ALGORITHM = "HS256"
@@ -26,6 +34,17 @@ def verify_password(password: str, password_hash: str) -> bool:
         return False
 
 
+def verify_and_update(password: str, password_hash: str) -> tuple[bool, str | None]:
+    """
+    (ok, hash_nuevo). hash_nuevo viene relleno si la contraseña es correcta
+    pero el hash guardado usa otras rondas/esquema y hay que reemplazarlo.
+    """
+    try:
+        return pwd_context.verify_and_update(password, password_hash)
+    except Exception:
+        return False, None
+
+
 def create_access_token(user_id: UUID) -> str:
     """
     Guarda el id del usuario en 'sub' como string UUID.
@@ -50,4 +69,24 @@ def decode_access_token(token: str) -> UUID:
         raise ValueError("Token inválido")
 
 
+# ------------------------
+# Clave de las URLs de tiles del mapa de calor
+# ------------------------
+TILES_KEY_HOURS = int(os.getenv("TILES_KEY_HOURS", "24"))
 
+
+def create_tiles_key() -> tuple[str, datetime]:
+    """
+    JWT corto para las URLs de /tiles/...png (las capas de tiles no mandan
+    Authorization). Solo sirve para eso: no lleva usuario.
+    """
+    expire = datetime.utcnow() + timedelta(hours=TILES_KEY_HOURS)
+    return jwt.encode({"scope": "tiles", "exp": expire}, SECRET_KEY, algorithm=ALGORITHM), expire
+
+
+def check_tiles_key(key: str) -> bool:
+    try:
+        payload = jwt.decode(key, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return payload.get("scope") == "tiles"
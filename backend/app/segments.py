@@ -0,0 +1,451 @@
+"""
+Segmentos y leaderboards.
+
+Un segmento es un tramo de una ruta (índices inicio..fin), guardado
+simplificado y con bbox/geohash como las rutas. Una ruta "pasa" por un
+segmento si tiene un punto a menos de MATCH_TOLERANCE_M del inicio, otro
+posterior cerca del fin y entre ambos no se aleja de la polilínea del
+segmento (cada muestra del segmento, cada SAMPLE_M, queda a menos de la
+tolerancia del trozo de ruta). El tiempo es t(fin) - t(inicio).
+
+El emparejamiento va fuera de la petición, en el SegmentMatcher
+(SEGMENT_WORKERS hilos; todo es numpy sobre arrays):
+  - ruta nueva: segmentos cuyo bbox cabe en el de la ruta (filtro
+    geohash + bbox en SQL, ver spatial.py). Las geometrías de segmento se
+    cachean decodificadas: no cambian nunca.
+  - segmento nuevo: rutas cuyo bbox contiene el del segmento, por lotes.
+"""
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import and_, case, delete, func, or_, select, update
+from sqlalchemy.orm import Session, undefer_group
+
+from . import models, pathcodec, simplify, spatial
+from .cache import TTLCache
+from .db import SessionLocal, dialect_insert
+from .geo import EARTH_RADIUS_M, segment_lengths_m
+
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "2"))
+MATCH_TOLERANCE_M = float(os.getenv("SEGMENT_MATCH_TOLERANCE_M", "25"))
+SAMPLE_M = 20.0
+MIN_SEGMENT_M = 100
+MAX_SEGMENT_M = 100_000
+# rutas por lote al emparejar un segmento nuevo con las existentes
+BACKFILL_BATCH = 50
+# tamaño máximo de la matriz muestras x tramos de una comprobación
+MAX_PAIRS = 2_000_000
+
+Segment = models.Segment
+SegmentEffort = models.SegmentEffort
+Route = models.Route
+
+
+class SegmentError(ValueError):
+    """
+    Tramo no válido; el mensaje es el `detail` que devuelve la API.
+    """
+
+
+# ------------------------
+# Geometría
+# ------------------------
+@dataclass
+class Geometry:
+    lat0: float
+    lon0: float
+    cos0: float
+    samples: np.ndarray  # (m, 2) en metros locales; [0] inicio, [-1] fin
+
+    def project(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        x = np.radians(lon - self.lon0) * EARTH_RADIUS_M * self.cos0
+        y = np.radians(lat - self.lat0) * EARTH_RADIUS_M
+        return np.column_stack([x, y])
+
+    @property
+    def start(self) -> np.ndarray:
+        return self.samples[0]
+
+    @property
+    def end(self) -> np.ndarray:
+        return self.samples[-1]
+
+
+def geometry(lat: np.ndarray, lon: np.ndarray) -> Geometry:
+    """
+    Polilínea del segmento -> proyección local centrada en su inicio y
+    muestras cada SAMPLE_M metros.
+    """
+    geom = Geometry(float(lat[0]), float(lon[0]), math.cos(math.radians(float(lat[0]))), None)
+    xy = geom.project(lat, lon)
+    cum = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(xy, axis=0).T))])
+    at = np.linspace(0.0, cum[-1], max(2, int(cum[-1] // SAMPLE_M) + 1))
+    geom.samples = np.column_stack([np.interp(at, cum, xy[:, 0]), np.interp(at, cum, xy[:, 1])])
+    return geom
+
+
+def _max_distance_to_polyline(points: np.ndarray, line: np.ndarray) -> float:
+    """
+    Máximo, sobre `points`, de la distancia a la polilínea `line`.
+    """
+    if len(line) == 1:
+        return float(np.hypot(*(points - line[0]).T).max())
+    a, ab = line[:-1], np.diff(line, axis=0)
+    ab_len2 = np.maximum((ab * ab).sum(axis=1), 1e-12)
+    # por bloques de muestras para acotar la matriz muestras x tramos
+    rows = max(1, MAX_PAIRS // len(a))
+    worst = 0.0
+    for start in range(0, len(points), rows):
+        p = points[start:start + rows, None, :]  # (m, 1, 2)
+        u = np.clip(((p - a) * ab).sum(axis=2) / ab_len2, 0.0, 1.0)  # (m, k)
+        diff = p - (a + u[..., None] * ab)
+        worst = max(worst, float(np.sqrt((diff * diff).sum(axis=2)).min(axis=1).max()))
+    return worst
+
+
+def _runs(idx: np.ndarray, dist: np.ndarray) -> np.ndarray:
+    """
+    De cada racha de índices consecutivos, el más cercano.
+    """
+    if len(idx) == 0:
+        return idx
+    breaks = np.flatnonzero(np.diff(idx) > 1) + 1
+    return np.array([run[dist[run].argmin()] for run in np.split(idx, breaks)])
+
+
+def match(geom: Geometry, xy: np.ndarray, t: np.ndarray) -> tuple[float, float] | None:
+    """
+    Mejor pasada de la ruta (ya proyectada con `geom.project`) por el
+    segmento: (segundos, t de inicio en ms) o None.
+    """
+    d_start = np.hypot(*(xy - geom.start).T)
+    d_end = np.hypot(*(xy - geom.end).T)
+    starts = _runs(np.flatnonzero(d_start <= MATCH_TOLERANCE_M), d_start)
+    ends = _runs(np.flatnonzero(d_end <= MATCH_TOLERANCE_M), d_end)
+    if len(starts) == 0 or len(ends) == 0:
+        return None
+
+    best = None
+    # cada inicio con el primer fin posterior (inicio y fin pueden coincidir
+    # en segmentos en bucle: el fin tiene que ser estrictamente después)
+    nxt = np.searchsorted(ends, starts, side="right")
+    for s, k in zip(starts.tolist(), nxt.tolist()):
+        if k >= len(ends):
+            break
+        e = int(ends[k])
+        elapsed = (t[e] - t[s]) / 1000.0
+        if not np.isfinite(elapsed) or elapsed <= 0 or (best and elapsed >= best[0]):
+            continue
+        if _max_distance_to_polyline(geom.samples, xy[s:e + 1]) <= MATCH_TOLERANCE_M:
+            best = (elapsed, float(t[s]))
+    return best
+
+
+def build(cols: dict[str, np.ndarray], start_index: int, end_index: int) -> dict:
+    """
+    Columnas de la ruta + índices -> valores de la fila de Segment.
+    """
+    n = len(cols["lat"])
+    if not (0 <= start_index < end_index < n):
+        raise SegmentError("BAD_SEGMENT_RANGE")
+
+    piece = {k: v[start_index:end_index + 1] for k, v in cols.items()}
+    ok = np.isfinite(piece["lat"]) & np.isfinite(piece["lon"])
+    piece = {k: v[ok] for k, v in piece.items()}
+    if len(piece["lat"]) < 2:
+        raise SegmentError("BAD_SEGMENT_RANGE")
+
+    distance = float(segment_lengths_m(piece["lat"], piece["lon"]).sum())
+    if not (MIN_SEGMENT_M <= distance <= MAX_SEGMENT_M):
+        raise SegmentError("BAD_SEGMENT_LENGTH")
+
+    # la geometría se guarda simplificada (las muestras se interpolan)
+    idx = simplify.simplify_indices(piece["lat"], piece["lon"], 3.0, 1000)
+    piece = {k: v[idx] for k, v in piece.items()}
+    return {
+        "distance_m": int(round(distance)),
+        "path_blob": pathcodec.encode_columns(piece),
+        "end_lat": float(piece["lat"][-1]),
+        "end_lon": float(piece["lon"][-1]),
+        **spatial.route_geo(piece),
+    }
+
+
+# ------------------------
+# Emparejamiento (hilos del matcher)
+# ------------------------
+def _contains(outer, inner_box: spatial.BBox, margin_deg: float):
+    """
+    SQL: bbox de `outer` contiene `inner_box` (con margen).
+    """
+    return and_(
+        outer.min_lat <= inner_box.min_lat + margin_deg,
+        outer.max_lat >= inner_box.max_lat - margin_deg,
+        outer.min_lon <= inner_box.min_lon + margin_deg,
+        outer.max_lon >= inner_box.max_lon - margin_deg,
+    )
+
+
+def _inside(inner, outer_box: spatial.BBox, margin_deg: float):
+    """
+    SQL: bbox de `inner` dentro de `outer_box` (con margen).
+    """
+    return and_(
+        inner.min_lat >= outer_box.min_lat - margin_deg,
+        inner.max_lat <= outer_box.max_lat + margin_deg,
+        inner.min_lon >= outer_box.min_lon - margin_deg,
+        inner.max_lon <= outer_box.max_lon + margin_deg,
+    )
+
+
+# tolerancia en grados para los filtros de bbox (de sobra en longitud
+# salvo muy cerca de los polos)
+_MARGIN_DEG = MATCH_TOLERANCE_M / 111_000.0 * 2
+
+
+def _store(db: Session, efforts: list[dict]) -> None:
+    if not efforts:
+        return
+    insert = dialect_insert(db)
+    db.execute(insert(SegmentEffort).on_conflict_do_nothing(), efforts)
+
+
+def _effort(segment_id: UUID, route_id: UUID, user_id: UUID, result: tuple[float, float]) -> dict:
+    elapsed, t0 = result
+    return {
+        "segment_id": segment_id,
+        "route_id": route_id,
+        "user_id": user_id,
+        "elapsed_s": int(round(elapsed)),
+        "started_at": datetime.fromtimestamp(t0 / 1000, tz=timezone.utc),
+    }
+
+
+class SegmentMatcher:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        # id -> Geometry; los segmentos no se editan
+        self._geometries = TTLCache(maxsize=20_000, ttl_s=24 * 3600)
+        self.routes_matched = 0
+        self.segments_backfilled = 0
+        self.efforts = 0
+        self.errors = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="segments")
+            return self._executor
+
+    def _submit(self, fn, *args) -> None:
+        def job():
+            try:
+                fn(*args)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print("segments", fn.__name__, "ERROR:", repr(e))
+
+        self._get_executor().submit(job)
+
+    def submit_routes(self, route_ids: list[UUID]) -> None:
+        for route_id in route_ids:
+            self._submit(self.match_route, route_id)
+
+    def submit_segment(self, segment_id: UUID) -> None:
+        self._submit(self.backfill_segment, segment_id)
+
+    def _geometries_for(self, db: Session, ids: list[UUID]) -> dict[UUID, Geometry]:
+        out, missing = {}, []
+        for segment_id in ids:
+            geom = self._geometries.get(segment_id)
+            if geom is None:
+                missing.append(segment_id)
+            else:
+                out[segment_id] = geom
+        if missing:
+            rows = db.execute(select(Segment.id, Segment.path_blob).where(Segment.id.in_(missing))).all()
+            for segment_id, blob in rows:
+                cols = pathcodec.decode_columns(blob)
+                geom = geometry(cols["lat"], cols["lon"])
+                self._geometries.set(segment_id, geom)
+                out[segment_id] = geom
+        return out
+
+    def match_route(self, route_id: UUID) -> int:
+        """
+        Empareja una ruta con todos los segmentos que caben en su bbox.
+        """
+        with SessionLocal() as db:
+            route = db.scalar(select(Route).options(undefer_group("path")).where(Route.id == route_id))
+            if route is None or route.min_lat is None:
+                return 0
+            box = spatial.route_bbox(route)
+            segment_ids = db.scalars(
+                select(Segment.id).where(
+                    spatial.candidates_filter(Segment, box),
+                    _inside(Segment, box, _MARGIN_DEG),
+                )
+            ).all()
+            if not segment_ids:
+                return 0
+
+            cols = pathcodec.route_columns(route)
+            efforts = []
+            for segment_id, geom in self._geometries_for(db, segment_ids).items():
+                result = match(geom, geom.project(cols["lat"], cols["lon"]), cols["t"])
+                if result:
+                    efforts.append(_effort(segment_id, route.id, route.user_id, result))
+            _store(db, efforts)
+            db.commit()
+
+        with self._lock:
+            self.routes_matched += 1
+            self.efforts += len(efforts)
+        return len(efforts)
+
+    def backfill_segment(self, segment_id: UUID) -> int:
+        """
+        Empareja un segmento nuevo con las rutas existentes que lo pueden
+        contener, de BACKFILL_BATCH en BACKFILL_BATCH.
+        """
+        total = 0
+        with SessionLocal() as db:
+            segment = db.get(Segment, segment_id)
+            if segment is None:
+                return 0
+            box = spatial.BBox(segment.min_lat, segment.min_lon, segment.max_lat, segment.max_lon)
+            geom = self._geometries_for(db, [segment_id])[segment_id]
+            route_ids = db.scalars(
+                select(Route.id).where(
+                    spatial.candidates_filter(Route, box),
+                    _contains(Route, box, _MARGIN_DEG),
+                )
+            ).all()
+
+            for start in range(0, len(route_ids), BACKFILL_BATCH):
+                routes = db.scalars(
+                    select(Route)
+                    .options(undefer_group("path"))
+                    .where(Route.id.in_(route_ids[start:start + BACKFILL_BATCH]))
+                ).all()
+                efforts = []
+                for route in routes:
+                    cols = pathcodec.route_columns(route)
+                    result = match(geom, geom.project(cols["lat"], cols["lon"]), cols["t"])
+                    if result:
+                        efforts.append(_effort(segment_id, route.id, route.user_id, result))
+                _store(db, efforts)
+                db.commit()
+                db.expunge_all()
+                total += len(efforts)
+
+        with self._lock:
+            self.segments_backfilled += 1
+            self.efforts += total
+        return total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "routes_matched": self.routes_matched,
+                "segments_backfilled": self.segments_backfilled,
+                "efforts": self.efforts,
+                "errors": self.errors,
+                "geometry_cache": self._geometries.stats(),
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+matcher = SegmentMatcher(SEGMENT_WORKERS)
+
+
+# ------------------------
+# Lectura / borrado
+# ------------------------
+def leaderboard_query(segment_id: UUID, viewer_id: UUID, friend_ids: frozenset, limit: int):
+    """
+    Mejor pasada de cada usuario entre las rutas que `viewer_id` puede
+    ver (visibilidad actual de la ruta), de más rápida a más lenta.
+    """
+    visible = or_(
+        Route.visibility == "public",
+        Route.user_id == viewer_id,
+        and_(Route.visibility == "friends", Route.user_id.in_(list(friend_ids))),
+    )
+    ranked = (
+        select(
+            SegmentEffort.user_id,
+            SegmentEffort.route_id,
+            SegmentEffort.elapsed_s,
+            SegmentEffort.started_at,
+            func.row_number()
+            .over(
+                partition_by=SegmentEffort.user_id,
+                order_by=(SegmentEffort.elapsed_s, SegmentEffort.started_at),
+            )
+            .label("rn"),
+        )
+        .join(Route, Route.id == SegmentEffort.route_id)
+        .where(SegmentEffort.segment_id == segment_id, visible)
+        .subquery()
+    )
+    return (
+        select(ranked.c.user_id, models.User.name, ranked.c.route_id, ranked.c.elapsed_s, ranked.c.started_at)
+        .join(models.User, models.User.id == ranked.c.user_id)
+        .where(ranked.c.rn == 1)
+        .order_by(ranked.c.elapsed_s, ranked.c.started_at)
+        .limit(limit)
+    )
+
+
+def visibility_for(route: models.Route, creator_id: UUID) -> str:
+    """
+    Visibilidad de un segmento sacado de `route`. Se comprueba como la de
+    una ruta del creador del segmento: si es el autor de la ruta, la misma;
+    si no, solo "public" si la ruta lo es (POST /segments solo deja sacar
+    segmentos de rutas ajenas públicas) y si deja de serlo, "private".
+    """
+    if route.user_id == creator_id:
+        return route.visibility
+    return "public" if route.visibility == "public" else "private"
+
+
+def route_visibility_changed(db: Session, route: models.Route) -> None:
+    """
+    Lleva la nueva visibilidad de la ruta a sus segmentos. No hace commit.
+    """
+    db.execute(
+        update(Segment)
+        .where(Segment.source_route_id == route.id)
+        .values(
+            visibility=case(
+                (Segment.user_id == route.user_id, route.visibility),
+                else_="public" if route.visibility == "public" else "private",
+            )
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def drop_route(db: Session, route_id: UUID) -> None:
+    """
+    Como el ON DELETE CASCADE / SET NULL (SQLite no aplica FKs). No hace
+    commit.
+    """
+    db.execute(delete(SegmentEffort).where(SegmentEffort.route_id == route_id))
+    db.execute(update(Segment).where(Segment.source_route_id == route_id).values(source_route_id=None))
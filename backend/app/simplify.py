@@ -0,0 +1,92 @@
+"""
+Simplificación de tracks (Douglas-Peucker) y niveles de detalle (LOD).
+
+Las distancias se calculan en metros sobre una proyección equirectangular
+local centrada en el track: de sobra para rutas de decenas de km.
+"""
+import numpy as np
+
+from . import pathcodec
+from .geo import EARTH_RADIUS_M
+
+# lod -> (tolerancia inicial en metros, máximo de puntos)
+LODS = {
+    "low": (25.0, 300),
+    "medium": (5.0, 1500),
+}
+
+
+def project_m(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    lat_r = np.radians(lat)
+    lon_r = np.radians(lon)
+    cos0 = np.cos(lat_r.mean()) if len(lat_r) else 1.0
+    return np.column_stack([EARTH_RADIUS_M * lon_r * cos0, EARTH_RADIUS_M * lat_r])
+
+
+def douglas_peucker(xy: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """
+    Devuelve los índices (ordenados) de los puntos que se conservan.
+    Versión iterativa: cada tramo calcula la distancia de todos sus puntos
+    interiores al segmento de una vez con numpy.
+    """
+    n = len(xy)
+    if n <= 2:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        a = xy[start]
+        seg = xy[end] - a
+        pts = xy[start + 1:end] - a
+        seg_len2 = float(seg @ seg)
+
+        if seg_len2 == 0.0:
+            dist = np.hypot(pts[:, 0], pts[:, 1])
+        else:
+            # distancia al segmento (no a la recta): proyección acotada a [0, 1]
+            u = np.clip((pts @ seg) / seg_len2, 0.0, 1.0)
+            diff = pts - np.outer(u, seg)
+            dist = np.hypot(diff[:, 0], diff[:, 1])
+
+        i = int(dist.argmax())
+        if dist[i] > tolerance_m:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return np.flatnonzero(keep)
+
+
+def simplify_indices(lat: np.ndarray, lon: np.ndarray, tolerance_m: float, max_points: int) -> np.ndarray:
+    """
+    Douglas-Peucker, doblando la tolerancia hasta quedar en max_points.
+    """
+    xy = project_m(lat, lon)
+    idx = douglas_peucker(xy, tolerance_m)
+    while len(idx) > max_points:
+        tolerance_m *= 2
+        idx = douglas_peucker(xy, tolerance_m)
+    return idx
+
+
+def build_lods(cols: dict[str, np.ndarray]) -> dict[str, dict[str, np.ndarray]]:
+    """
+    Columnas de pathcodec -> {lod: columnas simplificadas}.
+    """
+    out = {}
+    for lod, (tolerance_m, max_points) in LODS.items():
+        idx = simplify_indices(cols["lat"], cols["lon"], tolerance_m, max_points)
+        out[lod] = {name: values[idx] for name, values in cols.items()}
+    return out
+
+
+def encode_lods(cols: dict[str, np.ndarray]) -> dict[str, bytes]:
+    return {lod: pathcodec.encode_columns(c) for lod, c in build_lods(cols).items()}
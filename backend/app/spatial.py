@@ -0,0 +1,263 @@
+"""
+Índice espacial de rutas basado en geohash (funciona igual en Postgres y
+SQLite: solo necesita un B-tree normal).
+
+Cada ruta guarda su bbox y `geohash` = la celda geohash más pequeña que
+contiene el bbox entero. Para consultar un viewport se cubre con celdas
+de una precisión adecuada y una ruta es candidata si:
+  - su celda está dentro de una celda de la consulta  (rango de prefijo)
+  - o su celda contiene a una celda de la consulta     (prefijos exactos)
+Después se filtra por solape real de bbox en SQL.
+
+Una ruta pequeña que cruza un borde de celda grande (el ecuador, el
+meridiano 0, lat ±45...) tendría celda "" o de 1 carácter, y la leería
+cualquier consulta. Por eso el geohash también se calcula sobre una
+rejilla desplazada SHIFT_DEG (no es fracción binaria de 360 ni de 180,
+así que sus bordes no coinciden con los de la original a ninguna
+precisión) y se guarda el más largo de los dos; los de la desplazada van
+con el prefijo SHIFTED. Las consultas cubren las dos rejillas.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from sqlalchemy import and_, case, or_
+
+from .geo import EARTH_RADIUS_M, haversine_m
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+MAX_PRECISION = 9
+MAX_QUERY_CELLS = 32
+
+# sigue justo a "z" en ASCII: geohash < prefijo + HIGH_CHAR cubre todo el prefijo
+HIGH_CHAR = "{"
+# celdas de la rejilla desplazada; después de HIGH_CHAR, así que ningún
+# rango de la original las incluye
+SHIFTED = "~"
+SHIFT_DEG = 15.0
+
+# near: candidatas que se leen (las más cercanas según el bbox) por cada
+# ruta que se devuelve
+NEAR_CANDIDATES_PER_RESULT = 4
+
+
+@dataclass
+class BBox:
+    min_lat: float
+    min_lon: float
+    max_lat: float
+    max_lon: float
+
+    @classmethod
+    def parse(cls, raw: str) -> "BBox":
+        """
+        "min_lon,min_lat,max_lon,max_lat" (orden GeoJSON). ValueError si no.
+        """
+        parts = [float(x) for x in raw.split(",")]
+        if len(parts) != 4:
+            raise ValueError("bbox necesita 4 números")
+        min_lon, min_lat, max_lon, max_lat = parts
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+            raise ValueError("bbox fuera de rango")
+        return cls(min_lat, min_lon, max_lat, max_lon)
+
+    @classmethod
+    def around(cls, lat: float, lon: float, radius_m: float) -> "BBox":
+        dlat = np.degrees(radius_m / EARTH_RADIUS_M)
+        coslat = max(np.cos(np.radians(lat)), 1e-6)
+        dlon = np.degrees(radius_m / (EARTH_RADIUS_M * coslat))
+        return cls(
+            max(-90.0, lat - dlat),
+            max(-180.0, lon - dlon),
+            min(90.0, lat + dlat),
+            min(180.0, lon + dlon),
+        )
+
+
+def encode(lat: float, lon: float, precision: int) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    out = []
+    bit, ch, even = 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            out.append(BASE32[ch])
+            bit, ch = 0, 0
+    return "".join(out)
+
+
+def cell_size_deg(precision: int) -> tuple[float, float]:
+    """
+    (alto en lat, ancho en lon) de una celda de esa precisión.
+    """
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_cell(box: BBox) -> str:
+    """
+    Celda más pequeña que contiene el bbox (puede ser "" si cruza el
+    ecuador o el meridiano 0 a gran escala).
+    """
+    corners = [
+        encode(box.min_lat, box.min_lon, MAX_PRECISION),
+        encode(box.min_lat, box.max_lon, MAX_PRECISION),
+        encode(box.max_lat, box.min_lon, MAX_PRECISION),
+        encode(box.max_lat, box.max_lon, MAX_PRECISION),
+    ]
+    prefix = corners[0]
+    for c in corners[1:]:
+        i = 0
+        while i < len(prefix) and prefix[i] == c[i]:
+            i += 1
+        prefix = prefix[:i]
+    return prefix
+
+
+def shifted(box: BBox) -> BBox:
+    """
+    El bbox en la rejilla desplazada. Recortar en los bordes mantiene los
+    solapes (es monótono), que es lo único que necesita el filtro.
+    """
+    def lat(v: float) -> float:
+        return min(90.0, max(-90.0, v + SHIFT_DEG))
+
+    def lon(v: float) -> float:
+        return min(180.0, max(-180.0, v + SHIFT_DEG))
+
+    return BBox(lat(box.min_lat), lon(box.min_lon), lat(box.max_lat), lon(box.max_lon))
+
+
+def route_cell(box: BBox) -> str:
+    """
+    Valor de la columna geohash: la celda más pequeña de las dos rejillas.
+    """
+    cell = covering_cell(box)
+    alt = covering_cell(shifted(box))
+    return SHIFTED + alt if len(alt) > len(cell) else cell
+
+
+def query_cells(box: BBox) -> list[str]:
+    """
+    Celdas que cubren el bbox, a la mayor precisión que no pase de
+    MAX_QUERY_CELLS.
+    """
+    best = [""]
+    for precision in range(1, MAX_PRECISION + 1):
+        h, w = cell_size_deg(precision)
+        lats = np.arange(box.min_lat, box.max_lat + h, h)
+        lons = np.arange(box.min_lon, box.max_lon + w, w)
+        if len(lats) * len(lons) > MAX_QUERY_CELLS * 4:
+            break
+        cells = {
+            encode(min(la, box.max_lat), min(lo, box.max_lon), precision)
+            for la in lats
+            for lo in lons
+        }
+        if len(cells) > MAX_QUERY_CELLS:
+            break
+        best = sorted(cells)
+    return best
+
+
+def prefixes(cells: list[str]) -> set[str]:
+    return {c[:i] for c in cells for i in range(len(c))}
+
+
+def route_geo(cols: dict[str, np.ndarray]) -> dict | None:
+    """
+    Columnas de pathcodec -> valores de bbox/inicio/geohash para la ruta.
+    None si el path está vacío.
+    """
+    lat, lon = cols["lat"], cols["lon"]
+    if len(lat) == 0:
+        return None
+    box = BBox(float(lat.min()), float(lon.min()), float(lat.max()), float(lon.max()))
+    return {
+        "min_lat": box.min_lat,
+        "min_lon": box.min_lon,
+        "max_lat": box.max_lat,
+        "max_lon": box.max_lon,
+        "start_lat": float(lat[0]),
+        "start_lon": float(lon[0]),
+        "geohash": route_cell(box),
+    }
+
+
+def apply(route, geo: dict) -> None:
+    for key, value in geo.items():
+        setattr(route, key, value)
+
+
+def route_bbox(route) -> BBox:
+    return BBox(route.min_lat, route.min_lon, route.max_lat, route.max_lon)
+
+
+def candidates_filter(model, box: BBox):
+    """
+    Condición SQL: rutas cuyo bbox solapa con `box`, acotada primero por
+    geohash para que la resuelva el índice.
+    """
+    cells = query_cells(box)
+    cells += [SHIFTED + c for c in query_cells(shifted(box))]
+    by_cell = [
+        and_(model.geohash >= c, model.geohash < c + HIGH_CHAR)
+        for c in cells
+    ]
+    # SHIFTED solo no es una celda (con "" en las dos, se guarda "")
+    by_cell.append(model.geohash.in_(sorted(prefixes(cells) - {SHIFTED})))
+
+    return and_(
+        or_(*by_cell),
+        model.min_lat <= box.max_lat,
+        model.max_lat >= box.min_lat,
+        model.min_lon <= box.max_lon,
+        model.max_lon >= box.min_lon,
+    )
+
+
+def distance_order(model, lat: float, lon: float):
+    """
+    Expresión SQL para ordenar por cercanía del punto al bbox: distancia
+    equirectangular al cuadrado, en grados (solo sirve para ordenar).
+    """
+    coslat = max(float(np.cos(np.radians(lat))), 1e-6)
+    dlat = case(
+        (model.min_lat > lat, model.min_lat - lat),
+        (model.max_lat < lat, lat - model.max_lat),
+        else_=0.0,
+    )
+    dlon = case(
+        (model.min_lon > lon, model.min_lon - lon),
+        (model.max_lon < lon, lon - model.max_lon),
+        else_=0.0,
+    ) * coslat
+    return dlat * dlat + dlon * dlon
+
+
+def distance_to_bbox_m(lat: float, lon: float, box: BBox) -> float:
+    """
+    Distancia del punto al rectángulo (0 si está dentro).
+    """
+    clat = min(max(lat, box.min_lat), box.max_lat)
+    clon = min(max(lon, box.min_lon), box.max_lon)
+    return float(haversine_m(lat, lon, clat, clon))
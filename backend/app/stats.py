@@ -0,0 +1,143 @@
+"""
+Estadísticas de una ruta calculadas en el servidor a partir del path.
+
+Todo en una pasada vectorizada sobre las columnas de pathcodec:
+  - se descartan puntos con accuracy mala y saltos imposibles (jitter)
+  - distancia haversine
+  - tiempo en movimiento / parado (speed del GPS o velocidad derivada)
+  - velocidad máxima y media (total y en movimiento)
+  - parciales por km
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .geo import segment_lengths_m
+
+MAX_ACCURACY_M = 50.0     # igual que el filtro de location-task.ts
+MAX_SPEED_MS = 70.0       # ~250 km/h: más rápido es un salto del GPS
+MOVING_SPEED_MS = 0.5     # por debajo, parado
+MAX_GAP_S = 60.0          # un tramo más largo no cuenta como movimiento
+SPLIT_M = 1000.0
+
+
+@dataclass
+class RouteStats:
+    distance_m: int = 0
+    duration_s: int = 0
+    moving_time_s: int = 0
+    max_speed_ms: float = 0.0
+    avg_speed_ms: float = 0.0
+    avg_moving_speed_ms: float = 0.0
+    point_count: int = 0
+    # segundos que se tardó en cada km completo
+    splits_s: list[int] = field(default_factory=list)
+
+
+def _clean_mask(cols: dict[str, np.ndarray]) -> np.ndarray:
+    lat, lon, t, acc = cols["lat"], cols["lon"], cols["t"], cols["accuracy"]
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    ok &= np.isnan(acc) | (acc <= MAX_ACCURACY_M)
+    # con tiempos en unos puntos y no en otros (GPX de varios
+    # dispositivos), los que no tienen no cuentan
+    if np.isfinite(t[ok]).any():
+        ok &= np.isfinite(t)
+
+    # puntos desordenados o con el mismo t no aportan nada
+    idx = np.flatnonzero(ok)
+    if len(idx) > 1 and not np.isnan(t[idx]).all():
+        prev_t = np.maximum.accumulate(np.nan_to_num(t[idx], nan=-np.inf))
+        ok[idx[1:]] &= ~(t[idx[1:]] <= prev_t[:-1])
+    return ok
+
+
+def _reject_jumps(lat, lon, t) -> np.ndarray:
+    """
+    Quita puntos que implican una velocidad imposible desde el anterior.
+    Vectorizado por rondas: en cada una se cae el punto de llegada del
+    primer tramo imposible de cada racha y se recalcula (normalmente 1-2
+    rondas).
+    """
+    keep = np.ones(len(lat), dtype=bool)
+    for _ in range(5):
+        idx = np.flatnonzero(keep)
+        if len(idx) < 2:
+            break
+        d = segment_lengths_m(lat[idx], lon[idx])
+        dt = np.diff(t[idx]) / 1000.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            v = np.where(dt > 0, d / dt, 0.0)
+        bad = np.flatnonzero(v > MAX_SPEED_MS)
+        if not len(bad):
+            break
+        # un pico da dos tramos malos seguidos: solo sobra el punto del medio
+        first_of_run = bad[~np.isin(bad - 1, bad)]
+        keep[idx[first_of_run + 1]] = False
+    return keep
+
+
+def compute(cols: dict[str, np.ndarray]) -> RouteStats:
+    mask = _clean_mask(cols)
+    lat, lon, t, speed = (cols[k][mask] for k in ("lat", "lon", "t", "speed"))
+
+    has_time = len(t) > 1 and not np.isnan(t).any()
+    if has_time:
+        keep = _reject_jumps(lat, lon, t)
+        lat, lon, t, speed = lat[keep], lon[keep], t[keep], speed[keep]
+
+    n = len(lat)
+    out = RouteStats(point_count=n)
+    if n < 2:
+        return out
+
+    seg = segment_lengths_m(lat, lon)
+    total_m = float(seg.sum())
+    out.distance_m = int(round(total_m))
+
+    if not has_time:
+        return out
+
+    dt = np.diff(t) / 1000.0
+    duration = float(t[-1] - t[0]) / 1000.0
+    out.duration_s = int(round(duration))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        derived = np.where(dt > 0, seg / dt, 0.0)
+
+    # speed del GPS en el punto de llegada si es válida; si no, derivada
+    gps = speed[1:]
+    seg_speed = np.clip(np.where(np.isfinite(gps) & (gps >= 0), gps, derived), 0, MAX_SPEED_MS)
+
+    moving = (seg_speed >= MOVING_SPEED_MS) & (dt <= MAX_GAP_S)
+    moving_s = float(dt[moving].sum())
+    out.moving_time_s = int(round(moving_s))
+
+    # máxima y media en movimiento de la misma velocidad (la media,
+    # ponderada por dt), así que la media nunca supera a la máxima
+    out.max_speed_ms = float(seg_speed.max())
+    out.avg_speed_ms = total_m / duration if duration > 0 else 0.0
+    out.avg_moving_speed_ms = float((seg_speed[moving] * dt[moving]).sum()) / moving_s if moving_s > 0 else 0.0
+
+    # parciales: instante (interpolado) en que se cruza cada km
+    cum_m = np.concatenate([[0.0], np.cumsum(seg)])
+    marks = np.arange(SPLIT_M, total_m + 1e-9, SPLIT_M)
+    if len(marks):
+        cross_t = np.interp(marks, cum_m, t - t[0]) / 1000.0
+        out.splits_s = np.rint(np.diff(cross_t, prepend=0.0)).astype(int).tolist()
+
+    return out
+
+
+def apply(route, st: RouteStats) -> None:
+    """
+    Copia las estadísticas a la ruta. distance_m/duration_s solo se pisan
+    si el path da para calcularlos.
+    """
+    if st.point_count >= 2:
+        route.distance_m = st.distance_m
+        if st.duration_s:
+            route.duration_s = st.duration_s
+    route.moving_time_s = st.moving_time_s
+    route.max_speed_ms = round(st.max_speed_ms, 2)
+    route.avg_moving_speed_ms = round(st.avg_moving_speed_ms, 2)
+    route.splits_s = st.splits_s
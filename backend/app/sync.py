@@ -0,0 +1,233 @@
+"""
+Sincronización incremental para clientes offline-first (GET /sync).
+
+Cada escritura que cambia lo que ve un usuario (sus rutas, su feed, sus
+amigos, sus solicitudes) añade en la misma transacción una fila a
+sync_changes: (seq, destinatario, tipo, id). `seq` sale de una secuencia
+global, así que es el cursor monótono: el cliente guarda el `token` de la
+respuesta y la siguiente vez solo se leen sus filas con seq > token (dos
+rangos de índice; sin cambios no se lee nada más).
+
+Las filas no dicen qué cambió sino qué hay que mirar: al leer se carga el
+estado actual de cada entidad y, si ya no existe o ya no la puede ver, va
+en la lista de borrados. Una fila cuyo objeto ya no existe es la lápida.
+Así dar el mismo cambio dos veces es inofensivo, lo que permite:
+  - SYNC_SETTLE_S: en Postgres una transacción puede hacer commit de un
+    seq menor después de que otra ya sea visible. El token no pasa de los
+    cambios de los últimos SYNC_SETTLE_S segundos, que se vuelven a
+    mandar en la siguiente llamada en vez de perderse.
+  - rutas públicas: van con destinatario NULL (las lee todo el mundo,
+    como el feed), y el cliente recibe upsert o borrado según lo que vea.
+
+`prune` borra los cambios de más de SYNC_RETENTION_DAYS; un token más
+antiguo que lo que queda recibe `reset` y una instantánea completa.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+from uuid import UUID
+
+from sqlalchemy import delete, func, insert, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from . import feed, friendgraph, models
+
+SYNC_SETTLE_S = float(os.getenv("SYNC_SETTLE_S", "5"))
+SYNC_RETENTION_DAYS = int(os.getenv("SYNC_RETENTION_DAYS", "30"))
+SYNC_MAX_CHANGES = 500
+# entradas del feed en una instantánea (el resto, con /feed?before=)
+SNAPSHOT_FEED = 50
+
+SyncChange = models.SyncChange
+Route = models.Route
+
+# (destinatario o None = todos, tipo, id)
+Change = tuple[UUID | None, str, UUID]
+
+
+class SyncTokenError(ValueError):
+    pass
+
+
+def parse_token(raw: str) -> int:
+    try:
+        seq = int(raw)
+    except ValueError:
+        raise SyncTokenError("BAD_SYNC_TOKEN")
+    if seq < 0:
+        raise SyncTokenError("BAD_SYNC_TOKEN")
+    return seq
+
+
+# ------------------------
+# Escritura (sin commit)
+# ------------------------
+def record(db: Session, changes: Iterable[Change]) -> None:
+    rows = [
+        {"user_id": user_id, "kind": kind, "entity_id": entity_id}
+        for user_id, kind, entity_id in dict.fromkeys(changes)
+    ]
+    if rows:
+        db.execute(insert(SyncChange), rows)
+
+
+def route_changes(owner_id: UUID, route_ids: list[UUID], readers: Iterable[UUID], broadcast: bool) -> list[Change]:
+    """
+    `readers`: quién puede tener (o haber tenido) las rutas en el feed;
+    `broadcast` si son o eran públicas.
+    """
+    out: list[Change] = []
+    readers = list(readers)
+    for route_id in route_ids:
+        out.append((owner_id, "route", route_id))
+        out += [(reader, "feed", route_id) for reader in readers]
+        if broadcast:
+            out.append((None, "feed", route_id))
+    return out
+
+
+def route_changed(db: Session, route: models.Route, broadcast: bool) -> None:
+    """
+    Ruta creada, editada o a punto de borrarse. Se avisa al dueño y a
+    todos sus amigos sea cual sea la visibilidad: si la ruta ha dejado de
+    estar en su feed, les llega como borrada.
+    """
+    friends = db.scalars(select(models.Friend.friend_id).where(models.Friend.user_id == route.user_id)).all()
+    record(db, route_changes(route.user_id, [route.id], [route.user_id, *friends], broadcast))
+
+
+def friend_changes(pairs: Iterable[tuple[UUID, UUID]]) -> list[Change]:
+    return [c for a, b in pairs for c in ((a, "friend", b), (b, "friend", a))]
+
+
+def request_changes(requests: Iterable[tuple[UUID, UUID, UUID]]) -> list[Change]:
+    """
+    requests: (request_id, from_user_id, to_user_id).
+    """
+    return [c for rid, a, b in requests for c in ((a, "friend_request", rid), (b, "friend_request", rid))]
+
+
+def feed_changes(entries: Iterable[tuple[UUID, UUID]]) -> list[Change]:
+    """
+    entries: (lector, ruta) de entradas de timeline nuevas.
+    """
+    return [(reader, "feed", route_id) for reader, route_id in entries]
+
+
+def prune(db: Session, days: int = SYNC_RETENTION_DAYS) -> int:
+    """
+    Borra los cambios antiguos (nunca el último: marca hasta dónde llega
+    la secuencia). Hace commit.
+    """
+    last = db.scalar(select(func.max(SyncChange.seq)))
+    if last is None:
+        return 0
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    n = db.execute(
+        delete(SyncChange).where(SyncChange.created_at < cutoff, SyncChange.seq < last)
+    ).rowcount
+    db.commit()
+    return n
+
+
+# ------------------------
+# Lectura
+# ------------------------
+def _settled(created_at: datetime, cutoff: datetime) -> bool:
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at <= cutoff
+
+
+def _snapshot_token(db: Session, cutoff: datetime) -> int:
+    seq = db.scalar(
+        select(SyncChange.seq).where(SyncChange.created_at <= cutoff).order_by(SyncChange.seq.desc()).limit(1)
+    )
+    return seq or 0
+
+
+def _feed_visible(db: Session, user_id: UUID, ids: list[UUID]) -> list[models.Route]:
+    in_timeline = select(models.FeedEntry.route_id).where(
+        models.FeedEntry.owner_id == user_id, models.FeedEntry.route_id.in_(ids)
+    )
+    return db.scalars(
+        select(Route).where(Route.id.in_(ids), or_(Route.visibility == "public", Route.id.in_(in_timeline)))
+    ).all()
+
+
+def _states(db: Session, user_id: UUID, ids: dict[str, list[UUID]]) -> dict:
+    """
+    Estado actual de las entidades que han cambiado: lo que sigue visible
+    va en la lista, el resto en deleted_*. Una consulta por tipo.
+    """
+    out = {}
+    if ids["route"]:
+        routes = db.scalars(select(Route).where(Route.id.in_(ids["route"]), Route.user_id == user_id)).all()
+        out["routes"] = routes
+        out["deleted_routes"] = sorted(set(ids["route"]) - {r.id for r in routes})
+    if ids["feed"]:
+        routes = _feed_visible(db, user_id, ids["feed"])
+        out["feed"] = routes
+        out["deleted_feed"] = sorted(set(ids["feed"]) - {r.id for r in routes})
+    if ids["friend"]:
+        friends = db.execute(friendgraph.friends_query(user_id, ids["friend"])).all()
+        out["friends"] = friends
+        out["deleted_friends"] = sorted(set(ids["friend"]) - {f.id for f in friends})
+    if ids["friend_request"]:
+        requests = db.execute(friendgraph.requests_query(user_id, None, ids["friend_request"])).all()
+        out["friend_requests"] = requests
+        out["deleted_friend_requests"] = sorted(set(ids["friend_request"]) - {r.id for r in requests})
+    return out
+
+
+def snapshot(db: Session, user_id: UUID) -> dict:
+    """
+    Primera sincronización (o token caducado): todo lo que ve el usuario y
+    un token tomado antes de leerlo.
+    """
+    token = _snapshot_token(db, datetime.now(timezone.utc) - timedelta(seconds=SYNC_SETTLE_S))
+    return {
+        "token": str(token),
+        "reset": True,
+        "has_more": False,
+        "routes": db.scalars(
+            select(Route).where(Route.user_id == user_id).order_by(Route.created_at.desc(), Route.id.desc())
+        ).all(),
+        "feed": feed.read_feed(db, user_id, SNAPSHOT_FEED),
+        "friends": db.execute(friendgraph.friends_query(user_id)).all(),
+        "friend_requests": db.execute(friendgraph.requests_query(user_id, None)).all(),
+    }
+
+
+def changes_since(db: Session, user_id: UUID, since: int, limit: int = SYNC_MAX_CHANGES) -> dict:
+    oldest = db.scalar(select(func.min(SyncChange.seq)))
+    if oldest is not None and since < oldest - 1:
+        # lo que había entre medias ya se ha podado
+        return snapshot(db, user_id)
+
+    cols = (SyncChange.seq, SyncChange.kind, SyncChange.entity_id, SyncChange.created_at)
+    mine = select(*cols).where(SyncChange.user_id == user_id, SyncChange.seq > since)
+    everyone = select(*cols).where(SyncChange.user_id.is_(None), SyncChange.seq > since)
+    both = union_all(mine, everyone).subquery()
+    rows = db.execute(select(both).order_by(both.c.seq).limit(limit + 1)).all()
+
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+
+    # el token avanza hasta antes del primer cambio sin asentar
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=SYNC_SETTLE_S)
+    token = since
+    for row in rows:
+        if not _settled(row.created_at, cutoff):
+            break
+        token = row.seq
+    # si el token no ha avanzado, volver a llamar daría la misma página:
+    # lo que queda llega en la siguiente sincronización normal
+    has_more = truncated and token > since
+
+    ids: dict[str, list[UUID]] = {"route": [], "feed": [], "friend": [], "friend_request": []}
+    for row in rows:
+        ids[row.kind].append(row.entity_id)
+    ids = {kind: list(dict.fromkeys(v)) for kind, v in ids.items()}
+
+    return {"token": str(token), "reset": False, "has_more": has_more, **_states(db, user_id, ids)}
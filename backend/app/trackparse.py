@@ -0,0 +1,282 @@
+"""
+Lectura de tracks de otras apps (GPX, GeoJSON y, si está instalado
+fitparse, FIT) a columnas de pathcodec, y de ahí a los valores de la fila
+de Route (blob, LODs, estadísticas, bbox/geohash).
+
+Sin BD ni ORM: se ejecuta en los procesos del pool de imports.py y solo
+devuelve dicts/bytes. El GPX se lee con iterparse, soltando cada punto en
+cuanto se ha leído; el GeoJSON se carga fichero a fichero (las
+coordenadas ya son el path entero).
+"""
+import json
+import os
+import zipfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from xml.etree import ElementTree
+
+import numpy as np
+
+from . import pathcodec, simplify, spatial, stats
+
+try:
+    from fitparse import FitFile
+except ImportError:
+    FitFile = None
+
+MAX_POINTS = int(os.getenv("IMPORT_MAX_POINTS", "200000"))
+MAX_NAME = 200
+
+FORMATS = {
+    ".gpx": "gpx",
+    ".geojson": "geojson",
+    ".json": "geojson",
+    ".fit": "fit",
+}
+
+# grados = semicírculos * 180 / 2^31
+_SEMICIRCLE_DEG = 180.0 / 2**31
+
+
+class TrackError(ValueError):
+    """
+    Fichero que no se puede importar; el mensaje es el código que se
+    devuelve en los errores del trabajo.
+    """
+
+
+def format_for(filename: str) -> str | None:
+    return FORMATS.get(os.path.splitext(filename)[1].lower())
+
+
+class _Track:
+    def __init__(self, name: str | None):
+        self.name = name
+        self.lat: list[float] = []
+        self.lon: list[float] = []
+        self.t: list[float] = []
+        self.speed: list[float] = []
+
+    def add(self, lat: float, lon: float, t: float = np.nan, speed: float = np.nan) -> None:
+        # puntos basura (NaN, lat=500...) se saltan, no tiran el fichero
+        if not (abs(lat) <= 90 and abs(lon) <= 180):
+            return
+        if len(self.lat) >= MAX_POINTS:
+            raise TrackError("TOO_MANY_POINTS")
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.t.append(t)
+        self.speed.append(speed)
+
+    def columns(self) -> dict[str, np.ndarray]:
+        n = len(self.lat)
+        return {
+            "lat": np.asarray(self.lat, dtype=np.float64),
+            "lon": np.asarray(self.lon, dtype=np.float64),
+            "t": np.asarray(self.t, dtype=np.float64),
+            "accuracy": np.full(n, np.nan),
+            "speed": np.asarray(self.speed, dtype=np.float64),
+        }
+
+
+def _epoch_ms(raw: str | None) -> float:
+    if not raw:
+        return np.nan
+    try:
+        dt = datetime.fromisoformat(raw.strip())
+    except ValueError:
+        return np.nan
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp() * 1000
+
+
+# ------------------------
+# GPX
+# ------------------------
+def _local(tag: str) -> str:
+    # "{http://www.topografix.com/GPX/1/1}trkpt" -> "trkpt"
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_gpx(stream) -> list[_Track]:
+    """
+    Un track por <trk> (los <trkseg> se concatenan) o por <rte>.
+    """
+    tracks: list[_Track] = []
+    current: _Track | None = None
+    point: dict | None = None
+    depth_names: list[str] = []
+
+    try:
+        for event, elem in ElementTree.iterparse(stream, events=("start", "end")):
+            tag = _local(elem.tag)
+            if event == "start":
+                depth_names.append(tag)
+                if tag in ("trk", "rte"):
+                    current = _Track(None)
+                elif tag in ("trkpt", "rtept") and current is not None:
+                    point = {"lat": elem.get("lat"), "lon": elem.get("lon"), "time": None}
+                continue
+
+            depth_names.pop()
+            if tag == "time" and point is not None:
+                point["time"] = elem.text
+            elif tag == "name" and current is not None and depth_names and depth_names[-1] in ("trk", "rte"):
+                current.name = (elem.text or "").strip() or None
+            elif tag in ("trkpt", "rtept") and point is not None:
+                try:
+                    current.add(float(point["lat"]), float(point["lon"]), _epoch_ms(point["time"]))
+                except (TypeError, ValueError):
+                    pass
+                point = None
+                elem.clear()
+            elif tag in ("trk", "rte") and current is not None:
+                tracks.append(current)
+                current = None
+                elem.clear()
+    except ElementTree.ParseError:
+        raise TrackError("BAD_GPX")
+    return tracks
+
+
+# ------------------------
+# GeoJSON
+# ------------------------
+def _geojson_lines(obj) -> list[tuple[dict, list]]:
+    """
+    (properties, lista de líneas de coordenadas) de cada Feature.
+    """
+    kind = obj.get("type") if isinstance(obj, dict) else None
+    if kind == "FeatureCollection":
+        return [item for f in obj.get("features") or [] for item in _geojson_lines(f)]
+    if kind == "Feature":
+        geometry = obj.get("geometry") or {}
+        props = obj.get("properties") or {}
+        lines = _geojson_lines(geometry)
+        return [(props, coords) for _, coords in lines]
+    if kind == "LineString":
+        return [({}, [obj.get("coordinates") or []])]
+    if kind == "MultiLineString":
+        return [({}, obj.get("coordinates") or [])]
+    return []
+
+
+def parse_geojson(stream) -> list[_Track]:
+    try:
+        obj = json.load(stream)
+    except (ValueError, UnicodeDecodeError):
+        raise TrackError("BAD_GEOJSON")
+
+    tracks = []
+    for props, lines in _geojson_lines(obj):
+        track = _Track(props.get("name"))
+        # tiempos como los deja togeojson: properties.coordTimes (ISO o ms)
+        times = props.get("coordTimes") or props.get("times") or []
+        flat_times = [t for line in times for t in line] if times and isinstance(times[0], list) else times
+        i = 0
+        for line in lines:
+            for coord in line:
+                t = flat_times[i] if i < len(flat_times) else None
+                i += 1
+                try:
+                    lon, lat = float(coord[0]), float(coord[1])
+                except (TypeError, ValueError, IndexError):
+                    continue
+                track.add(lat, lon, float(t) if isinstance(t, (int, float)) else _epoch_ms(t))
+        tracks.append(track)
+    return tracks
+
+
+# ------------------------
+# FIT (opcional)
+# ------------------------
+def parse_fit(stream) -> list[_Track]:
+    if FitFile is None:
+        raise TrackError("FIT_UNSUPPORTED")
+    track = _Track(None)
+    try:
+        for record in FitFile(stream).get_messages("record"):
+            values = record.get_values()
+            lat, lon = values.get("position_lat"), values.get("position_long")
+            if lat is None or lon is None:
+                continue
+            ts = values.get("timestamp")
+            speed = values.get("enhanced_speed", values.get("speed"))
+            track.add(
+                lat * _SEMICIRCLE_DEG,
+                lon * _SEMICIRCLE_DEG,
+                ts.replace(tzinfo=timezone.utc).timestamp() * 1000 if ts else np.nan,
+                float(speed) if speed is not None else np.nan,
+            )
+    except TrackError:
+        raise
+    except Exception:
+        raise TrackError("BAD_FIT")
+    return [track]
+
+
+PARSERS = {"gpx": parse_gpx, "geojson": parse_geojson, "fit": parse_fit}
+
+
+# ------------------------
+# Track -> fila de Route
+# ------------------------
+def route_values(cols: dict[str, np.ndarray], name: str) -> dict:
+    """
+    Lo mismo que hace main.insert_route antes del INSERT, sin ORM.
+    created_at es el inicio del track (si tiene tiempos): las rutas
+    importadas se ordenan en el feed por cuándo se hicieron.
+    """
+    try:
+        path_blob = pathcodec.encode_columns(cols)
+    except ValueError:
+        # tiempos imposibles (saltos de semanas, fechas absurdas): la ruta
+        # se importa sin tiempos en vez de fallar
+        cols = {**cols, "t": np.full(len(cols["t"]), np.nan)}
+        path_blob = pathcodec.encode_columns(cols)
+
+    lods = simplify.encode_lods(cols)
+    row = SimpleNamespace(distance_m=0, duration_s=0)
+    stats.apply(row, stats.compute(cols))
+    values = {
+        "name": name[:MAX_NAME],
+        "path_blob": path_blob,
+        "path_lod_low": lods["low"],
+        "path_lod_medium": lods["medium"],
+        **vars(row),
+    }
+    geo = spatial.route_geo(cols)
+    if geo:
+        values.update(geo)
+
+    t = cols["t"][np.isfinite(cols["t"])]
+    if len(t):
+        values["created_at"] = datetime.fromtimestamp(float(t.min()) / 1000, tz=timezone.utc)
+    return values
+
+
+def parse_file(source: str, member: str | None, fmt: str) -> list[dict]:
+    """
+    Punto de entrada de los procesos: `source` es la subida (un zip si
+    `member` no es None). Devuelve los valores de cada ruta del fichero.
+    """
+    label = os.path.splitext(os.path.basename(member or ""))[0] or "Ruta importada"
+    parser = PARSERS[fmt]
+
+    if member is None:
+        with open(source, "rb") as f:
+            tracks = parser(f)
+    else:
+        with zipfile.ZipFile(source) as zf, zf.open(member) as f:
+            tracks = parser(f)
+
+    out = []
+    for i, track in enumerate(tracks):
+        if len(track.lat) < 2:
+            continue
+        name = track.name or (label if len(tracks) == 1 else f"{label} ({i + 1})")
+        out.append(route_values(track.columns(), name))
+    if not out:
+        raise TrackError("NO_TRACK_POINTS")
+    return out
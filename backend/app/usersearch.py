@@ -0,0 +1,150 @@
+"""
+Búsqueda de usuarios por nombre (typeahead de /users/search).
+
+Se busca sobre users.name_lower y los resultados que empiezan por el
+texto van antes que los que solo lo contienen.
+  - Postgres: LIKE 'q%' por el B-tree (collation "C") y LIKE '%q%' por el
+    índice GIN de pg_trgm.
+  - SQLite (local): índice en memoria con los nombres ordenados (prefijos
+    por bisect) y n-gramas -> ids (substrings). Se rellena de la BD la
+    primera vez, se actualiza al registrar y se recarga cada
+    SEARCH_INDEX_TTL_S por si hay más de un proceso.
+"""
+import asyncio
+import bisect
+import os
+import time
+from uuid import UUID
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+SEARCH_LIMIT = 20
+SEARCH_INDEX_TTL_S = float(os.getenv("SEARCH_INDEX_TTL_S", "300"))
+GRAM_SIZES = (2, 3)
+
+
+def normalize(name: str) -> str:
+    return " ".join(name.split()).lower()
+
+
+def _grams(text: str, n: int) -> set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NameIndex:
+    def __init__(self, ttl_s: float):
+        self.ttl_s = ttl_s
+        self.loaded_at: float | None = None
+        self._names: dict[UUID, str] = {}
+        self._sorted: list[tuple[str, UUID]] = []
+        self._grams: dict[str, set[UUID]] = {}
+        self._load_lock = asyncio.Lock()
+
+    def _index(self, user_id: UUID, name: str) -> None:
+        key = normalize(name)
+        self._names[user_id] = name
+        for n in GRAM_SIZES:
+            for gram in _grams(key, n):
+                self._grams.setdefault(gram, set()).add(user_id)
+
+    def build(self, rows) -> None:
+        """
+        rows: (id, name) de todos los usuarios.
+        """
+        self._names, self._grams = {}, {}
+        for user_id, name in rows:
+            self._index(user_id, name)
+        self._sorted = sorted((normalize(name), uid) for uid, name in self._names.items())
+        self.loaded_at = time.monotonic()
+
+    def add(self, user_id: UUID, name: str) -> None:
+        if self.loaded_at is None or user_id in self._names:
+            return
+        self._index(user_id, name)
+        bisect.insort(self._sorted, (normalize(name), user_id))
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl_s:
+            return
+        async with self._load_lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl_s:
+                return
+            rows = (await db.execute(select(models.User.id, models.User.name))).all()
+            self.build(rows)
+
+    def search(self, q: str, limit: int) -> list[tuple[UUID, str]]:
+        out: list[tuple[UUID, str]] = []
+
+        i = bisect.bisect_left(self._sorted, (q,))
+        while i < len(self._sorted) and len(out) < limit:
+            key, user_id = self._sorted[i]
+            if not key.startswith(q):
+                break
+            out.append((user_id, self._names[user_id]))
+            i += 1
+
+        if len(out) >= limit or len(q) < min(GRAM_SIZES):
+            return out
+
+        n = max(s for s in GRAM_SIZES if s <= len(q))
+        candidates: set[UUID] | None = None
+        for gram in sorted(_grams(q, n), key=lambda g: len(self._grams.get(g, ()))):
+            ids = self._grams.get(gram, set())
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return out
+
+        inner = []
+        for user_id in candidates:
+            key = normalize(self._names[user_id])
+            pos = key.find(q)
+            if pos > 0:
+                inner.append((pos, key, user_id))
+        inner.sort()
+        out.extend((uid, self._names[uid]) for _, _, uid in inner[:limit - len(out)])
+        return out
+
+
+local_index = NameIndex(SEARCH_INDEX_TTL_S)
+
+
+async def _search_sql(db: AsyncSession, q: str, limit: int) -> list[tuple[UUID, str]]:
+    User = models.User
+    prefix = (
+        await db.execute(
+            select(User.id, User.name)
+            .where(User.name_lower.startswith(q, autoescape=True))
+            .order_by(User.name_lower)
+            .limit(limit)
+        )
+    ).all()
+    if len(prefix) >= limit:
+        return [tuple(r) for r in prefix]
+
+    inner = (
+        await db.execute(
+            select(User.id, User.name)
+            .where(
+                User.name_lower.contains(q, autoescape=True),
+                ~User.name_lower.startswith(q, autoescape=True),
+            )
+            .order_by(func.strpos(User.name_lower, q), User.name_lower)
+            .limit(limit - len(prefix))
+        )
+    ).all()
+    return [tuple(r) for r in prefix + inner]
+
+
+async def search(db: AsyncSession, q: str, limit: int = SEARCH_LIMIT) -> list[tuple[UUID, str]]:
+    """
+    (id, name) de los usuarios que casan con `q`: primero por prefijo,
+    luego por substring (más cerca del principio antes).
+    """
+    q = normalize(q)
+    if db.get_bind().dialect.name == "postgresql":
+        return await _search_sql(db, q, limit)
+    await local_index.ensure_loaded(db)
+    return local_index.search(q, limit)
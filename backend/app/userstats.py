@@ -0,0 +1,271 @@
+"""
+Estadísticas agregadas por usuario: totales, mejores marcas y totales por
+semana/mes (tablas user_stats y user_stat_buckets).
+
+Se mantienen de forma incremental dentro de la transacción que crea o
+borra rutas (insert_route, imports, DELETE /routes/{id}): sumas con
+upserts, como heatmap.py, así que dos rutas a la vez del mismo usuario no
+se pisan. Leerlas (GET /me/stats) es leer una fila y unos pocos buckets,
+tenga el usuario las rutas que tenga.
+
+Las mejores marcas solo se recalculan contra `routes` al borrar la ruta
+que tenía alguna de ellas.
+"""
+from datetime import date, datetime, timedelta, timezone
+from uuid import UUID
+
+from sqlalchemy import and_, case, delete, or_, select, update
+from sqlalchemy.orm import Session, load_only
+
+from . import models
+from .db import dialect_insert
+
+# semanas / meses que devuelve GET /me/stats (los vacíos van con ceros)
+STATS_WEEKS = 12
+STATS_MONTHS = 12
+
+SUMS = ("route_count", "total_distance_m", "total_duration_s", "total_moving_time_s")
+# (columna de la marca, columna de su ruta, campo de la ruta)
+BESTS = (
+    ("best_distance_m", "best_distance_route_id", "distance_m"),
+    ("best_duration_s", "best_duration_route_id", "duration_s"),
+    ("best_avg_speed_ms", "best_avg_speed_route_id", "avg_moving_speed_ms"),
+)
+ROUTE_FIELDS = ("id", "user_id", "distance_m", "duration_s", "moving_time_s", "avg_moving_speed_ms", "created_at")
+
+UserStats = models.UserStats
+Bucket = models.UserStatBucket
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _periods(created_at: datetime) -> tuple[tuple[str, date], tuple[str, date]]:
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    day = created_at.date()
+    return ("week", week_start(day)), ("month", month_start(day))
+
+
+def route_values(route) -> dict:
+    """
+    Campos de una Route del ORM que cuentan para las estadísticas.
+    """
+    return {f: getattr(route, f) for f in ROUTE_FIELDS}
+
+
+# ------------------------
+# Escritura (sin commit)
+# ------------------------
+def add_routes(db: Session, routes: list[dict]) -> None:
+    """
+    Suma rutas nuevas (dicts con ROUTE_FIELDS; las de imports.py valen tal
+    cual). Un upsert de user_stats y otro de buckets para todo el lote.
+    """
+    if not routes:
+        return
+    totals: dict[UUID, dict] = {}
+    buckets: dict[tuple[UUID, str, date], list[int]] = {}
+    for r in routes:
+        t = totals.setdefault(
+            r["user_id"],
+            {"user_id": r["user_id"], **dict.fromkeys(SUMS, 0), **{c: None for b in BESTS for c in b[:2]}},
+        )
+        distance, duration = r.get("distance_m") or 0, r.get("duration_s") or 0
+        t["route_count"] += 1
+        t["total_distance_m"] += distance
+        t["total_duration_s"] += duration
+        t["total_moving_time_s"] += r.get("moving_time_s") or 0
+        for value_col, route_col, field in BESTS:
+            value = r.get(field)
+            if value and (t[value_col] is None or value > t[value_col]):
+                t[value_col], t[route_col] = value, r["id"]
+        for period, start in _periods(r["created_at"]):
+            b = buckets.setdefault((r["user_id"], period, start), [0, 0, 0])
+            b[0] += 1
+            b[1] += distance
+            b[2] += duration
+
+    insert = dialect_insert(db)
+    now = datetime.now(timezone.utc)
+
+    stmt = insert(UserStats)
+    set_ = {c: getattr(UserStats, c) + getattr(stmt.excluded, c) for c in SUMS}
+    for value_col, route_col, _ in BESTS:
+        current, new = getattr(UserStats, value_col), getattr(stmt.excluded, value_col)
+        better = or_(current.is_(None), new > current)
+        set_[value_col] = case((better, new), else_=current)
+        set_[route_col] = case((better, getattr(stmt.excluded, route_col)), else_=getattr(UserStats, route_col))
+    set_["updated_at"] = stmt.excluded.updated_at
+    db.execute(
+        stmt.on_conflict_do_update(index_elements=["user_id"], set_=set_),
+        [{**totals[uid], "updated_at": now} for uid in sorted(totals)],
+    )
+
+    stmt = insert(Bucket)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", "period", "start"],
+            set_={
+                "route_count": Bucket.route_count + stmt.excluded.route_count,
+                "distance_m": Bucket.distance_m + stmt.excluded.distance_m,
+                "duration_s": Bucket.duration_s + stmt.excluded.duration_s,
+            },
+        ),
+        [
+            {"user_id": uid, "period": period, "start": start, "route_count": n, "distance_m": d, "duration_s": s}
+            for (uid, period, start), (n, d, s) in sorted(buckets.items())
+        ],
+    )
+
+
+def remove_route(db: Session, route) -> None:
+    """
+    Resta una ruta que se va a borrar (aún en la BD). Si tenía alguna
+    mejor marca, se busca la siguiente entre las demás rutas del usuario.
+    """
+    r = route_values(route)
+    user_id = r["user_id"]
+    distance, duration = r["distance_m"] or 0, r["duration_s"] or 0
+
+    db.execute(
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .values(
+            route_count=UserStats.route_count - 1,
+            total_distance_m=UserStats.total_distance_m - distance,
+            total_duration_s=UserStats.total_duration_s - duration,
+            total_moving_time_s=UserStats.total_moving_time_s - (r["moving_time_s"] or 0),
+            updated_at=datetime.now(timezone.utc),
+        )
+    )
+    periods = _periods(r["created_at"])
+    for period, start in periods:
+        db.execute(
+            update(Bucket)
+            .where(Bucket.user_id == user_id, Bucket.period == period, Bucket.start == start)
+            .values(
+                route_count=Bucket.route_count - 1,
+                distance_m=Bucket.distance_m - distance,
+                duration_s=Bucket.duration_s - duration,
+            )
+        )
+    db.execute(
+        delete(Bucket)
+        .where(Bucket.user_id == user_id, Bucket.route_count <= 0)
+        .where(or_(*(and_(Bucket.period == p, Bucket.start == s) for p, s in periods)))
+        .execution_options(synchronize_session=False)
+    )
+
+    holders = db.execute(
+        select(*(getattr(UserStats, route_col) for _, route_col, _ in BESTS)).where(UserStats.user_id == user_id)
+    ).first()
+    if holders is None:
+        return
+    for (value_col, route_col, field), holder in zip(BESTS, holders):
+        if holder != r["id"]:
+            continue
+        column = getattr(models.Route, field)
+        best = db.execute(
+            select(column, models.Route.id)
+            .where(models.Route.user_id == user_id, models.Route.id != r["id"], column > 0)
+            .order_by(column.desc(), models.Route.created_at)
+            .limit(1)
+        ).first()
+        db.execute(
+            update(UserStats)
+            .where(UserStats.user_id == user_id)
+            .values({value_col: best[0] if best else None, route_col: best[1] if best else None})
+        )
+
+
+def rebuild(db: Session, batch_size: int = 1000) -> int:
+    """
+    Recalcula todo desde `routes` (primer despliegue o para corregir
+    desvíos). Hace commit.
+    """
+    db.execute(delete(Bucket))
+    db.execute(delete(UserStats))
+    last_id, done = None, 0
+    while True:
+        q = (
+            select(models.Route)
+            .options(load_only(*(getattr(models.Route, f) for f in ROUTE_FIELDS)))
+            .order_by(models.Route.id)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            q = q.where(models.Route.id > last_id)
+        routes = db.scalars(q).all()
+        if not routes:
+            break
+        add_routes(db, [route_values(route) for route in routes])
+        done += len(routes)
+        last_id = routes[-1].id
+        db.commit()
+        db.expunge_all()
+    db.commit()
+    return done
+
+
+# ------------------------
+# Lectura
+# ------------------------
+def _series(rows: dict[date, models.UserStatBucket], starts: list[date]) -> list[dict]:
+    out = []
+    for start in starts:
+        b = rows.get(start)
+        out.append({
+            "start": start,
+            "route_count": b.route_count if b else 0,
+            "distance_m": b.distance_m if b else 0,
+            "duration_s": b.duration_s if b else 0,
+        })
+    return out
+
+
+def read(db: Session, user_id: UUID, today: date | None = None) -> dict:
+    """
+    Lo que devuelve GET /me/stats: la fila de totales, los últimos
+    STATS_WEEKS/STATS_MONTHS buckets y la última ruta (índice
+    user_id + created_at). Tres consultas acotadas.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    weeks = [week_start(today) - timedelta(weeks=i) for i in range(STATS_WEEKS)]
+    months = [month_start(today)]
+    while len(months) < STATS_MONTHS:
+        months.append(month_start(months[-1] - timedelta(days=1)))
+
+    stats = db.get(UserStats, user_id)
+    rows = db.scalars(
+        select(Bucket).where(
+            Bucket.user_id == user_id,
+            or_(
+                and_(Bucket.period == "week", Bucket.start >= weeks[-1]),
+                and_(Bucket.period == "month", Bucket.start >= months[-1]),
+            ),
+        )
+    ).all()
+    last = db.scalar(
+        select(models.Route)
+        .where(models.Route.user_id == user_id)
+        .order_by(models.Route.created_at.desc(), models.Route.id.desc())
+        .limit(1)
+    )
+
+    out = {c: getattr(stats, c) if stats else 0 for c in SUMS}
+    out["bests"] = {
+        field: {"value": getattr(stats, value_col), "route_id": getattr(stats, route_col)}
+        if stats and getattr(stats, route_col) is not None
+        else None
+        for value_col, route_col, field in BESTS
+    }
+    out["weeks"] = _series({b.start: b for b in rows if b.period == "week"}, weeks)
+    out["months"] = _series({b.start: b for b in rows if b.period == "month"}, months)
+    out["last_route"] = last
+    return out
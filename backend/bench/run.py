@@ -0,0 +1,259 @@
+"""
+Benchmark de la API sobre una BD sembrada con bench.seed.
+
+    cd backend
+    export DATABASE_URL=sqlite:///bench.db
+    python -m bench.seed --users 200 --routes 5
+    python -m bench.run --requests 300 --concurrency 16
+
+Por defecto levanta la app en el mismo proceso (httpx + ASGITransport);
+con --url se ataca un servidor ya arrancado (mismo DATABASE_URL y
+SECRET_KEY: los tokens se firman aquí). En los dos casos las consultas
+SQL de cada petición se leen de la cabecera Server-Timing, que solo sale
+con `X-Debug-Token: <METRICS_TOKEN>` (ver app/instrumentation.py): con
+--url hay que exportar el mismo METRICS_TOKEN que el servidor; en el
+mismo proceso, si no hay, se genera uno.
+
+Escenarios: login, feed, route (GET /routes/{id}), create (POST /routes)
+y search (/users/search). Para cada uno: p50/p95/p99, peticiones/s,
+errores y consultas por petición.
+
+Modo regresión (CI):
+    python -m bench.run --save-baseline bench/baseline.json      # una vez
+    python -m bench.run --baseline bench/baseline.json --max-regression 0.3
+sale con código 1 si el p95 de algún escenario empeora más de un 30%, si
+hace más consultas por petición que en la referencia o si hay más errores.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import re
+import secrets
+import sys
+import time
+
+import httpx
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import instrumentation, models, pathcodec, security
+from app.db import engine
+
+from .seed import BENCH_PASSWORD, EMAIL_DOMAIN, random_path
+
+SCENARIOS = ("login", "feed", "route", "create", "search")
+
+# las cachés hacen que la media de consultas baile unas décimas
+QUERY_TOLERANCE = 0.5
+
+class Fixtures:
+    """
+    Datos de la BD sembrada que necesitan los escenarios.
+    """
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        with Session(engine) as db:
+            users = db.execute(
+                select(models.User.id, models.User.email, models.User.name)
+                .where(models.User.email.like(f"bench%@{EMAIL_DOMAIN}"))
+            ).all()
+            if not users:
+                raise SystemExit("No hay usuarios de benchmark: ejecuta antes `python -m bench.seed`")
+            visible = db.execute(
+                select(models.Route.id, models.Route.user_id, models.Route.visibility)
+                .where(models.Route.user_id.in_([u.id for u in users]))
+                .where(models.Route.visibility != "private")
+            ).all()
+        self.users = users
+        self.tokens = {u.id: security.create_access_token(u.id) for u in users}
+        self.public_routes = [r.id for r in visible if r.visibility == "public"]
+        self.routes_by_user: dict = {}
+        for r in visible:
+            self.routes_by_user.setdefault(r.user_id, []).append(r.id)
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def auth(self, user) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[user.id]}"}
+
+
+def build_request(name: str, fx: Fixtures, np_rng: np.random.Generator) -> tuple[str, str, dict]:
+    """
+    (método, url, kwargs de httpx) para una petición del escenario.
+    """
+    user = fx.user()
+    if name == "login":
+        return "POST", "/auth/login", {"json": {"email": user.email, "password": BENCH_PASSWORD}}
+    if name == "feed":
+        return "GET", "/feed?limit=50", {"headers": fx.auth(user)}
+    if name == "route":
+        # las propias "friends"/"public" o una pública de cualquiera: siempre visible
+        own = fx.routes_by_user.get(user.id, [])
+        pool = own if own and fx.rng.random() < 0.5 else fx.public_routes or own
+        return "GET", f"/routes/{fx.rng.choice(pool)}", {"headers": fx.auth(user)}
+    if name == "create":
+        cols = random_path(np_rng, 1000, int(time.time() * 1000))
+        body = {
+            "name": "bench",
+            "visibility": fx.rng.choice(["private", "friends", "public"]),
+            "path_encoded": base64.b64encode(pathcodec.encode_columns(cols)).decode("ascii"),
+        }
+        return "POST", "/routes", {"json": body, "headers": fx.auth(user)}
+    if name == "search":
+        other = fx.user()
+        q = other.name[: fx.rng.randint(2, 4)]
+        return "GET", f"/users/search?q={q}", {"headers": fx.auth(user)}
+    raise ValueError(name)
+
+
+_SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) quer')
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, fx: Fixtures, n: int, concurrency: int) -> dict:
+    np_rng = np.random.default_rng(fx.rng.randint(0, 2**31))
+    requests = [build_request(name, fx, np_rng) for _ in range(n)]
+    latencies: list[float] = []
+    queries: list[int] = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(method: str, url: str, kwargs: dict) -> None:
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            res = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - t0)
+            if res.status_code >= 400:
+                errors += 1
+            m = _SERVER_TIMING_QUERIES.search(res.headers.get("server-timing", ""))
+            if m:
+                queries.append(int(m.group(1)))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(*req) for req in requests))
+    wall = time.perf_counter() - t0
+
+    ms = np.array(latencies) * 1000
+    return {
+        "requests": n,
+        "errors": errors,
+        "rps": round(n / wall, 1),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "queries_per_req": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def print_report(results: dict) -> None:
+    header = f"{'escenario':<10}{'n':>6}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        q = "-" if r["queries_per_req"] is None else f"{r['queries_per_req']:.1f}"
+        print(
+            f"{name:<10}{r['requests']:>6}{r['errors']:>6}{r['rps']:>9.1f}"
+            f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{q:>9}"
+        )
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    problems = []
+    for name, r in results.items():
+        ref = baseline.get(name)
+        if not ref:
+            continue
+        limit = ref["p95_ms"] * (1 + max_regression)
+        if r["p95_ms"] > limit:
+            problems.append(f"{name}: p95 {r['p95_ms']} ms > {limit:.1f} ms (referencia {ref['p95_ms']} ms)")
+        if r["queries_per_req"] is not None and ref.get("queries_per_req") is not None:
+            if r["queries_per_req"] > ref["queries_per_req"] + QUERY_TOLERANCE:
+                problems.append(
+                    f"{name}: {r['queries_per_req']} consultas/petición (referencia {ref['queries_per_req']})"
+                )
+        if r["errors"] > ref.get("errors", 0):
+            problems.append(f"{name}: {r['errors']} errores (referencia {ref.get('errors', 0)})")
+    return problems
+
+
+async def main_async(args) -> int:
+    rng = random.Random(args.seed)
+    fx = Fixtures(rng)
+    if not args.url:
+        from app.main import app
+
+        if not instrumentation.METRICS_TOKEN:
+            instrumentation.METRICS_TOKEN = secrets.token_urlsafe(16)
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120)
+    else:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120)
+    if instrumentation.METRICS_TOKEN:
+        client.headers["X-Debug-Token"] = instrumentation.METRICS_TOKEN
+
+    results = {}
+    async with client:
+        # calentamiento: cachés (usuarios autenticados, índice de búsqueda),
+        # pool de conexiones... fuera de la medida
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def touch(user):
+            async with sem:
+                await client.get("/me", headers=fx.auth(user))
+
+        await asyncio.gather(*(touch(u) for u in fx.users))
+        for name in args.scenarios:
+            await run_scenario(client, name, fx, min(10, args.requests), args.concurrency)
+        for name in args.scenarios:
+            results[name] = await run_scenario(client, name, fx, args.requests, args.concurrency)
+
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Referencia guardada en", args.save_baseline)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, args.max_regression)
+        if problems:
+            print("\nREGRESIÓN:")
+            for p in problems:
+                print("  -", p)
+            return 1
+        print("\nSin regresiones respecto a", args.baseline)
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de la API")
+    parser.add_argument("--url", help="servidor ya arrancado (por defecto, la app en proceso)")
+    parser.add_argument("--requests", type=int, default=200, help="peticiones por escenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="guardar resultados en este fichero")
+    parser.add_argument("--baseline", help="comparar con esta referencia (modo regresión)")
+    parser.add_argument("--save-baseline", help="guardar los resultados como referencia")
+    parser.add_argument("--max-regression", type=float, default=0.3, help="empeoramiento de p95 tolerado")
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Siembra una BD para el benchmark (SQLite o Postgres local).
+
+    cd backend
+    DATABASE_URL=sqlite:///bench.db python -m bench.seed --users 200 --friends 8 --routes 5
+
+Usuarios bench{i}@example.com con contraseña BENCH_PASSWORD. Se calcula un
+solo hash para todos: sembrar no paga pbkdf2 por usuario. Los paths son
+paseos aleatorios realistas (1 punto/s, ~5 m/s con ruido de GPS y alguna
+parada) de entre --min-points y --max-points puntos.
+
+Las rutas se insertan con sus LODs, estadísticas y geohash como lo haría
+POST /routes y al final se reconstruyen los timelines del feed y el mapa
+de calor.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from app import feed, heatmap, migrations, models, security, simplify, spatial, stats, pathcodec, usersearch, userstats
+from app.db import Base, engine
+
+BENCH_PASSWORD = "benchpass"
+EMAIL_DOMAIN = "example.com"
+
+FIRST_NAMES = [
+    "ana", "carlos", "lucia", "javier", "marta", "pablo", "sofia", "diego",
+    "elena", "sergio", "laura", "andres", "paula", "miguel", "irene", "raul",
+    "clara", "hugo", "noelia", "alvaro", "julia", "ivan", "sara", "marcos",
+]
+
+# ciudades de partida (lat, lon)
+CITIES = [
+    (40.4168, -3.7038), (41.3874, 2.1686), (37.3891, -5.9845),
+    (39.4699, -0.3763), (43.2630, -2.9350), (42.8782, -8.5448),
+]
+
+
+def bench_email(i: int) -> str:
+    return f"bench{i}@{EMAIL_DOMAIN}"
+
+
+def random_path(rng: np.random.Generator, n: int, t0_ms: int) -> dict[str, np.ndarray]:
+    """
+    Columnas de pathcodec para un paseo de n puntos a 1 Hz.
+    """
+    lat0, lon0 = CITIES[rng.integers(len(CITIES))]
+    lat0 += rng.normal(0, 0.05)
+    lon0 += rng.normal(0, 0.05)
+
+    speed = np.clip(rng.normal(5.0, 1.0, n), 0, None)
+    # alguna parada (semáforo, foto...)
+    for start in rng.integers(0, n, size=max(1, n // 2000)):
+        speed[start:start + rng.integers(10, 90)] = 0.0
+
+    heading = np.cumsum(rng.normal(0, 0.08, n)) + rng.uniform(0, 2 * np.pi)
+    step_m = speed  # 1 s por punto
+    dlat = np.degrees(step_m * np.cos(heading) / 6_371_000.0)
+    dlon = np.degrees(step_m * np.sin(heading) / (6_371_000.0 * np.cos(np.radians(lat0))))
+
+    accuracy = np.clip(rng.normal(6, 3, n), 2, 40)
+    jitter = rng.normal(0, 1, (2, n)) * accuracy / 3 / 111_000.0
+    return {
+        "lat": lat0 + np.cumsum(dlat) + jitter[0],
+        "lon": lon0 + np.cumsum(dlon) + jitter[1],
+        "t": (t0_ms + np.arange(n) * 1000).astype(np.float64),
+        "accuracy": np.round(accuracy, 1),
+        "speed": np.round(speed, 2),
+    }
+
+
+def build_route(user_id, cols: dict, name: str, visibility: str) -> models.Route:
+    lods = simplify.encode_lods(cols)
+    route = models.Route(
+        user_id=user_id,
+        name=name,
+        distance_m=0,
+        duration_s=0,
+        path_blob=pathcodec.encode_columns(cols),
+        path_lod_low=lods["low"],
+        path_lod_medium=lods["medium"],
+        visibility=visibility,
+    )
+    stats.apply(route, stats.compute(cols))
+    geo = spatial.route_geo(cols)
+    if geo:
+        spatial.apply(route, geo)
+    return route
+
+
+def wipe(db: Session) -> None:
+    # borra solo lo sembrado (usuarios bench*); el resto cae por CASCADE en
+    # Postgres, en SQLite se borra a mano
+    ids = [u.id for u in db.query(models.User).filter(models.User.email.like(f"bench%@{EMAIL_DOMAIN}"))]
+    if not ids:
+        return
+    for model, column in (
+        (models.FeedEntry, models.FeedEntry.owner_id),
+        (models.FeedEntry, models.FeedEntry.author_id),
+        (models.SegmentEffort, models.SegmentEffort.user_id),
+        (models.UserStatBucket, models.UserStatBucket.user_id),
+        (models.UserStats, models.UserStats.user_id),
+        (models.SyncChange, models.SyncChange.user_id),
+        (models.Segment, models.Segment.user_id),
+        (models.Route, models.Route.user_id),
+        (models.Friend, models.Friend.user_id),
+        (models.Friend, models.Friend.friend_id),
+        (models.FriendRequest, models.FriendRequest.from_user_id),
+        (models.FriendRequest, models.FriendRequest.to_user_id),
+        (models.User, models.User.id),
+    ):
+        db.execute(delete(model).where(column.in_(ids)))
+    db.commit()
+
+
+def seed(users: int, friends: int, routes: int, min_points: int, max_points: int, public_share: float, seed_value: int) -> dict:
+    rng = np.random.default_rng(seed_value)
+    pyrng = random.Random(seed_value)
+
+    Base.metadata.create_all(bind=engine)
+    migrations.run(engine)
+
+    password_hash = security.hash_password(BENCH_PASSWORD)
+    counts = {"users": users, "friendships": 0, "routes": 0, "points": 0}
+
+    with Session(engine) as db:
+        wipe(db)
+
+        user_rows = []
+        for i in range(users):
+            name = f"{pyrng.choice(FIRST_NAMES)}{i}"
+            user_rows.append(models.User(
+                email=bench_email(i),
+                name=name,
+                name_lower=usersearch.normalize(name),
+                password_hash=password_hash,
+            ))
+        db.add_all(user_rows)
+        db.commit()
+        ids = [u.id for u in user_rows]
+
+        pairs = set()
+        for i in range(users):
+            for j in pyrng.sample(range(users), min(friends, users - 1)):
+                if i != j:
+                    pairs.add((min(i, j), max(i, j)))
+        db.add_all(
+            models.Friend(user_id=ids[a], friend_id=ids[b])
+            for i, j in pairs
+            for a, b in ((i, j), (j, i))
+        )
+        db.commit()
+        counts["friendships"] = len(pairs)
+
+        now_ms = int(time.time() * 1000)
+        for i, user_id in enumerate(ids):
+            for k in range(routes):
+                n = int(rng.integers(min_points, max_points + 1))
+                t0 = now_ms - int(rng.integers(1, 90 * 24 * 3600)) * 1000
+                r = rng.random()
+                visibility = "public" if r < public_share else ("friends" if r < 0.8 else "private")
+                db.add(build_route(user_id, random_path(rng, n, t0), f"Ruta {k + 1}", visibility))
+                counts["routes"] += 1
+                counts["points"] += n
+            db.commit()
+
+        feed.rebuild_all(db)
+        heatmap.rebuild(db)
+        userstats.rebuild(db)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Siembra la BD del benchmark")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--friends", type=int, default=8, help="amigos por usuario (aprox.)")
+    parser.add_argument("--routes", type=int, default=5, help="rutas por usuario")
+    parser.add_argument("--min-points", type=int, default=1000)
+    parser.add_argument("--max-points", type=int, default=20000)
+    parser.add_argument("--public-share", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    counts = seed(args.users, args.friends, args.routes, args.min_points, args.max_points, args.public_share, args.seed)
+    print(f"Sembrado en {time.perf_counter() - t0:.1f} s:", counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import numpy as np
+
+from app import stats
+
+
+def _cols(lat, lon, t, speed):
+    n = len(lat)
+    return {
+        "lat": np.asarray(lat, dtype=np.float64),
+        "lon": np.asarray(lon, dtype=np.float64),
+        "t": np.asarray(t, dtype=np.float64),
+        "accuracy": np.full(n, 5.0),
+        "speed": np.asarray(speed, dtype=np.float64),
+    }
+
+
+def test_avg_moving_speed_not_above_max_with_gps_speed():
+    # el GPS dice 5 m/s pero los puntos están a ~12 m por segundo
+    n = 200
+    cols = _cols(40 + np.arange(n) * 1.08e-4, np.full(n, -3.0), np.arange(n) * 1000.0, np.full(n, 5.0))
+    st = stats.compute(cols)
+    assert st.max_speed_ms == 5.0
+    assert 0 < st.avg_moving_speed_ms <= st.max_speed_ms
+
+
+def test_avg_moving_speed_not_above_max_mixed():
+    rng = np.random.default_rng(1)
+    n = 500
+    lat = 40 + np.cumsum(rng.uniform(0, 2e-4, n))
+    t = np.cumsum(rng.uniform(500, 3000, n))
+    speed = np.where(rng.random(n) < 0.5, rng.uniform(0, 10, n), np.nan)
+    st = stats.compute(_cols(lat, np.full(n, -3.0), t, speed))
+    assert st.avg_moving_speed_ms <= st.max_speed_ms
+
+
+def test_avg_moving_speed_from_positions_without_gps_speed():
+    n = 100
+    cols = _cols(40 + np.arange(n) * 9e-5, np.full(n, -3.0), np.arange(n) * 1000.0, np.full(n, np.nan))
+    st = stats.compute(cols)
+    assert abs(st.avg_moving_speed_ms - st.max_speed_ms) < 0.1
+    assert abs(st.avg_moving_speed_ms - 10.0) < 0.1
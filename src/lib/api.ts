@@ -17,6 +17,19 @@ export type FriendRequestOut = {
   from_user_id: string; // UUID
   to_user_id: string; // UUID
   created_at: string; // ISO
+  from_name?: string | null; // solo en incoming/outgoing
+  to_name?: string | null;
+};
+
+export type FriendRequestSendResult = {
+  to_name: string;
+  status: string; // "sent" o el detail del error
+  request: FriendRequestOut | null;
+};
+
+export type FriendRequestActionResult = {
+  id: string;
+  status: string; // "accepted" | "rejected" | "ALREADY_FRIENDS" | "REQUEST_NOT_FOUND"
 };
 
 export type RouteOut = {
@@ -24,6 +37,9 @@ export type RouteOut = {
   name: string;
   distance_m: number;
   duration_s: number;
+  moving_time_s?: number | null; // calculado en el servidor
+  max_speed_ms?: number | null;
+  avg_moving_speed_ms?: number | null;
   visibility: RouteVisibility;
   created_at: string; // ISO
 };
@@ -34,6 +50,9 @@ export type FeedRouteOut = {
   name: string;
   distance_m: number;
   duration_s: number;
+  moving_time_s?: number | null; // calculado en el servidor
+  max_speed_ms?: number | null;
+  avg_moving_speed_ms?: number | null;
   visibility: RouteVisibility;
   created_at: string; // ISO
 };
@@ -44,11 +63,20 @@ export type RouteDetailOut = {
   name: string;
   distance_m: number;
   duration_s: number;
-  path: any[];
+  moving_time_s?: number | null; // calculado en el servidor
+  max_speed_ms?: number | null;
+  avg_moving_speed_ms?: number | null;
+  splits_s?: number[] | null; // segundos por km
+  path: any[] | null; // null si se pidió otro path_format
+  path_polyline?: string | null; // Google encoded polyline (lat/lon)
+  path_encoded?: string | null; // binario compacto del backend (base64)
   visibility: RouteVisibility;
   created_at: string; // ISO
 };
 
+export type PathFormat = "list" | "polyline" | "compact";
+export type PathLod = "low" | "medium" | "full";
+
 export type RouteCreateIn = {
   name: string;
   distance_m: number;
@@ -97,6 +125,21 @@ function isNotAuthenticated(resStatus: number, bodyText: string) {
   return false;
 }
 
+/**
+ * Últimas respuestas GET con ETag: se reenvía If-None-Match y un 304
+ * reutiliza el body guardado (el detalle de una ruta pesa megas).
+ */
+const ETAG_CACHE_MAX = 50;
+const etagCache = new Map<string, { etag: string; text: string }>();
+
+function rememberEtag(key: string, etag: string, text: string) {
+  etagCache.delete(key);
+  etagCache.set(key, { etag, text });
+  if (etagCache.size > ETAG_CACHE_MAX) {
+    etagCache.delete(etagCache.keys().next().value as string);
+  }
+}
+
 export async function apiFetch<T = any>(
   path: string,
   options: RequestInit & { method?: HttpMethod } = {}
@@ -104,18 +147,31 @@ export async function apiFetch<T = any>(
   const token = await AsyncStorage.getItem("access_token");
 
   const url = `${API_URL}${normalizePath(path)}`;
+  const isGet = (options.method ?? "GET") === "GET";
+  // por token: dos usuarios en el mismo móvil no comparten respuestas
+  const cacheKey = `${token ?? ""} ${url}`;
+  const cached = isGet ? etagCache.get(cacheKey) : undefined;
 
   const res = await fetch(url, {
     ...options,
     headers: {
       ...(options.body ? { "Content-Type": "application/json" } : {}),
       ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      ...(cached ? { "If-None-Match": cached.etag } : {}),
       ...(options.headers ?? {}),
     },
   });
 
   // leemos como texto siempre (así el error tiene el body real)
-  const text = await res.text().catch(() => "");
+  const text = res.status === 304 && cached ? cached.text : await res.text().catch(() => "");
+
+  if (res.status === 304 && cached) {
+    const parsed = safeJsonParse(text);
+    return (parsed ?? (text as any)) as T;
+  }
+
+  const etag = res.headers.get("ETag");
+  if (isGet && res.ok && etag) rememberEtag(cacheKey, etag, text);
 
   if (!res.ok) {
     // ✅ si no está autenticado -> error especial + limpiamos token
@@ -140,20 +196,119 @@ export async function apiFetch<T = any>(
 // ----------------------
 // Helpers rutas
 // ----------------------
-export function getMyRoutes() {
-  return apiFetch<RouteOut[]>("/routes/mine", { method: "GET" });
+/**
+ * Sin opciones devuelve todas las rutas. Para paginar pasa `limit` y, en
+ * las siguientes páginas, `before` con feedCursor(último elemento).
+ */
+export function getMyRoutes(opts: { before?: string; limit?: number } = {}) {
+  const params = new URLSearchParams();
+  if (opts.before) params.set("before", opts.before);
+  if (opts.limit) params.set("limit", String(opts.limit));
+  const qs = params.toString();
+  return apiFetch<RouteOut[]>(`/routes/mine${qs ? `?${qs}` : ""}`, { method: "GET" });
 }
 
-export function getPublicRoutes() {
-  return apiFetch<RouteOut[]>("/routes/public", { method: "GET" });
+export type StatBucketOut = {
+  start: string; // YYYY-MM-DD (lunes de la semana / día 1 del mes, UTC)
+  route_count: number;
+  distance_m: number;
+  duration_s: number;
+};
+
+export type PersonalBestOut = {
+  value: number;
+  route_id: string; // UUID
+};
+
+export type UserStatsOut = {
+  route_count: number;
+  total_distance_m: number;
+  total_duration_s: number;
+  total_moving_time_s: number;
+  bests: {
+    distance_m: PersonalBestOut | null;
+    duration_s: PersonalBestOut | null;
+    avg_moving_speed_ms: PersonalBestOut | null;
+  };
+  weeks: StatBucketOut[]; // de la más reciente a la más antigua
+  months: StatBucketOut[];
+  last_route: RouteOut | null;
+};
+
+/** Totales del usuario calculados en el servidor (no hace falta la lista entera). */
+export function getMyStats() {
+  return apiFetch<UserStatsOut>("/me/stats", { method: "GET" });
 }
 
-export function getFeed() {
-  return apiFetch<FeedRouteOut[]>("/feed", { method: "GET" });
+export type PublicRoutesQuery = {
+  // viewport del mapa
+  bbox?: { minLat: number; minLon: number; maxLat: number; maxLon: number };
+  // "rutas cerca de mí" (radius en metros)
+  near?: { lat: number; lon: number; radius?: number };
+  limit?: number;
+};
+
+export function getPublicRoutes(query: PublicRoutesQuery = {}) {
+  const params = new URLSearchParams();
+  if (query.bbox) {
+    const b = query.bbox;
+    params.set("bbox", `${b.minLon},${b.minLat},${b.maxLon},${b.maxLat}`);
+  }
+  if (query.near) {
+    params.set("near", `${query.near.lat},${query.near.lon}`);
+    if (query.near.radius) params.set("radius", String(query.near.radius));
+  }
+  if (query.limit) params.set("limit", String(query.limit));
+  const qs = params.toString();
+  return apiFetch<RouteOut[]>(`/routes/public${qs ? `?${qs}` : ""}`, { method: "GET" });
+}
+
+/**
+ * Feed paginado: para la siguiente página pasa `before` con
+ * feedCursor(último elemento de la página anterior).
+ */
+export function getFeed(opts: { before?: string; limit?: number } = {}) {
+  const params = new URLSearchParams();
+  if (opts.before) params.set("before", opts.before);
+  if (opts.limit) params.set("limit", String(opts.limit));
+  const qs = params.toString();
+  return apiFetch<FeedRouteOut[]>(`/feed${qs ? `?${qs}` : ""}`, { method: "GET" });
+}
+
+export function feedCursor(route: Pick<FeedRouteOut, "id" | "created_at">) {
+  return `${route.created_at},${route.id}`;
+}
+
+/**
+ * lod: "low" (~300 puntos, miniaturas), "medium" (~1500, mapa) o "full".
+ */
+export function getRouteById(
+  routeId: string,
+  opts: { pathFormat?: PathFormat; lod?: PathLod } = {}
+) {
+  const params = new URLSearchParams();
+  if (opts.pathFormat && opts.pathFormat !== "list") params.set("path_format", opts.pathFormat);
+  if (opts.lod && opts.lod !== "full") params.set("lod", opts.lod);
+  const qs = params.toString();
+  return apiFetch<RouteDetailOut>(`/routes/${routeId}${qs ? `?${qs}` : ""}`, { method: "GET" });
 }
 
-export function getRouteById(routeId: string) {
-  return apiFetch<RouteDetailOut>(`/routes/${routeId}`, { method: "GET" });
+/**
+ * Varias rutas en una petición (máx. 100 ids). lod: null -> sin path.
+ * `missing`: ids que no existen o que no puedo ver.
+ */
+export function getRoutesBatch(
+  ids: string[],
+  opts: { pathFormat?: PathFormat; lod?: PathLod | null } = {}
+) {
+  return apiFetch<{ routes: RouteDetailOut[]; missing: string[] }>("/routes/batch", {
+    method: "POST",
+    body: JSON.stringify({
+      ids,
+      path_format: opts.pathFormat ?? "list",
+      lod: opts.lod === undefined ? "full" : opts.lod,
+    }),
+  });
 }
 
 export function createRoute(data: RouteCreateIn) {
@@ -192,6 +347,48 @@ export function deleteRoute(routeId: string) {
   });
 }
 
+// ----------------------
+// Recordings (subida por trozos mientras se graba)
+// ----------------------
+export type RecordingOut = {
+  id: string; // UUID
+  point_count: number;
+  chunk_count: number;
+  distance_m: number;
+  duration_s: number;
+  created_at: string; // ISO
+};
+
+export function openRecording() {
+  return apiFetch<RecordingOut>("/recordings", { method: "POST" });
+}
+
+/**
+ * seq = número de trozo (0, 1, 2...). Si falla se puede reintentar con el
+ * mismo seq: el backend no lo duplica.
+ */
+export function appendRecordingPoints(recordingId: string, seq: number, points: any[]) {
+  return apiFetch<RecordingOut>(`/recordings/${recordingId}/points?seq=${seq}`, {
+    method: "POST",
+    headers: { "Content-Type": "application/x-ndjson" },
+    body: points.map((p) => JSON.stringify(p)).join("\n"),
+  });
+}
+
+export function finalizeRecording(
+  recordingId: string,
+  data: { name: string; visibility?: RouteVisibility }
+) {
+  return apiFetch<RouteOut>(`/recordings/${recordingId}/finalize`, {
+    method: "POST",
+    body: JSON.stringify({ name: data.name, visibility: data.visibility ?? "private" }),
+  });
+}
+
+export function discardRecording(recordingId: string) {
+  return apiFetch<{ status: string }>(`/recordings/${recordingId}`, { method: "DELETE" });
+}
+
 // ----------------------
 // Friend requests
 // ----------------------
@@ -218,10 +415,76 @@ export function sendFriendRequest(username: string) {
   });
 }
 
+export function sendFriendRequests(usernames: string[]) {
+  return apiFetch<FriendRequestSendResult[]>("/friend-requests/bulk", {
+    method: "POST",
+    body: JSON.stringify({ to_names: usernames }),
+  });
+}
+
+export function acceptFriendRequests(requestIds: string[]) {
+  return apiFetch<FriendRequestActionResult[]>("/friend-requests/accept", {
+    method: "POST",
+    body: JSON.stringify({ ids: requestIds }),
+  });
+}
+
+export function rejectFriendRequests(requestIds: string[]) {
+  return apiFetch<FriendRequestActionResult[]>("/friend-requests/reject", {
+    method: "POST",
+    body: JSON.stringify({ ids: requestIds }),
+  });
+}
+
 export function getFriends() {
   return apiFetch<any[]>("/friends", { method: "GET" });
 }
 
+// ----------------------
+// Mapa de calor (tiles PNG para <UrlTile>)
+// ----------------------
+export type HeatTilesOut = {
+  url_template: string; // absoluta, con {z}/{x}/{y} y la clave firmada
+  expires_at: string; // ISO; pedir otra al abrir el mapa
+  min_zoom: number;
+  max_zoom: number; // por encima, el mapa reescala los tiles de este zoom
+};
+
+/**
+ * Las capas de tiles no mandan Authorization: la URL lleva una clave
+ * firmada que da este endpoint (autenticado).
+ */
+export async function getHeatTiles() {
+  const out = await apiFetch<HeatTilesOut>("/tiles/url", { method: "GET" });
+  return { ...out, url_template: `${API_URL}${out.url_template}` };
+}
+
+// ----------------------
+// Sincronización incremental
+// ----------------------
+export type SyncOut = {
+  token: string; // pasar como `since` en la siguiente llamada
+  reset: boolean; // true: estado completo, reemplaza lo guardado en local
+  has_more: boolean; // quedan cambios: volver a llamar con el nuevo token
+  routes: RouteOut[];
+  deleted_routes: string[];
+  feed: FeedRouteOut[];
+  deleted_feed: string[];
+  friends: { id: string; name: string }[];
+  deleted_friends: string[];
+  friend_requests: FriendRequestOut[]; // recibidas y enviadas
+  deleted_friend_requests: string[];
+};
+
+/**
+ * Sin `since` devuelve una instantánea; con el `token` guardado, solo lo
+ * que ha cambiado desde entonces.
+ */
+export function syncChanges(since?: string | null) {
+  const qs = since ? `?since=${encodeURIComponent(since)}` : "";
+  return apiFetch<SyncOut>(`/sync${qs}`, { method: "GET" });
+}
+
 export function isAuthError(e: unknown) {
   return e instanceof AuthError || (e as any)?.name === "AuthError";
 }